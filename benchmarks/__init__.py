@@ -0,0 +1,8 @@
+# benchmarks
+#
+# Reproduzierbare Benchmarks für Ingest, Query, Update/Delete, SQLite-Checkup und Rebuild:
+#   python -m benchmarks --scale 10k [--out result.json] [--save_baseline]
+#
+#   corpus.py         synthetische Registry-Zeilen im Stil von emails_dump.jsonl (Seed-deterministisch)
+#   hash_embedder.py  deterministischer Hash-Embedder (kein Model-Download, misst unseren Code statt torch)
+#   run.py            Ablauf, Messung (Durchsatz, p50/p95/p99) und Vergleich mit benchmarks/baselines/<scale>.json
@@ -0,0 +1,79 @@
+# corpus.py
+#
+# Synthetische Registry-Zeilen wie in emails_dump.jsonl / id_registry
+# (id, collection, entity_type, primary_value, metadata, timestamp, source, import_batch).
+# Gleicher Seed -> gleicher Korpus. Ein kleiner Anteil Duplikate (defect_rate) gibt dem
+# SQLite-Checkup realistische Arbeit.
+#
+#   python -m benchmarks.corpus --rows 100000 --out corpus_100k.jsonl
+
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1M": 1_000_000}
+SOURCES = ("informant", "leak", "crawler", "osint", "manual")
+DOMAINS = ("beispiel.com", "mail.de", "posteo.de", "gmx.net", "web.de", "proton.me")
+FIRST_NAMES = ("anna", "ben", "clara", "david", "eva", "felix", "greta", "hans", "ida", "jonas", "karl", "lena", "max", "nina", "otto", "paula")
+LAST_NAMES = ("mueller", "schmidt", "schneider", "fischer", "weber", "meyer", "wagner", "becker", "schulz", "hoffmann", "koch", "richter")
+WORDS = ("konto", "zugang", "passwort", "server", "leak", "rechnung", "adresse", "treffen", "lieferung", "bericht",
+         "quelle", "hinweis", "datei", "archiv", "netzwerk", "telefon", "kontakt", "firma", "vertrag", "zahlung")
+EPOCH = datetime(2023, 1, 1)
+
+
+def parse_scale(value):
+    """'10k', '100k', '1M' oder eine Zahl -> Anzahl Zeilen."""
+    if value in SCALES:
+        return SCALES[value]
+    return int(float(value.lower().replace("k", "e3").replace("m", "e6")))
+
+def _primary_value(rng, entity_type, i):
+    if entity_type == "EMAIL":
+        return f"{rng.choice(FIRST_NAMES)}.{rng.choice(LAST_NAMES)}{i}@{rng.choice(DOMAINS)}"
+    words = rng.choices(WORDS, k=rng.randint(5, 12))
+    return f"{' '.join(words).capitalize()} #{i}"
+
+def generate(n, seed=0, collection="bench", defect_rate=0.01):
+    """Liefert n Zeilen als Dicts (metadata als Dict); deterministisch für (n, seed, collection, defect_rate)."""
+    rng = random.Random(seed)
+    prefix = collection.upper()
+    seen = []
+    for i in range(n):
+        source = rng.choice(SOURCES)
+        entity_type = "EMAIL" if rng.random() < 0.7 else "NOTE"
+        if seen and rng.random() < defect_rate:
+            entity_type, primary_value = rng.choice(seen)  # Duplikat
+        else:
+            primary_value = _primary_value(rng, entity_type, i)
+            if len(seen) < 1000:
+                seen.append((entity_type, primary_value))
+        ts = EPOCH + timedelta(seconds=rng.randrange(3 * 365 * 86400))
+        yield {
+            "id": f"{prefix}_{entity_type}_{source}_{ts:%Y%m%d}_{i:012d}",
+            "collection": collection,
+            "entity_type": entity_type,
+            "primary_value": primary_value,
+            "metadata": {"quelle": source, "timestamp": ts.date().isoformat(), "confidence": round(rng.random(), 2)},
+            "timestamp": ts.isoformat(),
+            "source": source,
+            "import_batch": f"bench_{i // 10000:04d}",
+        }
+
+def write_jsonl(path, n, seed=0, collection="bench", defect_rate=0.01):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in generate(n, seed, collection, defect_rate):
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetischen Benchmark-Korpus (JSONL im Registry-Format) schreiben.")
+    parser.add_argument("--rows", default="10k", help="Anzahl Zeilen: 10k, 100k, 1M oder Zahl (default: 10k)")
+    parser.add_argument("--seed", type=int, default=0, help="Zufalls-Seed (default: 0)")
+    parser.add_argument("--collection", default="bench", help="Collection-Name (default: bench)")
+    parser.add_argument("--defect_rate", type=float, default=0.01, help="Anteil Duplikate (default: 0.01)")
+    parser.add_argument("--out", required=True, help="Ziel-Datei (.jsonl)")
+    args = parser.parse_args()
+    write_jsonl(args.out, parse_scale(args.rows), args.seed, args.collection, args.defect_rate)
+    print(f"{args.out} geschrieben.")
@@ -0,0 +1,46 @@
+# hash_embedder.py
+#
+# Deterministischer Embedder für Benchmarks: Wörter und Zeichen-Trigramme werden per CRC32
+# (prozessunabhängig, anders als hash()) auf Dimensionen mit Vorzeichen abgebildet und
+# L2-normiert. Ähnliche Texte landen nahe beieinander, die Kosten sind vernachlässigbar
+# gegenüber FAISS/SQLite. Gleiche Schnittstelle wie SentenceTransformer (encode,
+# get_sentence_embedding_dimension), kann per db_embedding.configure(model=...) gesetzt werden.
+
+import re
+import zlib
+
+import numpy as np
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def _features(text):
+    text = text.lower()
+    words = _TOKEN.findall(text)
+    grams = [text[i:i + 3] for i in range(max(0, len(text) - 2))]
+    return words + grams
+
+
+class HashEmbedder:
+    def __init__(self, dim=384):
+        self.dim = int(dim)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=None, show_progress_bar=False, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in _features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                rows.append(row)
+                cols.append(h % self.dim)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        if rows:
+            np.add.at(out, (np.asarray(rows), np.asarray(cols)), np.asarray(signs, dtype="float32"))
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        out /= np.where(norms > 0, norms, 1.0)
+        return out[0] if single else out
@@ -0,0 +1,367 @@
+# run.py
+#
+# Benchmark-Lauf in einem eigenen Arbeitsverzeichnis (Registry, Indizes, Logs; das Repo bleibt
+# unberührt) mit dem Hash-Embedder statt des echten Models:
+#   1. batch_insert   Ingest des Korpus in Blöcken (--batch_size)
+#   2. train          nur bei IVF/PQ: Training + Neuaufbau (train_collection)
+#   3. add            Einzel-Inserts (add_document)
+#   4. query_k<k>     Einzel-Query pro k (search_batch mit einer Query)
+#   5. batch_query_k<k>  Batches von --query_batch Queries
+#   6. update/delete  update_document / delete_document
+#   7. sqlite_checkup voller Checkup (inkl. eingestreuter Defekte)
+#   8. rebuild        rebuild_faiss_index der ganzen Collection
+# Ergebnis als JSON (Durchsatz, p50/p95/p99/mean in ms) und Vergleich mit
+# benchmarks/baselines/<scale>.json (--baseline); --save_baseline legt den Lauf dort ab.
+#
+#   python -m benchmarks --scale 100k --out bench_100k.json
+#   python -m benchmarks --scale 10k --save_baseline
+#
+# Baselines (eingecheckt: baselines/10k.json) sind maschinenabhängig; meta nennt Commit, CPU,
+# Python-/FAISS-/NumPy-Version. Auffrischen nach gewollten Performance-Änderungen oder beim
+# Wechsel der Referenzmaschine: auf der Referenzmaschine ohne Last
+#   python -m benchmarks --scale 10k --save_baseline
+# laufen lassen und baselines/10k.json mit der Änderung committen. Auf anderen Maschinen nur
+# mit großzügiger --tolerance vergleichen (Einzelwerte schwanken dort leicht um 10-20 %).
+#
+# 1M mit Flat und dim 384: ca. 1,5 GB Vektoren im Index plus Embeddings beim Rebuild
+# (--dim 128 oder --index_type IVFPQ für kleinere Maschinen).
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks import corpus
+from benchmarks.hash_embedder import HashEmbedder
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(REPO_ROOT, "benchmarks", "baselines")
+COLLECTION = "bench"
+DEFAULT_K = "1,10,50"
+TOLERANCE = 0.10  # relative Verschlechterung, ab der ein Vergleich als Regression gilt
+
+
+def summarize(latencies, items=None):
+    """Kennzahlen einer Messreihe (Sekunden pro Operation); items: verarbeitete Einheiten (default: Operationen)."""
+    lat = np.asarray(latencies, dtype="float64")
+    total = float(lat.sum())
+    items = len(lat) if items is None else items
+    p50, p95, p99 = np.percentile(lat, [50, 95, 99]) if len(lat) else (0.0, 0.0, 0.0)
+    return {
+        "n": len(lat),
+        "items": items,
+        "total_s": round(total, 4),
+        "throughput_per_s": round(items / total, 2) if total else None,
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "p99_ms": round(p99 * 1000, 3),
+        "mean_ms": round(float(lat.mean()) * 1000, 3) if len(lat) else 0.0,
+    }
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _prepare_environment(workdir, dim):
+    """Arbeitsverzeichnis + Umgebung setzen, dann die Broker-Module importieren (lesen BROKER_* beim Import)."""
+    os.environ.update({
+        "BROKER_INDEX_DIR": workdir,
+        "BROKER_EMBED_CACHE": "",
+        "BROKER_AUDIT_LOG": os.path.join(workdir, "audit.log"),
+        "BROKER_EVENT_LOG": os.path.join(workdir, "shadowbroker_gateway.log"),
+        "BROKER_LOG_CONSOLE": "0",
+    })
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    os.chdir(workdir)
+    import db_embedding
+    # Vor db_cleanup/db_faiss_gateway: die holen sich die Engine beim Import
+    engine = db_embedding.configure(model_name=f"hash-{dim}", model=HashEmbedder(dim), cache=None)
+    import db_id_manager
+    db_id_manager.REGISTRY_DB = os.path.join(workdir, "broker_registry.db")
+    db_id_manager.setup_registry()
+    return engine
+
+def _args(**kwargs):
+    return argparse.Namespace(**kwargs)
+
+def _query_texts(rng, rows, n):
+    """Queries aus Korpus-Werten (leicht abgewandelt) und freien Wortfolgen."""
+    out = []
+    for _ in range(n):
+        if rows and rng.random() < 0.7:
+            out.append(rng.choice(rows)["primary_value"].split("@")[0].replace(".", " "))
+        else:
+            out.append(" ".join(rng.choices(corpus.WORDS, k=rng.randint(2, 6))))
+    return out
+
+def _inject_defects(rate, seed):
+    """Ungültige Metadaten (Python-Repr) und Zeitstempel in der Zukunft für den Checkup (nicht gemessen)."""
+    import db_id_manager
+    if rate <= 0:
+        return 0
+    step = max(1, int(1 / rate))
+    with db_id_manager.transaction() as c:
+        c.execute(f"UPDATE id_registry SET metadata = '{{''quelle'': ''bench'', ''seed'': {int(seed)}}}' WHERE rowid % {step} = 1")
+        n = c.rowcount
+        c.execute(f"UPDATE id_registry SET timestamp = '2999-01-01T00:00:00' WHERE rowid % {step} = 2")
+        return n + c.rowcount
+
+def run(n_rows, dim=384, index_type=None, seed=0, samples=200, ks=(1, 10, 50), query_batch=32,
+        batch_size=1000, defect_rate=0.01, workdir=None, log=print):
+    """Führt alle Benchmarks aus und gibt das Ergebnis-Dict (meta + results) zurück."""
+    own_workdir = workdir is None
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix="broker_bench_"))
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    engine = _prepare_environment(workdir, dim)
+    import db_batch_insert
+    import db_cleanup
+    import db_collection_management
+    import db_faiss_gateway
+    import db_faiss_index
+    import db_id_manager
+    import db_index_manager
+    import db_logger
+    import db_sqlite_checkup
+
+    rng = random.Random(seed)
+    spec = db_faiss_index.normalize_spec({"type": index_type}) if index_type else None
+    results = {}
+    try:
+        db_collection_management.create_collection(COLLECTION, dim, index_spec=spec)
+        index_file = db_index_manager.index_path(COLLECTION)
+
+        # 1. Ingest
+        log(f"batch_insert: {n_rows} Zeilen ...")
+        latencies = []
+        sample_rows = []
+        chunk = []
+        def flush_chunk(chunk):
+            index, _ = db_faiss_gateway.load_or_create_faiss_index(COLLECTION, dim)
+            by_type = {}
+            for row in chunk:
+                by_type.setdefault(row["entity_type"], []).append(row)
+            start = time.perf_counter()
+            for entity_type, rows in by_type.items():
+                db_batch_insert.batch_insert(
+                    index, [r["primary_value"] for r in rows], COLLECTION, entity_type=entity_type,
+                    metadatas=[r["metadata"] for r in rows], import_batch=rows[0]["import_batch"],
+                    embedding_model=engine, index_file=index_file)
+            db_faiss_gateway.journal_written(index, index_file, COLLECTION)
+            latencies.append(time.perf_counter() - start)
+        for row in corpus.generate(n_rows, seed, COLLECTION, defect_rate):
+            chunk.append(row)
+            if len(sample_rows) < 10000:
+                sample_rows.append(row)
+            if len(chunk) >= batch_size:
+                flush_chunk(chunk)
+                chunk = []
+        if chunk:
+            flush_chunk(chunk)
+        results["batch_insert"] = summarize(latencies, n_rows)
+
+        # 2. Training (IVF/PQ)
+        if spec and db_faiss_index.needs_training(spec):
+            log("train ...")
+            seconds, _ = _timed(db_collection_management.train_collection, COLLECTION, dim)
+            results["train"] = summarize([seconds], n_rows)
+
+        sink = io.StringIO()
+        # 3. Einzel-Inserts
+        log(f"add: {samples} ...")
+        latencies = []
+        with contextlib.redirect_stdout(sink):
+            for i in range(samples):
+                args = _args(collection=COLLECTION, text=f"bench.add{i}@{rng.choice(corpus.DOMAINS)}",
+                             metadata=json.dumps({"quelle": "bench"}), entity_type="EMAIL")
+                latencies.append(_timed(db_faiss_gateway.add_document, args, engine)[0])
+        results["add"] = summarize(latencies)
+
+        # 4./5. Queries (Warmup: Index laden/mmap, erste Registry-Abfragen)
+        db_faiss_gateway.search_batch(["warmup"], [COLLECTION], n=1, embedding_model=engine)
+        for k in ks:
+            log(f"query k={k}: {samples} einzeln, {max(1, samples // query_batch)} x {query_batch} im Batch ...")
+            queries = _query_texts(rng, sample_rows, samples)
+            latencies = [_timed(db_faiss_gateway.search_batch, [q], [COLLECTION], n=k, embedding_model=engine)[0] for q in queries]
+            results[f"query_k{k}"] = summarize(latencies)
+            batches = max(1, samples // query_batch)
+            latencies = []
+            for _ in range(batches):
+                batch = _query_texts(rng, sample_rows, query_batch)
+                latencies.append(_timed(db_faiss_gateway.search_batch, batch, [COLLECTION], n=k, embedding_model=engine)[0])
+            results[f"batch_query_k{k}"] = summarize(latencies, batches * query_batch)
+
+        # 6. Update/Delete auf zufälligen bestehenden Einträgen
+        ids = [row[0] for row in db_id_manager.list_vektor_ids(COLLECTION)]
+        targets = rng.sample(ids, min(len(ids), 2 * samples))
+        updates, deletes = targets[:len(targets) // 2], targets[len(targets) // 2:]
+        log(f"update: {len(updates)}, delete: {len(deletes)} ...")
+        with contextlib.redirect_stdout(sink):
+            latencies = [_timed(db_faiss_gateway.update_document,
+                                _args(collection=COLLECTION, id=doc_id, text=f"aktualisiert {i} {rng.choice(corpus.WORDS)}",
+                                      metadata=None, entity_type=None), engine)[0]
+                         for i, doc_id in enumerate(updates)]
+            results["update"] = summarize(latencies)
+            latencies = [_timed(db_faiss_gateway.delete_document, _args(collection=COLLECTION, id=doc_id))[0] for doc_id in deletes]
+            results["delete"] = summarize(latencies)
+
+        # 7. SQLite-Checkup
+        injected = _inject_defects(defect_rate, seed)
+        log(f"sqlite_checkup ({injected} eingestreute Defekte) ...")
+        seconds, report = _timed(db_sqlite_checkup.sqlite_checkup, time_budget=None)
+        results["sqlite_checkup"] = summarize([seconds], db_id_manager.count_by_collection(COLLECTION))
+        results["sqlite_checkup"]["findings"] = {rule: n for rule, n in report.counts.items() if n}
+
+        # 8. Rebuild
+        n_registry = db_id_manager.count_by_collection(COLLECTION)
+        log(f"rebuild: {n_registry} Einträge ...")
+        seconds, _ = _timed(db_cleanup.rebuild_faiss_index, COLLECTION, index_file, dim)
+        results["rebuild"] = summarize([seconds], n_registry)
+    finally:
+        db_logger.flush()
+        db_id_manager.close_connection()
+        db_index_manager.get_manager().clear()
+        os.chdir(cwd)
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    import faiss
+    return {
+        "meta": {
+            "rows": n_rows,
+            "dim": dim,
+            "index_type": (spec or {"type": "Flat"})["type"],
+            "seed": seed,
+            "samples": samples,
+            "query_batch": query_batch,
+            "batch_size": batch_size,
+            "defect_rate": defect_rate,
+            "embedder": "hash",
+            "git_commit": _git_commit(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "faiss": getattr(faiss, "__version__", None),
+            "numpy": np.__version__,
+        },
+        "results": results,
+    }
+
+def compare(current, baseline, tolerance=TOLERANCE):
+    """
+    Vergleich pro Benchmark mit der Baseline: Latenzen niedriger = besser, Durchsatz höher = besser.
+    regression: Durchsatz, p50 oder p95 um mehr als tolerance schlechter (p99 nur informativ,
+    bei wenigen Messungen zu verrauscht); regressed nennt die betroffenen Kennzahlen.
+    """
+    out = {}
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        entry = {"regression": False, "regressed": []}
+        for metric, higher_is_better, gated in (("throughput_per_s", True, True), ("p50_ms", False, True),
+                                                ("p95_ms", False, True), ("p99_ms", False, False)):
+            b, c = base.get(metric), cur.get(metric)
+            if not b or c is None:
+                continue
+            change = (c - b) / b
+            worse = -change if higher_is_better else change
+            entry[metric] = {"baseline": b, "current": c, "change_pct": round(change * 100, 1)}
+            if gated and worse > tolerance:
+                entry["regressed"].append(metric)
+        entry["regression"] = bool(entry["regressed"])
+        out[name] = entry
+    return out
+
+def format_table(result):
+    lines = [f"{'Benchmark':<20} {'n':>6} {'Durchsatz/s':>12} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}  Vergleich"]
+    comparison = result.get("comparison", {})
+    for name, r in result["results"].items():
+        cmp = comparison.get(name)
+        note = ""
+        if cmp and "p95_ms" in cmp:
+            note = f"p95 {cmp['p95_ms']['change_pct']:+.1f}%"
+            if cmp["regression"]:
+                note += " REGRESSION (" + ", ".join(f"{m} {cmp[m]['change_pct']:+.1f}%" for m in cmp["regressed"]) + ")"
+        lines.append(f"{name:<20} {r['n']:>6} {r['throughput_per_s'] or 0:>12.1f} {r['p50_ms']:>10.3f} {r['p95_ms']:>10.3f} {r['p99_ms']:>10.3f}  {note}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Broker-Benchmarks: Ingest, Query, Update/Delete, Checkup, Rebuild (Hash-Embedder, eigenes Arbeitsverzeichnis).")
+    parser.add_argument("--scale", default="10k", help="Korpusgröße: 10k, 100k, 1M oder Zahl (default: 10k)")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding-Dimension (default: 384 wie MiniLM)")
+    parser.add_argument("--index_type", help="Index-Typ der Collection (default: Flat)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed für Korpus und Queries (default: 0)")
+    parser.add_argument("--samples", type=int, default=200, help="Messungen für add/update/delete/Einzel-Query (default: 200)")
+    parser.add_argument("--k", default=DEFAULT_K, help=f"Trefferzahlen für Queries, kommagetrennt (default: {DEFAULT_K})")
+    parser.add_argument("--query_batch", type=int, default=32, help="Queries pro Batch-Query (default: 32)")
+    parser.add_argument("--batch_size", type=int, default=1000, help="Zeilen pro batch_insert beim Ingest (default: 1000)")
+    parser.add_argument("--defect_rate", type=float, default=0.01, help="Anteil Duplikate/Defekte für den Checkup (default: 0.01)")
+    parser.add_argument("--workdir", help="Arbeitsverzeichnis behalten statt Temp-Verzeichnis")
+    parser.add_argument("--out", help="Ergebnis-JSON in diese Datei (default: stdout)")
+    parser.add_argument("--baseline", help="Baseline-JSON zum Vergleich (default: benchmarks/baselines/<scale>.json, falls vorhanden)")
+    parser.add_argument("--save_baseline", action="store_true", help="Ergebnis als neue Baseline für diese Skala speichern")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help=f"Erlaubte relative Verschlechterung (default: {TOLERANCE})")
+    parser.add_argument("--fail_on_regression", action="store_true", help="Exit-Code 1 bei Regression gegenüber der Baseline")
+    args = parser.parse_args(argv)
+
+    log = lambda msg: print(msg, file=sys.stderr)
+    out = os.path.abspath(args.out) if args.out else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else os.path.join(BASELINE_DIR, f"{args.scale}.json")
+    result = run(corpus.parse_scale(args.scale), dim=args.dim, index_type=args.index_type, seed=args.seed,
+                 samples=args.samples, ks=[int(k) for k in args.k.split(",") if k.strip()],
+                 query_batch=args.query_batch, batch_size=args.batch_size, defect_rate=args.defect_rate,
+                 workdir=args.workdir, log=log)
+    result["meta"]["scale"] = args.scale
+
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        result["baseline"] = {"file": baseline_path, "git_commit": baseline.get("meta", {}).get("git_commit"),
+                              "created": baseline.get("meta", {}).get("created")}
+        result["comparison"] = compare(result, baseline, args.tolerance)
+    log("\n" + format_table(result))
+
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        log(f"Ergebnis: {out}")
+    else:
+        print(text)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f"{args.scale}.json"), "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        log(f"Baseline gespeichert: {os.path.join(BASELINE_DIR, f'{args.scale}.json')}")
+    regressions = [name for name, entry in result.get("comparison", {}).items() if entry["regression"]]
+    if regressions:
+        log(f"Regression gegenüber Baseline: {', '.join(regressions)}")
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
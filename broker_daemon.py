@@ -1,26 +1,24 @@
+import functools
 import threading
 import os
 import time
 import json
 import math
 import tkinter as tk
-from datetime import datetime
 from PIL import Image, ImageTk, ImageEnhance
 
 from db_sqlite_checkup import sqlite_checkup
-from db_cleanup import rebuild_faiss_index
-from db_healthchecks import registry_healthcheck, faiss_healthcheck, db_stats
+from db_cleanup import repair_faiss_index, reindex_changes
+from db_healthchecks import registry_healthcheck, faiss_healthcheck, db_stats, update_collection_gauges
+import db_id_manager
+import db_index_manager
+import db_logger
+import db_metrics
 
-AUDIT_LOG = "audit.log"
 CONFIG_FILE = "daemon_config.json"
+METRICS_PORT = int(os.environ.get("BROKER_DAEMON_METRICS_PORT", "8766"))  # /metrics des Daemons, 0 = aus
 
-def log_audit(msg, level="INFO"):
-    now = datetime.now().isoformat(timespec="seconds")
-    pid = os.getpid()
-    line = f"{now} [{level}] [PID:{pid}] {msg}"
-    with open(AUDIT_LOG, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
-    #print(line)
+log_audit = db_logger.audit_logger("INFO")
 
 def load_config():
     with open(CONFIG_FILE, encoding="utf-8") as f:
@@ -98,25 +96,10 @@ class BrokerDaemon(threading.Thread):
 
     def run(self):
         log_audit("BrokerDaemon gestartet.", "START")
+        start_metrics_endpoint(self.collections)
         while self.running:
             try:
-                for coll in self.collections:
-                    name = coll["name"]
-                    idxfile = coll["index_file"]
-                    reg_ok, reg_count = registry_healthcheck(name)
-                    idx_ok, idx_count = faiss_healthcheck(idxfile)
-                    log_audit(f"Healthcheck für Collection '{name}': Registry OK={reg_ok}, N={reg_count} | Index OK={idx_ok}, V={idx_count}", "AUDIT")
-                    # Konsistenz-Check
-                    sqlite_checkup()
-                    #log_audit(f"SQLite Checkup abgeschlossen.", "CLEANUP")
-                    if reg_count != idx_count:
-                        log_audit(f"KONSISTENZPROBLEM in '{name}': Registry({reg_count}) != Index({idx_count})", "WARNING")
-                        log_audit(f"Starte Cleanup/Rebuild...", "ACTION")
-                        n_new = rebuild_faiss_index(name, idxfile)
-                        log_audit(f"Cleanup abgeschlossen. {n_new} Einträge neu indiziert.", "SUCCESS")
-                # Alle Collections: Stats loggen
-                stats = db_stats()
-                log_audit(f"Stats: {stats}", "STATS")
+                run_cycle(self.collections)
                 time.sleep(self.interval)
             except Exception as e:
                 log_audit(f"Daemon-Fehler: {e}", "ERROR")
@@ -126,6 +109,73 @@ class BrokerDaemon(threading.Thread):
         self.running = False
         log_audit("BrokerDaemon gestoppt.", "STOP")
 
+def check_collection(name, idxfile):
+    """
+    Inkrementeller Konsistenz-Check einer Collection anhand des Änderungsprotokolls:
+    Ohne neue Registry-Änderungen und bei unverändertem Index passiert nichts.
+    Sonst werden nur die seit dem letzten Checkpoint (beim ersten Lauf: alle protokollierten)
+    geänderten Zeilen gegen den Index geprüft und bei Bedarf neu indiziert, ersetzte Zeilen
+    neu embeddet; verbleibende Abweichungen behebt die diff-basierte Reparatur.
+    """
+    upto_seq = db_id_manager.current_change_seq()
+    checkpoint = db_id_manager.get_checkpoint(name)
+    idx_mtime = os.path.getmtime(idxfile) if os.path.exists(idxfile) else None
+    # Ohne Checkpoint (erster Check) alle noch protokollierten Änderungen: nur sie zeigen
+    # ersetzte Zeilen, deren Vektor noch zum alten Text gehört
+    changes = db_id_manager.changes_since(name, checkpoint["seq"] if checkpoint is not None else 0, upto_seq)
+    if checkpoint is not None and not changes and checkpoint["index_mtime"] == idx_mtime:
+        log_audit(f"Collection '{name}' unverändert seit {checkpoint['checked_at']} (seq {checkpoint['seq']}).", "AUDIT")
+        return
+    if changes:
+        # Nur die geänderten Zeilen gegen den Index prüfen und fehlende/verwaiste Vektoren korrigieren
+        n_new = reindex_changes(name, idxfile, changes)
+        if n_new:
+            log_audit(f"Inkrementeller Abgleich für '{name}': {n_new} Einträge neu indiziert ({len(changes)} Änderungen).", "SUCCESS")
+    reg_ok, reg_count = registry_healthcheck(name)
+    idx_ok, idx_count = faiss_healthcheck(idxfile)
+    log_audit(f"Healthcheck für Collection '{name}': Registry OK={reg_ok}, N={reg_count} | Index OK={idx_ok}, V={idx_count} | {len(changes)} Änderungen", "AUDIT")
+    if reg_count != idx_count:
+        log_audit(f"KONSISTENZPROBLEM in '{name}': Registry({reg_count}) != Index({idx_count})", "WARNING")
+        log_audit(f"Starte Reparatur (Diff Registry/Index)...", "ACTION")
+        n_removed, n_new = repair_faiss_index(name, idxfile)
+        idx_ok, idx_count = faiss_healthcheck(idxfile)
+        log_audit(f"Reparatur abgeschlossen. {n_removed} verwaiste Vektoren entfernt, {n_new} Einträge neu indiziert.", "SUCCESS")
+    db_id_manager.set_checkpoint(name, upto_seq, os.path.getmtime(idxfile) if os.path.exists(idxfile) else None, idx_count)
+    db_id_manager.prune_changes(name, upto_seq)
+
+def _index_file(coll):
+    # index_file in der Config optional, sonst aus BROKER_INDEX_DIR
+    return coll.get("index_file") or db_index_manager.index_path(coll["name"])
+
+def start_metrics_endpoint(collections, port=METRICS_PORT):
+    """/metrics des Daemons (Zykluszeiten, Rebuild-Dauern, Gauges der konfigurierten Collections)."""
+    if not port:
+        return None
+    db_metrics.register_collector(functools.partial(
+        update_collection_gauges, [(coll["name"], _index_file(coll)) for coll in collections]))
+    try:
+        httpd = db_metrics.serve_in_background(port)
+    except OSError as e:
+        log_audit(f"Metrik-Endpunkt auf Port {port} nicht gestartet: {e}", "WARN")
+        return None
+    log_audit(f"Metrik-Endpunkt: http://127.0.0.1:{port}/metrics", "START")
+    return httpd
+
+@db_metrics.timed(db_metrics.DAEMON_CYCLE_SECONDS, span="daemon")
+def run_cycle(collections):
+    """Ein Daemon-Durchlauf: globaler SQLite-Checkup (einmal), dann inkrementeller Check pro Collection."""
+    report = sqlite_checkup()
+    log_audit(f"SQLite Checkup abgeschlossen ({report.duration:.2f}s).", "CLEANUP")
+    for coll in collections:
+        check_collection(coll["name"], _index_file(coll))
+    # Änderungsprotokoll auch für nicht konfigurierte Collections kürzen
+    pruned = db_id_manager.prune_change_log()
+    if pruned:
+        log_audit(f"Änderungsprotokoll: {pruned} abgearbeitete/überzählige Einträge entfernt.", "CLEANUP")
+    # Alle Collections: Stats loggen
+    stats = db_stats()
+    log_audit(f"Stats: {stats}", "STATS")
+
 def start_daemon_from_config(interval=300):
     try:
         collections = load_config()
@@ -153,21 +203,7 @@ if __name__ == "__main__":
         # Run the daemon logic only once
         log_audit("BrokerDaemon (manual --once) gestartet.", "START")
         try:
-            for coll in collections:
-                name = coll["name"]
-                idxfile = coll["index_file"]
-                reg_ok, reg_count = registry_healthcheck(name)
-                idx_ok, idx_count = faiss_healthcheck(idxfile)
-                log_audit(f"Healthcheck für Collection '{name}': Registry OK={reg_ok}, N={reg_count} | Index OK={idx_ok}, V={idx_count}", "AUDIT")
-                sqlite_checkup()
-                log_audit(f"SQLite Checkup abgeschlossen.", "CLEANUP")
-                if reg_count != idx_count:
-                    log_audit(f"KONSISTENZPROBLEM in '{name}': Registry({reg_count}) != Index({idx_count})", "WARNING")
-                    log_audit(f"Starte Cleanup/Rebuild...", "ACTION")
-                    n_new = rebuild_faiss_index(name, idxfile)
-                    log_audit(f"Cleanup abgeschlossen. {n_new} Einträge neu indiziert.", "SUCCESS")
-            stats = db_stats()
-            log_audit(f"Stats: {stats}", "STATS")
+            run_cycle(collections)
         except Exception as e:
             log_audit(f"Daemon-Fehler: {e}", "ERROR")
         log_audit("BrokerDaemon (manual --once) beendet.", "STOP")
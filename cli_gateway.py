@@ -15,9 +15,9 @@ from db_faiss_gateway import (
     load_or_create_faiss_index
 )
 from db_id_manager import list_all, find_by_collection
-from db_export_import import export_registry_and_vectors, import_registry_and_vectors
+from db_export_import import export_collection, import_collection
 from db_batch_insert import batch_insert
-from sentence_transformers import SentenceTransformer
+import db_embedding
 
 # ==== Farbschema / Deepsea-Style ====
 style = Style.from_dict({
@@ -49,8 +49,7 @@ COMMANDS = {
 }
 COMMAND_COMPLETER = WordCompleter(COMMANDS.keys(), ignore_case=True)
 
-MODEL_NAME = "all-MiniLM-L6-v2"
-EMBEDDING_MODEL = SentenceTransformer(MODEL_NAME)
+EMBEDDING_MODEL = db_embedding.get_engine()
 INDEX_DIR = "./faiss_indices"
 
 def print_welcome():
@@ -84,11 +83,15 @@ def cli_query():
     collection = Prompt.ask("[prompt]Collection[/prompt]")
     query = Prompt.ask("[prompt]Suchtext[/prompt]")
     n = int(Prompt.ask("[prompt]Anzahl Ergebnisse[/prompt]", default="3"))
+    source = Prompt.ask("[prompt]Filter Quelle (optional)[/prompt]", default="")
+    since = Prompt.ask("[prompt]Filter ab Zeitstempel (ISO, optional)[/prompt]", default="")
     class Args: pass
     args = Args()
     args.collection = collection
     args.query = query
     args.n = n
+    args.source = source or None
+    args.since = since or None
     try:
         query_collection(args, EMBEDDING_MODEL)
     except Exception as e:
@@ -138,29 +141,29 @@ def cli_batch_insert():
             collection, EMBEDDING_MODEL.get_sentence_embedding_dimension()
         )
         batch_insert(index, json.loads(texts), collection,
-                     metadatas=json.loads(metadatas) if metadatas else None)
+                     metadatas=json.loads(metadatas) if metadatas else None,
+                     embedding_model=EMBEDDING_MODEL, index_file=index_file)
         console.print("[success]Batch-Insert abgeschlossen.[/success]")
     except Exception as e:
         console.print(f"[error]Fehler bei Batch-Insert:[/error] {e}")
 
 def cli_export():
     collection = Prompt.ask("[prompt]Collection[/prompt]")
-    out = Prompt.ask("[prompt]Export-Dateiname[/prompt]", default="export.jsonl")
+    out = Prompt.ask("[prompt]Export-Präfix[/prompt]", default=f"{collection}_export")
+    compress = Prompt.ask("[prompt]gzip-komprimieren? (j/n)[/prompt]", default="n").lower().startswith("j")
     try:
-        index, _ = load_or_create_faiss_index(
-            collection, EMBEDDING_MODEL.get_sentence_embedding_dimension()
-        )
-        export_registry_and_vectors(out, index, f"{collection}.index")
-        console.print(f"[success]Exportiert nach {out} + {collection}.index[/success]")
+        manifest = export_collection(collection, out=out, compress=compress)
+        console.print(f"[success]Exportiert: {manifest['rows']} Zeilen, {manifest['vectors']} Vektoren -> {out}.*[/success]")
     except Exception as e:
         console.print(f"[error]Fehler beim Export:[/error] {e}")
 
 def cli_import():
     collection = Prompt.ask("[prompt]Collection[/prompt]")
-    in_file = Prompt.ask("[prompt]Import-Dateiname[/prompt]", default="export.jsonl")
+    in_file = Prompt.ask("[prompt]Export-Präfix oder Datei[/prompt]", default=f"{collection}_export")
     try:
-        import_registry_and_vectors(in_file, f"{collection}.index")
-        console.print(f"[success]Import abgeschlossen für {collection}.[/success]")
+        stats = import_collection(in_file, collection=collection, embedding_model=EMBEDDING_MODEL)
+        console.print(f"[success]Import abgeschlossen für {collection}: {stats['imported']} übernommen, "
+                      f"{stats['skipped_id'] + stats['skipped_content']} Duplikate übersprungen.[/success]")
     except Exception as e:
         console.print(f"[error]Fehler beim Import:[/error] {e}")
 
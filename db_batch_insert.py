@@ -1,45 +1,65 @@
+from datetime import datetime
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import db_id_manager
+import db_embedding
+import db_faiss_index
+import db_index_store
 
-def batch_insert(faiss_index, texts, collection, entity_type="EMAIL", metadatas=None, source=None, import_batch=None):
+def batch_insert(faiss_index, texts, collection, entity_type="EMAIL", metadatas=None, source=None, import_batch=None, embedding_model=None, index_file=None):
     """
     Fügt mehrere Texte + Metadaten in FAISS und Registry ein.
-    faiss_index: geöffneter FAISS-Index (IndexFlatL2 etc.)
+    faiss_index: geöffneter FAISS-Index mit ID-Mapping (siehe db_faiss_index)
     texts: Liste von Strings
     collection: Collection-Name (z. B. 'emails')
     entity_type: Typ der Entities (z. B. 'EMAIL')
-    metadatas: Liste von Dicts (optional)
+    metadatas: Liste von Dicts, gleich lang wie texts (optional; sonst ValueError)
     source: String (optional)
     import_batch: String (optional)
+    embedding_model: Engine/Model (optional, default: gemeinsame Engine aus db_embedding)
+    index_file: Index-Datei (optional); wenn gesetzt, werden die Vektoren ins Journal
+                geschrieben (db_index_store), sonst nur in faiss_index (Aufrufer speichert)
     """
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    embeddings = model.encode(texts)
+    texts = list(texts)
+    if not texts:
+        return [], []
     if metadatas is None:
         metadatas = [{} for _ in texts]
-    vektor_indices = []
+    elif len(metadatas) != len(texts):
+        # zip würde Registry-Zeilen abschneiden, Index bekäme trotzdem alle Vektoren (verwaist)
+        raise ValueError(f"metadatas hat {len(metadatas)} Einträge, texts {len(texts)}; beide müssen gleich lang sein.")
+    model = embedding_model if embedding_model is not None else db_embedding.get_engine()
+    embeddings = model.encode(texts)
+    # Vektor-IDs als Block reservieren, alle Embeddings mit einem Aufruf in FAISS
+    vektor_indices = db_id_manager.allocate_vektor_ids(collection, len(texts))  # stabile Vektor-IDs
+    # Registry: alle Zeilen in einer Transaktion (executemany statt Commit pro Zeile)
+    uniq_base = datetime.utcnow().strftime("%H%M%S%f")
     ids = []
-    # Insert Batch in FAISS und Registry
-    for i, (text, meta) in enumerate(zip(texts, metadatas)):
-        emb = np.array([embeddings[i]]).astype("float32")
-        faiss_index.add(emb)
-        vektor_index = faiss_index.ntotal - 1  # Index des gerade eingefügten Vektors
-        vektor_indices.append(vektor_index)
+    entries = []
+    for i, (text, meta, vektor_index) in enumerate(zip(texts, metadatas, vektor_indices)):
+        meta = meta or {}
         doc_id = db_id_manager.generate_id(
             collection=collection,
             entity_type=entity_type,
             source=source if source else meta.get("quelle"),
-            unique_part=None
+            unique_part=f"{uniq_base}{i:06d}"  # eindeutig auch innerhalb derselben Mikrosekunde
         )
         ids.append(doc_id)
-        db_id_manager.add_entry(
-            id=doc_id,
-            collection=collection,
-            entity_type=entity_type,
-            primary_value=text,
-            metadata=meta,
-            source=source if source else meta.get("quelle"),
-            import_batch=import_batch if import_batch else "batch_insert",
-            vektor_index=vektor_index
-        )
+        entries.append({
+            "id": doc_id,
+            "collection": collection,
+            "entity_type": entity_type,
+            "primary_value": text,
+            "metadata": meta,
+            "source": source if source else meta.get("quelle"),
+            "import_batch": import_batch if import_batch else "batch_insert",
+            "vektor_index": vektor_index
+        })
+    db_id_manager.add_entries(entries)
+    # Erst nach dem Registry-Commit in Journal + Index
+    embeddings = np.asarray(embeddings, dtype="float32")
+    if index_file is not None:
+        db_index_store.add(faiss_index, index_file, embeddings, vektor_indices)
+    else:
+        db_faiss_index.add_vectors(faiss_index, embeddings, vektor_indices)
     return ids, vektor_indices  # Rückgabe für Kontrolle/Weiterverarbeitung
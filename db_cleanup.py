@@ -1,47 +1,213 @@
 import faiss
+import functools
 import numpy as np
 import os
-from datetime import datetime
-from sentence_transformers import SentenceTransformer
-from db_id_manager import list_all, find_by_collection
-
-EMBEDDING_MODEL = SentenceTransformer("all-MiniLM-L6-v2")
-AUDIT_LOG = "audit.log"
-
-def log_audit(msg, level="CLEANUP"):
-    now = datetime.now().isoformat(timespec="seconds")
-    import os
-    pid = os.getpid()
-    line = f"{now} [{level}] [PID:{pid}] {msg}"
-    with open(AUDIT_LOG, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
-
-def rebuild_faiss_index(collection, index_file, embedding_dim=384, registry_func=find_by_collection):
+from db_id_manager import list_all, find_by_collection, allocate_vektor_ids, set_vektor_indices, get_by_ids, list_vektor_ids, get_collection_meta, set_collection_meta
+import db_embedding
+import db_faiss_index
+import db_index_store
+import db_index_manager
+import db_logger
+import db_metrics
+import db_trace
+
+EMBEDDING_MODEL = db_embedding.get_engine()  # lazy, lädt das Model erst beim ersten encode
+TRAIN_SAMPLE_SIZE = 100000  # max. Trainingsvektoren für IVF/PQ
+
+log_audit = db_logger.audit_logger("CLEANUP")
+# Dauer von Rebuild/Abgleich/Reparatur (Label op) in broker_rebuild_seconds
+_timed = db_metrics.timed(db_metrics.REBUILD_SECONDS, span="rebuild")
+
+@_timed
+def rebuild_faiss_index(collection, index_file, embedding_dim=384, registry_func=find_by_collection, index_spec=None, train_sample=None):
     """
     Baut den FAISS-Index aus der SQLite-Registry neu auf (nur noch gültige Daten).
+    Vektor-ID = vektor_index der Registry; Zeilen ohne vektor_index bekommen eine neue ID.
+    index_spec: Index-Typ (siehe db_faiss_index); default: Spezifikation aus collection_meta, sonst Flat.
+    IVF/PQ-Indizes werden auf einer Zufallsstichprobe (train_sample) der Registry trainiert.
     """
+    meta = get_collection_meta(collection)
+    if meta and meta["dim"]:
+        embedding_dim = meta["dim"]
+    spec = db_faiss_index.normalize_spec(index_spec or (meta["index_spec"] if meta else None))
+    # Journal-Stand vor dem Lesen der Registry: spätere Appends werden beim Snapshot nachgespielt
+    journal_offset = db_index_store.journal_end(index_file)
     docs = registry_func(collection)
     if not docs:
         log_audit(f"Keine Einträge für Collection {collection}. Schreibe leeren Index.", "WARN")
-        new_index = faiss.IndexFlatL2(embedding_dim)
-        faiss.write_index(new_index, index_file)
+        new_index = db_faiss_index.create_index(embedding_dim)
+        db_index_store.write_snapshot(new_index, index_file, journal_offset, collection)
+        db_index_manager.get_manager().put(collection, new_index, index_file)
+        if meta or index_spec:
+            set_collection_meta(collection, embedding_dim, spec, trained=not db_faiss_index.needs_training(spec))
         return 0
 
     texts = [row[3] for row in docs]   # primary_value-Spalte
+    ids = [row[8] for row in docs]     # vektor_index-Spalte
+    missing = [i for i, vid in enumerate(ids) if vid is None]
+    if missing:
+        for i, vid in zip(missing, allocate_vektor_ids(collection, len(missing))):
+            ids[i] = vid
+        set_vektor_indices([(docs[i][0], ids[i]) for i in missing])
+        log_audit(f"{len(missing)} Registry-Einträge ohne vektor_index in '{collection}' neu zugeordnet.", "CLEANUP")
     embeddings = EMBEDDING_MODEL.encode(texts).astype("float32")
 
-    new_index = faiss.IndexFlatL2(embedding_dim)
-    new_index.add(embeddings)
-    faiss.write_index(new_index, index_file)
+    trained = True
+    if db_faiss_index.needs_training(spec):
+        if len(docs) < db_faiss_index.min_training_size(spec):
+            # Zu wenig Daten zum Clustern: vorerst Flat, Training beim nächsten Rebuild
+            log_audit(f"Nur {len(docs)} Einträge in '{collection}', {spec['type']} braucht mind. {db_faiss_index.min_training_size(spec)}. Verwende vorerst Flat.", "WARN")
+            new_index = db_faiss_index.create_index(embedding_dim)
+            trained = False
+        else:
+            new_index = db_faiss_index.create_index(embedding_dim, spec)
+            n_train = min(len(docs), train_sample or TRAIN_SAMPLE_SIZE)
+            sample = np.random.default_rng(0).choice(len(docs), size=n_train, replace=False)
+            with db_trace.span("index.train"):
+                db_faiss_index.train_index(new_index, embeddings[np.sort(sample)])
+            log_audit(f"{spec['type']}-Index für '{collection}' auf {n_train} Vektoren trainiert.", "CLEANUP")
+    else:
+        new_index = db_faiss_index.create_index(embedding_dim, spec)
+    with db_trace.span("index.add"):
+        db_faiss_index.add_vectors(new_index, embeddings, ids)
+    db_index_store.write_snapshot(new_index, index_file, journal_offset, collection)
+    db_index_manager.get_manager().put(collection, new_index, index_file)
+    if meta or index_spec:
+        set_collection_meta(collection, embedding_dim, spec, trained=trained)
 
     log_audit(f"{len(texts)} Einträge in FAISS-Index '{index_file}' aktualisiert (Collection: {collection})", "SUCCESS")
     return len(texts)
 
+def _write_repaired(index, index_file, collection):
+    """Snapshot des (residenten) Index schreiben; Journal-Appends paralleler Schreiber werden nachgespielt."""
+    db_index_store.write_snapshot(index, index_file, collection=collection)
+    db_index_manager.get_manager().put(collection, index, index_file)
+
+def _discard_on_error(func):
+    """Bei Abbruch den evtl. halb veränderten residenten Index verwerfen (nächster Zugriff lädt neu)."""
+    @functools.wraps(func)
+    def wrapper(collection, index_file, *args, **kwargs):
+        try:
+            return func(collection, index_file, *args, **kwargs)
+        except Exception:
+            db_index_manager.get_manager().evict(collection, index_file)
+            raise
+    return wrapper
+
+@_timed
+@_discard_on_error
+def reindex_changes(collection, index_file, changes, embedding_dim=384):
+    """
+    Inkrementeller Abgleich: prüft nur die protokollierten Registry-Änderungen
+    (db_id_manager.changes_since) gegen den bestehenden Index, statt alles neu zu embedden.
+    Gelöschte Zeilen, deren Vektor noch im Index liegt, werden entfernt; geänderte/neue Zeilen,
+    deren Vektor-ID fehlt, werden embeddet und eingefügt. Ersetzte Zeilen (delete + insert mit
+    derselben Vektor-ID, z. B. update_document) werden neu embeddet und ihr Vektor ausgetauscht,
+    da der Index sonst nach einem Abbruch vor dem Journal den Vektor des alten Texts behält
+    (bei normalem Ablauf ein Treffer im Embedding-Cache). Schreibt den Index nur bei Bedarf.
+    Fällt auf rebuild_faiss_index zurück, wenn der Index fehlt, Legacy ist oder kein Delete kann (HNSW).
+    Gibt die Anzahl neu indizierter Einträge zurück.
+    """
+    if not os.path.exists(index_file):
+        return rebuild_faiss_index(collection, index_file, embedding_dim)
+    index = db_index_manager.get_manager().get(collection, index_file=index_file)
+    if db_faiss_index.is_legacy_index(index):
+        return rebuild_faiss_index(collection, index_file, embedding_dim)
+
+    rows = [row for row in get_by_ids([change[1] for change in changes]).values() if row[1] == collection]
+    live = {row[8] for row in rows if row[8] is not None}
+    candidates = live | {change[2] for change in changes if change[2] is not None}
+    candidates = np.fromiter(candidates, dtype="int64", count=len(candidates))
+    present = set(candidates[np.isin(candidates, db_faiss_index.index_ids(index))].tolist())
+
+    replaced_vids = {(change[1], change[2]) for change in changes if change[3] == "delete"}
+    replaced = [row for row in rows if row[8] in present and (row[0], row[8]) in replaced_vids]
+    stale = sorted((present - live) | {row[8] for row in replaced})
+    todo = [row for row in rows if row[8] is None or row[8] not in present] + replaced
+    if not stale and not todo:
+        return 0
+    if stale and db_faiss_index.remove_vectors(index, stale) < 0:
+        log_audit(f"Index von '{collection}' unterstützt kein Entfernen – voller Rebuild.", "WARN")
+        return rebuild_faiss_index(collection, index_file, embedding_dim)
+
+    ids = [row[8] for row in todo]
+    missing = [i for i, vid in enumerate(ids) if vid is None]
+    if missing:
+        for i, vid in zip(missing, allocate_vektor_ids(collection, len(missing))):
+            ids[i] = vid
+        set_vektor_indices([(todo[i][0], ids[i]) for i in missing])
+        log_audit(f"{len(missing)} Registry-Einträge ohne vektor_index in '{collection}' neu zugeordnet.", "CLEANUP")
+    if todo:
+        embeddings = EMBEDDING_MODEL.encode([row[3] for row in todo]).astype("float32")
+        db_faiss_index.add_vectors(index, embeddings, ids)
+    _write_repaired(index, index_file, collection)
+    log_audit(f"{len(changes)} Änderungen gegen Index '{index_file}' geprüft: {len(stale) - len(replaced)} verwaiste Vektoren entfernt, {len(replaced)} ersetzte Vektoren erneuert, {len(todo)} Einträge neu indiziert (Collection: {collection})", "SUCCESS")
+    return len(todo)
+
+@_timed
+@_discard_on_error
+def repair_faiss_index(collection, index_file, embedding_dim=384):
+    """
+    Diff-basierte Reparatur statt Neuaufbau: vergleicht die Vektor-IDs der Registry mit
+    den IDs im Index, entfernt verwaiste Vektoren und embeddet nur fehlende Einträge.
+    Kosten proportional zur Abweichung. Registry-Zuordnungen (neue Vektor-IDs) werden in
+    einer Transaktion geschrieben, der Index als Snapshot (Temp-Datei + Rename) ersetzt, sodass
+    Queries während der Reparatur weiter den alten Stand lesen.
+    Fällt auf rebuild_faiss_index zurück, wenn der Index fehlt, Legacy ist oder kein Delete kann (HNSW).
+    Gibt (entfernt, neu_indiziert) zurück.
+    """
+    if not os.path.exists(index_file):
+        return 0, rebuild_faiss_index(collection, index_file, embedding_dim)
+    index = db_index_manager.get_manager().get(collection, index_file=index_file)
+    if db_faiss_index.is_legacy_index(index):
+        return 0, rebuild_faiss_index(collection, index_file, embedding_dim)
+
+    entries = list_vektor_ids(collection)
+    registry_ids = np.fromiter((vid for _, vid in entries if vid is not None), dtype="int64")
+    indexed_ids = db_faiss_index.index_ids(index)
+    orphans = np.setdiff1d(indexed_ids, registry_ids)
+    present = set(np.intersect1d(registry_ids, indexed_ids).tolist())
+    todo_ids = [doc_id for doc_id, vid in entries if vid is None or vid not in present]
+    if len(orphans) == 0 and not todo_ids:
+        return 0, 0
+
+    if len(orphans) and db_faiss_index.remove_vectors(index, orphans) < 0:
+        log_audit(f"Index von '{collection}' unterstützt kein Entfernen – voller Rebuild.", "WARN")
+        return 0, rebuild_faiss_index(collection, index_file, embedding_dim)
+
+    rows = get_by_ids(todo_ids)
+    todo = [rows[doc_id] for doc_id in todo_ids if doc_id in rows]
+    ids = [row[8] for row in todo]
+    missing = [i for i, vid in enumerate(ids) if vid is None]
+    if missing:
+        for i, vid in zip(missing, allocate_vektor_ids(collection, len(missing))):
+            ids[i] = vid
+    if todo:
+        embeddings = EMBEDDING_MODEL.encode([row[3] for row in todo]).astype("float32")
+        db_faiss_index.add_vectors(index, embeddings, ids)
+    # Erst Registry (eine Transaktion), dann Index-Datei tauschen; ein Abbruch dazwischen
+    # hinterlässt nur Registry-IDs ohne Vektor, die der nächste Lauf wieder ergänzt
+    if missing:
+        set_vektor_indices([(todo[i][0], ids[i]) for i in missing])
+    _write_repaired(index, index_file, collection)
+    log_audit(f"Index '{index_file}' repariert: {len(orphans)} verwaiste Vektoren entfernt, {len(todo)} Einträge neu indiziert, {len(missing)} Vektor-IDs neu vergeben (Collection: {collection})", "SUCCESS")
+    return len(orphans), len(todo)
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Broker DB Cleanup – FAISS index rebuilds from SQLite registry.")
     parser.add_argument("--collection", required=True, help="Collection-Name (Registry-Lead)")
     parser.add_argument("--index_file", required=True, help="FAISS Index-File (z.B. emails.index)")
     parser.add_argument("--embedding_dim", type=int, default=384, help="Embedding Dimension (default: 384 für MiniLM)")
+    parser.add_argument("--index_spec", help='Index-Spezifikation als JSON, z.B. \'{"type": "IVFFlat", "nlist": 1024}\' (default: aus collection_meta)')
+    parser.add_argument("--train_sample", type=int, help=f"Max. Trainingsvektoren für IVF/PQ (default: {TRAIN_SAMPLE_SIZE})")
+    parser.add_argument("--repair", action="store_true", help="Nur Abweichungen reparieren (verwaiste Vektoren entfernen, fehlende embedden) statt Neuaufbau")
     args = parser.parse_args()
-    rebuild_faiss_index(args.collection, args.index_file, args.embedding_dim)
\ No newline at end of file
+    import json
+    if args.repair:
+        removed, added = repair_faiss_index(args.collection, args.index_file, args.embedding_dim)
+        print(f"{removed} verwaiste Vektoren entfernt, {added} Einträge neu indiziert.")
+        raise SystemExit(0)
+    rebuild_faiss_index(args.collection, args.index_file, args.embedding_dim,
+                        index_spec=json.loads(args.index_spec) if args.index_spec else None,
+                        train_sample=args.train_sample)
\ No newline at end of file
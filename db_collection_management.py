@@ -1,33 +1,64 @@
 import db_id_manager
+import db_index_manager
 import os
 
 def list_collections():
     """Gibt eine Liste aller in der Registry verwendeten Collections zurück."""
-    rows = db_id_manager.list_all()
-    return sorted(set(row[1] for row in rows))  # row[1] == collection
+    return db_id_manager.list_collection_names()  # SELECT DISTINCT statt ganzer Registry
 
-def create_collection(name, index_dim, index_dir="."):
+def new_collection_index(name, index_dim):
+    """
+    Leerer Index passend zur Spezifikation der Collection (collection_meta).
+    Untrainierte IVF/PQ-Collections starten mit einem Flat-Index, bis train_collection läuft.
+    """
+    import db_faiss_index
+    meta = db_id_manager.get_collection_meta(name)
+    spec = meta["index_spec"] if meta else None
+    if db_faiss_index.needs_training(spec) and not meta["trained"]:
+        return db_faiss_index.create_index(index_dim)
+    return db_faiss_index.create_index(index_dim, spec)
+
+def create_collection(name, index_dim, index_dir=None, index_spec=None):
     """
     Legt einen neuen (leeren) FAISS-Index für die Collection an.
     index_dim: Dimension der Embeddings, z. B. 384 oder 768.
+    index_spec: Index-Typ + Parameter, z. B. {"type": "IVFFlat", "nlist": 1024} (default: Flat).
     """
-    import faiss
-    index = faiss.IndexFlatL2(index_dim)
-    out_file = os.path.join(index_dir, f"{name}.index")
-    faiss.write_index(index, out_file)
+    import db_faiss_index
+    import db_index_store
+    spec = db_faiss_index.normalize_spec(index_spec)
+    db_id_manager.set_collection_meta(name, index_dim, spec, trained=not db_faiss_index.needs_training(spec))
+    index = new_collection_index(name, index_dim)
+    out_file = db_index_manager.index_path(name, index_dir)
+    db_index_store.write_snapshot(index, out_file, collection=name)
     return out_file
 
-def drop_collection(name, index_dir="."):
+def train_collection(name, index_dim, index_dir=None, index_spec=None, sample_size=None):
+    """
+    Trainiert den Index einer Collection (IVF/PQ) auf einer Stichprobe der Registry
+    und baut ihn mit allen Einträgen neu auf. Mit index_spec lässt sich der Index-Typ
+    dabei wechseln (z. B. Flat -> IVFPQ). Gibt die Anzahl indizierter Einträge zurück.
+    """
+    import db_cleanup
+    meta = db_id_manager.get_collection_meta(name)
+    spec = index_spec or (meta["index_spec"] if meta else None)
+    if spec is None:
+        raise ValueError(f"Collection '{name}' hat keine Index-Spezifikation (bei create_collection oder train_collection --index_type angeben).")
+    index_file = db_index_manager.index_path(name, index_dir)
+    return db_cleanup.rebuild_faiss_index(name, index_file, (meta or {}).get("dim") or index_dim,
+                                          index_spec=spec, train_sample=sample_size)
+
+def drop_collection(name, index_dir=None):
     """Löscht die Registry-Einträge und die Index-Datei einer Collection."""
     # 1. Registry löschen
-    import sqlite3
-    conn = db_id_manager.get_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM id_registry WHERE collection = ?", (name,))
-    conn.commit()
-    conn.close()
+    db_id_manager.delete_collection(name)
+    db_id_manager.delete_collection_meta(name)
+    db_id_manager.delete_checkpoint(name)
     # 2. Index-File löschen
-    index_file = os.path.join(index_dir, f"{name}.index")
+    import db_index_store
+    index_file = db_index_manager.index_path(name, index_dir)
+    db_index_manager.get_manager().evict(name, index_file)
+    db_index_store.remove_files(index_file)
     if os.path.exists(index_file):
         os.remove(index_file)
         return True
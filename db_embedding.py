@@ -0,0 +1,194 @@
+# embedding.py
+#
+# Gemeinsame Embedding-Engine für alle Module (Gateway, CLI, Batch-Insert, Cleanup).
+# Das Model wird genau einmal pro Prozess und erst beim ersten Bedarf geladen.
+# Parallele encode()-Aufrufe (z. B. Threads im Gateway-Server) werden zu einem
+# Model-Aufruf gebündelt (Micro-Batching: max. Batchgröße / max. Wartezeit).
+
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+import db_embedding_cache
+import db_metrics
+import db_trace
+
+MODEL_NAME = os.environ.get("BROKER_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+MAX_BATCH_SIZE = int(os.environ.get("BROKER_EMBED_MAX_BATCH", "64"))
+MAX_WAIT_MS = float(os.environ.get("BROKER_EMBED_MAX_WAIT_MS", "5"))
+
+# Bekannte Dimensionen, damit z. B. create_collection das Model nicht laden muss
+KNOWN_DIMENSIONS = {
+    "all-MiniLM-L6-v2": 384,
+    "all-MiniLM-L12-v2": 384,
+    "all-mpnet-base-v2": 768,
+}
+
+
+class _EncodeJob:
+    def __init__(self, texts):
+        self.texts = texts
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class EmbeddingEngine:
+    """
+    Lazy geladenes SentenceTransformer-Model mit Batching-Queue.
+    Bietet dieselbe Schnittstelle wie SentenceTransformer (encode,
+    get_sentence_embedding_dimension) und kann überall als embedding_model
+    übergeben werden.
+    """
+    def __init__(self, model_name=MODEL_NAME, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, model=None, cache="default"):
+        self.model_name = model_name
+        # cache: EmbeddingCache, None (aus) oder "default" (db_embedding_cache.CACHE_DB, leer = aus)
+        if cache == "default":
+            cache = db_embedding_cache.EmbeddingCache() if db_embedding_cache.CACHE_DB else None
+        self.cache = cache
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._model = model
+        self._model_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._active = 0  # Anzahl gerade wartender encode()-Aufrufer
+        self._active_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    with db_trace.span("model.load"):
+                        from sentence_transformers import SentenceTransformer
+                        self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def get_sentence_embedding_dimension(self):
+        if self._model is None and self.model_name in KNOWN_DIMENSIONS:
+            return KNOWN_DIMENSIONS[self.model_name]
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, **kwargs):
+        """Gibt Embeddings als float32-Array (len(texts), dim) zurück."""
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype="float32")
+        with db_trace.span("embed.encode"), db_metrics.EMBED_SECONDS.time():
+            if self.cache is None:
+                result = self._encode_uncached(texts)
+                db_metrics.EMBED_TEXTS.inc(len(texts), cached="false")
+            else:
+                result = self._encode_cached(texts)
+        return result[0] if single else result
+
+    def _encode_cached(self, texts):
+        dim = self.get_sentence_embedding_dimension()
+        cached = self.cache.get_many(texts, self.model_name, dim)
+        # Nur Cache-Misses (dedupliziert) durchs Model schicken
+        misses = list(dict.fromkeys(t for t, vec in zip(texts, cached) if vec is None))
+        fresh = {}
+        db_metrics.EMBED_TEXTS.inc(len(texts) - len(misses), cached="true")
+        db_metrics.EMBED_TEXTS.inc(len(misses), cached="false")
+        if misses:
+            emb = self._encode_uncached(misses)
+            self.cache.put_many(misses, emb, self.model_name, dim)
+            fresh = dict(zip(misses, emb))
+        result = np.empty((len(texts), dim), dtype="float32")
+        for i, (text, vec) in enumerate(zip(texts, cached)):
+            result[i] = vec if vec is not None else fresh[text]
+        return result
+
+    def _encode_uncached(self, texts):
+        if self._model is None:
+            self.model  # Laden im aufrufenden Thread (Span model.load), nicht im Batch-Worker
+        if len(texts) >= self.max_batch_size:
+            # Große Batches lohnen kein Warten, direkt durchs Model
+            return self._encode(texts)
+        return self._submit(texts)
+
+    def _encode(self, texts):
+        emb = self.model.encode(texts, batch_size=self.max_batch_size, show_progress_bar=False)
+        return np.asarray(emb, dtype="float32")
+
+    def _submit(self, texts):
+        self._ensure_worker()
+        job = _EncodeJob(texts)
+        with self._active_lock:
+            self._active += 1
+        try:
+            self._queue.put(job)
+            job.done.wait()
+        finally:
+            with self._active_lock:
+                self._active -= 1
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embedding-engine", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            jobs = [self._queue.get()]
+            n_texts = len(jobs[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            # Nur warten, wenn noch andere Aufrufer unterwegs sind
+            while n_texts < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (self._active <= len(jobs) and self._queue.empty()):
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                n_texts += len(job.texts)
+            texts = [t for job in jobs for t in job.texts]
+            try:
+                emb = self._encode(texts)
+                offset = 0
+                for job in jobs:
+                    job.result = emb[offset:offset + len(job.texts)]
+                    offset += len(job.texts)
+            except Exception as e:
+                for job in jobs:
+                    job.error = e
+            finally:
+                for job in jobs:
+                    job.done.set()
+
+
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+
+def get_engine():
+    """Gibt die prozessweite Embedding-Engine zurück (wird beim ersten Aufruf angelegt)."""
+    global _ENGINE
+    if _ENGINE is None:
+        with _ENGINE_LOCK:
+            if _ENGINE is None:
+                _ENGINE = EmbeddingEngine()
+    return _ENGINE
+
+def configure(**kwargs):
+    """
+    Ersetzt die prozessweite Engine, z. B. configure(max_batch_size=128, max_wait_ms=10),
+    configure(model=eigenes_model) oder configure(cache=None) ohne Embedding-Cache.
+    Muss vor der ersten Nutzung aufgerufen werden.
+    """
+    global _ENGINE
+    with _ENGINE_LOCK:
+        _ENGINE = EmbeddingEngine(**kwargs)
+    return _ENGINE
@@ -0,0 +1,122 @@
+# embedding_cache.py
+#
+# Inhaltsadressierter Embedding-Cache: Schlüssel = sha256(text) + Model-Name + Dimension.
+# Zwei Stufen: In-Memory-LRU (schnell, begrenzt) und SQLite-Seitentabelle (persistent).
+# Rebuilds und Updates mit unverändertem Text werden so zu Plattenzugriffen statt Inferenz.
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_DB = os.environ.get("BROKER_EMBED_CACHE", "embedding_cache.db")
+MAX_MEMORY_ITEMS = int(os.environ.get("BROKER_EMBED_CACHE_MEM", "50000"))
+_CHUNK = 500  # SQLite-Variablenlimit für IN (...)
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path=CACHE_DB, max_memory_items=MAX_MEMORY_ITEMS):
+        self.path = path
+        self.max_memory_items = max(0, int(max_memory_items))
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._local = threading.local()
+        self._setup()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _setup(self):
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                text_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (text_hash, model, dim)
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+
+    # ---------- In-Memory-Stufe ----------
+    def _memory_get(self, key):
+        with self._memory_lock:
+            vec = self._memory.get(key)
+            if vec is not None:
+                self._memory.move_to_end(key)
+            return vec
+
+    def _memory_put(self, key, vec):
+        if self.max_memory_items == 0:
+            return
+        with self._memory_lock:
+            self._memory[key] = vec
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    # ---------- Öffentliche API ----------
+    def get_many(self, texts, model_name, dim):
+        """
+        Gibt eine Liste gleicher Länge zurück: float32-Vektor oder None (Cache-Miss).
+        """
+        hashes = [text_hash(t) for t in texts]
+        result = [None] * len(texts)
+        missing = {}
+        for i, h in enumerate(hashes):
+            vec = self._memory_get((h, model_name, dim))
+            if vec is not None:
+                result[i] = vec
+            else:
+                missing.setdefault(h, []).append(i)
+        if not missing:
+            return result
+        conn = self._connection()
+        keys = list(missing)
+        for start in range(0, len(keys), _CHUNK):
+            chunk = keys[start:start + _CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND dim = ? AND text_hash IN ({placeholders})",
+                (model_name, dim, *chunk)
+            ).fetchall()
+            for h, blob in rows:
+                vec = np.frombuffer(blob, dtype="<f4")
+                if vec.shape[0] != dim:
+                    continue
+                self._memory_put((h, model_name, dim), vec)
+                for i in missing[h]:
+                    result[i] = vec
+        return result
+
+    def put_many(self, texts, vectors, model_name, dim):
+        """Speichert Embeddings (Zeilen von vectors) für die gegebenen Texte."""
+        vectors = np.asarray(vectors, dtype="<f4")
+        rows = []
+        for text, vec in zip(texts, vectors):
+            h = text_hash(text)
+            self._memory_put((h, model_name, dim), vec.copy())
+            rows.append((h, model_name, dim, vec.tobytes()))
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (text_hash, model, dim, vector) VALUES (?, ?, ?, ?)",
+                rows
+            )
+
+    def clear_memory(self):
+        with self._memory_lock:
+            self._memory.clear()
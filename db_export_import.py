@@ -1,39 +1,285 @@
+import contextlib
+import gzip
 import json
+import os
+import time
+from array import array
+from datetime import datetime
+
 import numpy as np
 import db_id_manager
-import faiss
+import db_embedding
+import db_faiss_index
+import db_index_manager
+import db_index_store
+
+IMPORT_CHUNK = 10000  # Zeilen pro Block beim Import (Registry-Abfragen, Journal-Datensatz)
+EXPORT_CHUNK = int(os.environ.get("BROKER_EXPORT_CHUNK", "10000"))  # Zeilen pro Block (Registry-Fetch + reconstruct)
+EXPORT_FORMAT = "broker-export/1"
+
+def _export_paths(collection, out=None, compress=False):
+    """Dateinamen eines Exports: <prefix>.jsonl[.gz], <prefix>.npy[.gz], <prefix>.manifest.json."""
+    prefix = out or f"{collection}_export"
+    for suffix in (".gz", ".jsonl", ".npy", ".manifest.json"):
+        if prefix.endswith(suffix):
+            prefix = prefix[:-len(suffix)]
+    ext = ".gz" if compress else ""
+    return prefix, f"{prefix}.jsonl{ext}", f"{prefix}.npy{ext}", f"{prefix}.manifest.json"
+
+def export_collection(collection, out=None, compress=False, chunk_rows=EXPORT_CHUNK):
+    """
+    Streaming-Export einer Collection mit konstantem Speicherbedarf:
+      - <prefix>.jsonl: eine Registry-Zeile pro Eintrag (inkl. vektor_index, has_vector)
+      - <prefix>.npy:   float32-Matrix (rows, dim), Zeile i gehört zu JSONL-Zeile i
+                        (fehlende Vektoren: NaN), Header vorab geschrieben, Daten blockweise
+      - <prefix>.manifest.json: Zeilen, Dimension, Index-Typ, Durchsatz
+    Registry-Zeilen kommen blockweise aus einer Lesetransaktion (konsistenter Stand),
+    Vektoren per reconstruct aus dem (per mmap geladenen) Index. compress=True schreibt gzip.
+    Gibt das Manifest zurück.
+    """
+    started = time.monotonic()
+    prefix, jsonl_file, npy_file, manifest_file = _export_paths(collection, out, compress)
+    meta = db_id_manager.get_collection_meta(collection)
+    index = db_index_manager.get_manager().get(collection, read_only=True)
+    dim = index.d if index is not None else (meta or {}).get("dim") or 0
+    opener = gzip.open if compress else open
+    rows = vectors = 0
+    with db_id_manager.read_snapshot() as conn:
+        total = conn.execute("SELECT COUNT(*) FROM id_registry WHERE collection = ?", (collection,)).fetchone()[0]
+        cursor = conn.execute(
+            f"SELECT {', '.join(db_id_manager.EXPORT_COLUMNS)} FROM id_registry WHERE collection = ? ORDER BY vektor_index",
+            (collection,))
+        with contextlib.ExitStack() as stack:
+            out_jsonl = stack.enter_context(opener(jsonl_file, "wt", encoding="utf-8"))
+            out_npy = None
+            if dim:
+                out_npy = stack.enter_context(opener(npy_file, "wb"))
+                np.lib.format.write_array_header_1_0(out_npy, {"descr": "<f4", "fortran_order": False, "shape": (total, dim)})
+            if index is not None:
+                stack.enter_context(db_faiss_index.reconstruct_access(index))
+            while True:
+                chunk = cursor.fetchmany(chunk_rows)
+                if not chunk:
+                    break
+                block = np.full((len(chunk), dim), np.nan, dtype="float32")
+                found = np.zeros(len(chunk), dtype=bool)
+                with_vid = [i for i, row in enumerate(chunk) if row[8] is not None]
+                if index is not None and with_vid:
+                    block[with_vid], found[with_vid] = db_faiss_index.reconstruct_vectors(index, [chunk[i][8] for i in with_vid])
+                for row, has_vector in zip(chunk, found.tolist()):
+                    entry = dict(zip(db_id_manager.EXPORT_COLUMNS, row))
+                    if entry["metadata"]:
+                        try:
+                            entry["metadata"] = json.loads(entry["metadata"])
+                        except ValueError:
+                            pass  # nicht reparierbare Altdaten roh exportieren
+                    entry["has_vector"] = has_vector
+                    out_jsonl.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                if out_npy is not None:
+                    out_npy.write(block.tobytes())
+                rows += len(chunk)
+                vectors += int(found.sum())
+    duration = time.monotonic() - started
+    size = sum(os.path.getsize(path) for path in (jsonl_file, npy_file) if os.path.exists(path))
+    manifest = {
+        "format": EXPORT_FORMAT,
+        "collection": collection,
+        "rows": rows,
+        "vectors": vectors,
+        "dim": dim,
+        "dtype": "float32",
+        "vectors_exact": db_faiss_index.vectors_exact(index) if index is not None else None,
+        "index_spec": (meta or {}).get("index_spec"),
+        "embedding_model": db_embedding.get_engine().model_name,
+        "files": {"registry": os.path.basename(jsonl_file), "vectors": os.path.basename(npy_file) if dim else None},
+        "compressed": bool(compress),
+        "schema_version": db_id_manager.get_schema_version(),
+        "exported_at": datetime.utcnow().isoformat(),
+        "duration_s": round(duration, 3),
+        "rows_per_s": round(rows / duration, 1) if duration > 0 else None,
+        "bytes": size,
+    }
+    with open(manifest_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"Export {collection}: {rows} Zeilen, {vectors} Vektoren in {duration:.1f}s "
+          f"({manifest['rows_per_s'] or 0:.0f} Zeilen/s, {size / 1024 / 1024 / max(duration, 1e-9):.1f} MB/s) -> {prefix}.*")
+    return manifest
 
-def export_registry_and_vectors(out_jsonl="export.jsonl", faiss_index=None, out_faiss="export.index"):
+def _open_export(path):
     """
-    Exportiert die Registry (Text, IDs, Meta, vektor_index) als JSONL,
-    und den FAISS-Index als Datei.
+    (manifest, jsonl_file, npy_file) zu einem Export-Präfix, Manifest oder einer Export-Datei.
+    Reine JSONL-Dateien ohne Manifest (ältere Exporte) ergeben (None, path, None).
     """
-    # 1. Exportiere Registry
-    db_id_manager.export_registry(out_jsonl)
-    # 2. Exportiere FAISS-Index, falls gegeben
-    if faiss_index is not None:
-        faiss.write_index(faiss_index, out_faiss)
-    return out_jsonl, out_faiss
-
-def import_registry_and_vectors(in_jsonl, faiss_index_file):
+    manifest_file = path if path.endswith(".manifest.json") else _export_paths(None, path)[3]
+    if os.path.exists(manifest_file):
+        with open(manifest_file, encoding="utf-8") as f:
+            manifest = json.load(f)
+        base = os.path.dirname(manifest_file)
+        vectors = manifest["files"].get("vectors")
+        return manifest, os.path.join(base, manifest["files"]["registry"]), os.path.join(base, vectors) if vectors else None
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Weder Manifest ({manifest_file}) noch Datei {path} gefunden.")
+    return None, path, None
+
+def _iter_export(jsonl_file, npy_file=None, chunk_rows=IMPORT_CHUNK):
+    """Liest einen Export blockweise: (Liste von Registry-Dicts, float32-Block oder None) pro Block."""
+    def opener(path, mode):
+        return gzip.open(path, mode) if path.endswith(".gz") else open(path, mode)
+    with contextlib.ExitStack() as stack:
+        lines = stack.enter_context(opener(jsonl_file, "rb"))
+        vectors, dim, dtype = None, 0, None
+        if npy_file:
+            vectors = stack.enter_context(opener(npy_file, "rb"))
+            version = np.lib.format.read_magic(vectors)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, _, dtype = read_header(vectors)
+            dim = shape[1]
+        chunk = []
+        for line in lines:
+            if line.strip():
+                chunk.append(json.loads(line))
+            if len(chunk) >= chunk_rows:
+                yield chunk, _read_block(vectors, len(chunk), dim, dtype)
+                chunk = []
+        if chunk:
+            yield chunk, _read_block(vectors, len(chunk), dim, dtype)
+
+def _read_block(f, n, dim, dtype):
+    if f is None:
+        return None
+    data = f.read(n * dim * dtype.itemsize)
+    if len(data) < n * dim * dtype.itemsize:
+        raise ValueError("Vektordatei kürzer als die Registry-Datei (Export unvollständig?).")
+    return np.frombuffer(data, dtype=dtype).reshape(n, dim).astype("float32")
+
+def import_collection(path, collection=None, chunk_rows=IMPORT_CHUNK, embedding_model=None):
     """
-    Importiert Registry aus JSONL und lädt FAISS-Index.
+    Importiert einen Export (export_collection) in eine bestehende oder neue Collection,
+    ohne die Texte neu zu embedden:
+      1. Registry: Duplikate per ID und per Inhalt (entity_type + primary_value in der
+         Ziel-Collection) überspringen, frische Vektor-IDs vergeben (und neue Dokument-IDs,
+         wenn die ID in einer anderen Collection belegt ist), alle Zeilen in EINER
+         Transaktion schreiben
+      2. Vektoren blockweise aus der .npy ins Journal + den Index (nach dem Commit, wie
+         überall: Registry -> Journal -> Index); nur Zeilen ohne Vektor werden embedded,
+         bei einem Export mit anderem embedding_model alle Zeilen (aus primary_value)
+    Exakte Vektoren desselben Models landen zusätzlich im Embedding-Cache.
+    Gibt ein Dict mit Zählern und Durchsatz zurück.
     """
-    # 1. Registry importieren (optional: Duplikate vermeiden!)
-    # TODO : RÜCKIMPORT IN SQLITE-DATABASE
-    with open(in_jsonl, encoding="utf-8") as f:
-        for line in f:
-            entry = json.loads(line)
-            db_id_manager.add_entry(
-                id=entry["id"],
-                collection=entry["collection"],
-                entity_type=entry["entity_type"],
-                primary_value=entry["primary_value"],
-                metadata=entry["metadata"],
-                source=entry.get("source"),
-                import_batch=entry.get("import_batch"),
-                vektor_index=entry.get("vektor_index")
-            )
-    # 2. FAISS-Index laden
-    index = faiss.read_index(faiss_index_file)
-    return index
+    import db_faiss_gateway  # lokal: das Gateway importiert dieses Modul
+    started = time.monotonic()
+    manifest, jsonl_file, npy_file = _open_export(path)
+    collection = collection or (manifest or {}).get("collection")
+    if not collection:
+        raise ValueError("Keine Ziel-Collection angegeben und kein Manifest mit Collection gefunden.")
+    model = embedding_model if embedding_model is not None else db_embedding.get_engine()
+    # Vektoren eines anderen Models sind mit den eigenen nicht vergleichbar: dann aus primary_value neu embedden
+    source_model = (manifest or {}).get("embedding_model")
+    reembed = source_model is not None and source_model != getattr(model, "model_name", source_model)
+    if reembed:
+        print(f"Export mit Model '{source_model}', aktiv ist '{model.model_name}': Vektoren werden neu embeddet.")
+        dim = model.get_sentence_embedding_dimension()
+    else:
+        dim = (manifest or {}).get("dim") or model.get_sentence_embedding_dimension()
+    index, index_file = db_faiss_gateway.load_or_create_faiss_index(collection, dim)
+    if index.d != dim:
+        raise ValueError(f"Dimension des Exports ({dim}) passt nicht zum Index von '{collection}' ({index.d}).")
+    default_batch = f"import_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+    stats = {"rows": 0, "imported": 0, "skipped_id": 0, "skipped_content": 0, "embedded": 0, "cached": 0}
+
+    # 1. Registry in einer Transaktion; pro Zeile die neue Vektor-ID merken (-1 = übersprungen)
+    assigned = array("q")
+    uniq_base = datetime.utcnow().strftime("%H%M%S%f")
+    with db_id_manager.transaction() as c:
+        for entries, _ in _iter_export(jsonl_file, None, chunk_rows):
+            # Abfragen laufen auf derselben Verbindung und sehen die bereits importierten Blöcke
+            taken_ids = db_id_manager.existing_ids([e["id"] for e in entries if e.get("id")])
+            seen_ids = {doc_id for doc_id, coll in taken_ids.items() if coll == collection}
+            values = {}
+            for e in entries:
+                values.setdefault(e.get("entity_type"), []).append(e.get("primary_value"))
+            seen_values = {(entity_type, value) for entity_type, vals in values.items()
+                           for value in db_id_manager.existing_values(collection, entity_type, vals)}
+            take = []
+            for e in entries:
+                key = (e.get("entity_type"), e.get("primary_value"))
+                if e.get("id") and e["id"] in seen_ids:
+                    stats["skipped_id"] += 1
+                    take.append(False)
+                elif key in seen_values:
+                    stats["skipped_content"] += 1
+                    take.append(False)
+                else:
+                    seen_values.add(key)
+                    if e.get("id"):
+                        seen_ids.add(e["id"])
+                    take.append(True)
+            vektor_ids = iter(db_id_manager.allocate_vektor_ids(collection, sum(take)) if any(take) else [])
+            rows = []
+            for e, taken in zip(entries, take):
+                if not taken:
+                    assigned.append(-1)
+                    continue
+                vid = next(vektor_ids)
+                assigned.append(vid)
+                doc_id = e.get("id")
+                if not doc_id or doc_id in taken_ids:
+                    # ID fehlt oder gehört einer anderen Collection: neue ID im Schema der Ziel-Collection
+                    doc_id = db_id_manager.generate_id(collection, e.get("entity_type") or "UNKNOWN",
+                                                       e.get("source"), f"{uniq_base}{len(assigned):09d}")
+                rows.append({
+                    "id": doc_id,
+                    "collection": collection,
+                    "entity_type": e.get("entity_type"),
+                    "primary_value": e.get("primary_value"),
+                    "metadata": e.get("metadata"),
+                    "timestamp": e.get("timestamp"),
+                    "source": e.get("source"),
+                    "import_batch": e.get("import_batch") or default_batch,
+                    "vektor_index": vid,
+                })
+            db_id_manager.add_entries(rows, cursor=c)
+            stats["rows"] += len(entries)
+            stats["imported"] += len(rows)
+
+    # 2. Vektoren nach dem Commit; Zeilen ohne Vektor (has_vector=false, alte Exporte) embedden
+    cache = getattr(model, "cache", None)
+    # Nur exakte Vektoren in den Cache: Flag UND Index-Typ der Quelle müssen passen
+    # (Exporte älterer Versionen markierten IVFPQ fälschlich als exakt)
+    source_spec = (manifest or {}).get("index_spec") or {}
+    seed_cache = (cache is not None and manifest is not None and not reembed and manifest.get("vectors_exact") is True
+                  and source_spec.get("type") in db_faiss_index.EXACT_INDEX_TYPES
+                  and manifest.get("embedding_model") == getattr(model, "model_name", None))
+    assigned = np.frombuffer(assigned, dtype="int64") if len(assigned) else np.zeros(0, dtype="int64")
+    start = 0
+    for entries, vectors in _iter_export(jsonl_file, npy_file, chunk_rows):
+        vids = assigned[start:start + len(entries)]
+        start += len(entries)
+        keep = vids >= 0
+        if not keep.any():
+            continue
+        texts = [e.get("primary_value") or "" for e, k in zip(entries, keep) if k]
+        if vectors is None or reembed:
+            block = np.full((int(keep.sum()), dim), np.nan, dtype="float32")
+        else:
+            block = np.array(vectors[keep], dtype="float32")
+        has_vector = ~np.isnan(block).any(axis=1)
+        has_vector &= np.array([e.get("has_vector", True) for e, k in zip(entries, keep) if k], dtype=bool)
+        missing = np.flatnonzero(~has_vector)
+        if len(missing):
+            block[missing] = model.encode([texts[i] for i in missing])
+            stats["embedded"] += len(missing)
+        if seed_cache and has_vector.any():
+            present = np.flatnonzero(has_vector)
+            cache.put_many([texts[i] for i in present], block[present], model.model_name, dim)
+            stats["cached"] += len(present)
+        db_index_store.add(index, index_file, block, vids[keep])
+        db_faiss_gateway.journal_written(index, index_file, collection)
+
+    stats["collection"] = collection
+    stats["duration_s"] = round(time.monotonic() - started, 3)
+    stats["rows_per_s"] = round(stats["rows"] / stats["duration_s"], 1) if stats["duration_s"] > 0 else None
+    print(f"Import {collection}: {stats['imported']} von {stats['rows']} Zeilen übernommen "
+          f"({stats['skipped_id']} ID-Duplikate, {stats['skipped_content']} Inhalts-Duplikate, "
+          f"{stats['embedded']} neu embedded) in {stats['duration_s']:.1f}s ({stats['rows_per_s'] or 0:.0f} Zeilen/s)")
+    return stats
@@ -2,9 +2,10 @@ import argparse
 import sys
 import os
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from rich.console import Console
 
 import db_id_manager
@@ -14,16 +15,120 @@ import db_export_import
 import db_collection_management
 import db_healthchecks
 import db_logger  # optional
-
-def load_or_create_faiss_index(collection_name, index_dim, index_dir="."):
-    index_file = os.path.join(index_dir, f"{collection_name}.index")
-    if os.path.exists(index_file):
-        index = faiss.read_index(index_file)
-    else:
-        index = faiss.IndexFlatL2(index_dim)
-        faiss.write_index(index, index_file)
+import db_metrics
+import db_trace
+import db_gateway_client
+import db_embedding
+import db_faiss_index
+import db_index_store
+import db_index_manager
+import db_search_filter
+
+def load_or_create_faiss_index(collection_name, index_dim, index_dir=None, read_only=False):
+    """
+    Gibt (index, index_file) zurück; geladen über den prozessweiten IndexManager
+    (resident, LRU mit Speicherbudget, Reload bei Änderung auf der Platte).
+    read_only=True (nur Queries): der Index darf per mmap eingeblendet werden und wird
+    dann nicht verändert; Schreiber bekommen immer eine volle Kopie.
+    index_dir: default BROKER_INDEX_DIR (db_index_manager.INDEX_DIR).
+    """
+    manager = db_index_manager.get_manager()
+    index_file = db_index_manager.index_path(collection_name, index_dir)
+    index = manager.get(collection_name, read_only=read_only, index_file=index_file)
+    if index is not None and db_faiss_index.is_legacy_index(index):
+        # Alter positionsbasierter Index: Positionen passen nicht zu vektor_index,
+        # daher einmalig aus der Registry mit stabilen Vektor-IDs neu aufbauen.
+        import db_cleanup
+        db_cleanup.log_audit(f"Migriere Index '{index_file}' auf IndexIDMap2 (stabile Vektor-IDs).", "MIGRATION")
+        db_cleanup.rebuild_faiss_index(collection_name, index_file, index.d)
+        index = manager.get(collection_name, index_file=index_file)
+    if index is None:
+        index = db_collection_management.new_collection_index(collection_name, index_dim)
+        save_faiss_index(index, index_file, collection_name)
     return index, index_file
 
+def index_spec_from_args(args):
+    """Baut eine Index-Spezifikation aus den CLI-Argumenten (None, wenn kein --index_type)."""
+    if not getattr(args, "index_type", None):
+        return None
+    return db_faiss_index.normalize_spec({
+        "type": args.index_type,
+        "nlist": getattr(args, "nlist", None),
+        "m": getattr(args, "m", None),
+        "nbits": getattr(args, "nbits", None),
+        "nprobe": getattr(args, "nprobe", None),
+        "ef_search": getattr(args, "ef_search", None),
+        "ef_construction": getattr(args, "ef_construction", None),
+    })
+
+def _add_index_spec_arguments(p):
+    p.add_argument("--index_type", choices=db_faiss_index.INDEX_TYPES, help="Index-Typ (OPTIONAL, default: Flat)")
+    p.add_argument("--nlist", type=int, help="IVF: Anzahl Cluster (OPTIONAL)")
+    p.add_argument("--m", type=int, help="IVFPQ: Subquantizer / HNSW: Nachbarn pro Knoten (OPTIONAL)")
+    p.add_argument("--nbits", type=int, help="IVFPQ: Bits pro Code (OPTIONAL, default: 8)")
+    p.add_argument("--nprobe", type=int, help="IVF: durchsuchte Cluster pro Query (OPTIONAL)")
+    p.add_argument("--ef_search", type=int, help="HNSW: Suchbreite (OPTIONAL)")
+    p.add_argument("--ef_construction", type=int, help="HNSW: Aufbaubreite (OPTIONAL)")
+
+def save_faiss_index(index, index_file, collection=None):
+    """Schreibt einen vollständigen Snapshot (leert das Journal) und hält den IndexManager aktuell."""
+    db_index_store.write_snapshot(index, index_file, collection=collection)
+    db_index_manager.get_manager().put(collection, index, index_file)
+
+def journal_written(index, index_file, collection=None):
+    """Nach Journal-Schreibvorgängen: ggf. kompaktieren und den IndexManager aktuell halten."""
+    db_index_store.maybe_compact(index, index_file, collection)
+    db_index_manager.get_manager().put(collection, index, index_file)
+
+def compact_index(collection, index_dir=None):
+    """
+    Übernimmt ein offenes Journal in einen neuen Snapshot und nimmt den (voll geladenen)
+    Index aus dem IndexManager, damit Queries ihn danach wieder per mmap einblenden.
+    Gibt True zurück, wenn kompaktiert wurde. Aufrufer hält den Schreibzugriff auf die Collection.
+    """
+    index_file = db_index_manager.index_path(collection, index_dir)
+    if not os.path.exists(index_file) or db_index_store.journal_size(index_file) == 0:
+        return False
+    manager = db_index_manager.get_manager()
+    index = manager.get(collection, index_file=index_file)
+    db_index_store.write_snapshot(index, index_file, collection=collection)
+    manager.evict(collection, index_file)
+    return True
+
+def search_index(index, query_emb, n, collection, filters=None, nprobe=None, ef_search=None):
+    """
+    index.search bzw. gefilterte Suche (db_search_filter); Dauer in broker_search_seconds.
+    nprobe/ef_search gelten nur für diesen Aufruf (SearchParameters), der residente Index bleibt unverändert.
+    """
+    with db_trace.span("index.search"), db_metrics.SEARCH_SECONDS.time(collection=collection, filtered="true" if filters else "false"):
+        if filters:
+            return db_search_filter.search(index, query_emb, n, collection, filters, nprobe=nprobe, ef_search=ef_search)
+        params = db_faiss_index.search_params(index, nprobe=nprobe, ef_search=ef_search)
+        if params is None:
+            return index.search(query_emb, n)
+        return index.search(query_emb, n, params=params)
+
+def search_rows(index, query_emb, n, collection, filters=None, nprobe=None, ef_search=None):
+    """
+    search_index + Registry-Zeilen: pro Query eine Liste (distance, vektor_index, row) mit bis zu n
+    Treffern in Rangfolge. Vektoren ohne Registry-Eintrag (verwaist, z. B. nach Update/Delete auf
+    HNSW bis zum nächsten Rebuild) werden übersprungen und belegen keine Top-n-Plätze: fehlen
+    dadurch Treffer, wird mit größerem k erneut gesucht.
+    """
+    k = n
+    while True:
+        D, I = search_index(index, query_emb, k, collection, filters, nprobe=nprobe, ef_search=ef_search)
+        # Eine Registry-Abfrage für alle Treffer aller Queries
+        rows = db_id_manager.get_by_vektor_indices([int(v) for v in I.ravel() if v >= 0], collection=collection)
+        results = [
+            [(float(dist), int(vid), rows[int(vid)]) for dist, vid in zip(D[q], I[q]) if vid >= 0 and int(vid) in rows][:n]
+            for q in range(len(query_emb))
+        ]
+        exhausted = k >= index.ntotal or all((I[q] < 0).any() for q in range(len(query_emb)))
+        if exhausted or all(len(hits) >= n for hits in results):
+            return results
+        k = min(index.ntotal, k * 2)
+
 console = Console()
 
 # ---------- Core Functions ----------
@@ -38,10 +143,9 @@ def add_document(args, embedding_model):
         source=metadata.get("quelle") if metadata else None
     )
     embedding = embedding_model.encode([args.text]).astype("float32")
-    index.add(embedding)
-    # Use registry-based vektor_index for consistency
-    max_index = db_id_manager.get_max_vektor_index()
-    vektor_index = max_index + 1
+    # Stabile Vektor-ID aus der Registry, unabhängig von index.ntotal
+    vektor_index = db_id_manager.allocate_vektor_ids(args.collection, 1)[0]
+    # Erst Registry-Commit, dann Journal + Index (kein Neuschreiben der Index-Datei)
     db_id_manager.add_entry(
         id=doc_id,
         collection=args.collection,
@@ -52,64 +156,192 @@ def add_document(args, embedding_model):
         import_batch="manual_insert",
         vektor_index=vektor_index
     )
-    faiss.write_index(index, index_file)
+    db_index_store.add(index, index_file, embedding, [vektor_index])
+    journal_written(index, index_file, args.collection)
     print(f"Dokument & Registry hinzugefügt: {doc_id} (Vektor-Index: {vektor_index})")
 
 def query_collection(args, embedding_model):
-    index, _ = load_or_create_faiss_index(args.collection, embedding_model.get_sentence_embedding_dimension())
+    """
+    Semantische Suche, optional auf Registry-Filter eingeschränkt (--source, --entity_type,
+    --import_batch, --since, --until); gibt die Treffer als Liste von Dicts in Rangfolge zurück
+    (rank, vektor_index, distance, row) und gibt sie auf der Konsole aus.
+    """
+    index, _ = load_or_create_faiss_index(args.collection, embedding_model.get_sentence_embedding_dimension(), read_only=True)
     query_emb = embedding_model.encode([args.query]).astype("float32")
-    n = args.n
-    D, I = index.search(query_emb, n)
-    from db_id_manager import get_by_vektor_index
+    found = search_rows(index, query_emb, args.n, args.collection, db_search_filter.filters_from_args(args),
+                        nprobe=getattr(args, "nprobe", None), ef_search=getattr(args, "ef_search", None))[0]
+    hits = [
+        {"rank": rank, "vektor_index": vid, "distance": dist, "row": row}
+        for rank, (dist, vid, row) in enumerate(found, 1)
+    ]
     console.print(f"[bold cyan]Ergebnisse:[/bold cyan]")
-    for rank, vektor_index in enumerate(I[0], 1):
-        row = get_by_vektor_index(int(vektor_index))
-        if row:
-            console.print(f"[{rank}] [#f1fa8c]{row[3]}[/#f1fa8c]")  # primary_value
-            meta = row[4]
-            if meta:
-                console.print(f"     Meta: {meta}")
+    for hit in hits:
+        row = hit["row"]
+        console.print(f"[{hit['rank']}] [#f1fa8c]{row[3]}[/#f1fa8c]  [dim](Distanz: {hit['distance']:.4f})[/dim]")  # primary_value
+        meta = row[4]
+        if meta:
+            console.print(f"     Meta: {meta}")
+    return hits
+
+SEARCH_WORKERS = int(os.environ.get("BROKER_SEARCH_WORKERS", str(os.cpu_count() or 1)))
+_SEARCH_POOL = None
+_SEARCH_POOL_LOCK = threading.Lock()
+
+def _search_pool():
+    """Prozessweiter Thread-Pool für search_batch: langlebige Threads behalten ihre Registry-Verbindung."""
+    global _SEARCH_POOL
+    if _SEARCH_POOL is None:
+        with _SEARCH_POOL_LOCK:
+            if _SEARCH_POOL is None:
+                _SEARCH_POOL = ThreadPoolExecutor(max_workers=max(1, SEARCH_WORKERS), thread_name_prefix="search")
+    return _SEARCH_POOL
+
+def search_batch(queries, collections, n=3, embedding_model=None, nprobe=None, ef_search=None, max_workers=None, filters=None):
+    """
+    Batch-Suche: alle Queries mit einem encode()-Aufruf, pro Collection ein index.search
+    mit (nq, d)-Matrix, Collections parallel in Threads (FAISS gibt dabei das GIL frei).
+    Die Treffer aller Collections werden pro Query nach Distanz zusammengeführt (Top-n).
+    filters (Dict wie db_search_filter.FILTER_FIELDS) schränkt jede Collection auf die passenden
+    Registry-Einträge ein. Die Collections laufen im prozessweiten Pool (BROKER_SEARCH_WORKERS
+    Threads), max_workers=1 sucht sequentiell im aufrufenden Thread.
+    Gibt pro Query eine Liste von Dicts zurück: rank, collection, vektor_index, distance, row.
+    """
+    filters = db_search_filter.normalize_filters(filters)
+    queries = list(queries)
+    collections = list(dict.fromkeys(collections))
+    if not queries or not collections:
+        return [[] for _ in queries]
+    model = embedding_model if embedding_model is not None else db_embedding.get_engine()
+    query_emb = np.asarray(model.encode(queries), dtype="float32")
+
+    def search_one(collection):
+        index, _ = load_or_create_faiss_index(collection, query_emb.shape[1], read_only=True)
+        return [
+            [(dist, collection, vid, row) for dist, vid, row in hits]
+            for hits in search_rows(index, query_emb, n, collection, filters, nprobe=nprobe, ef_search=ef_search)
+        ]
+
+    workers = max_workers or min(len(collections), SEARCH_WORKERS)
+    if workers > 1 and len(collections) > 1:
+        per_collection = list(_search_pool().map(db_trace.wrap(search_one), collections))
+    else:
+        per_collection = [search_one(collection) for collection in collections]
+
+    results = []
+    for q in range(len(queries)):
+        merged = sorted((hit for hits in per_collection for hit in hits[q]), key=lambda hit: hit[0])[:n]
+        results.append([
+            {"rank": rank, "collection": collection, "vektor_index": vid, "distance": dist, "row": row}
+            for rank, (dist, collection, vid, row) in enumerate(merged, 1)
+        ])
+    return results
+
+def _read_queries(args):
+    """Queries aus --queries (JSON-Array) oder --file (JSON-Array, JSONL mit "query" oder eine Zeile pro Query)."""
+    if getattr(args, "queries", None):
+        return json.loads(args.queries)
+    with open(args.file, encoding="utf-8") as f:
+        content = f.read()
+    if content.lstrip().startswith("["):
+        return json.loads(content)
+    queries = []
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        if line.lstrip().startswith("{"):
+            queries.append(json.loads(line)["query"])
         else:
-            console.print(f"[{rank}] Kein Dokument zu Vektor-Index {vektor_index} gefunden.")
+            queries.append(line.strip())
+    return queries
+
+def batch_query(args, embedding_model):
+    """
+    CLI-Batch-Query: gibt pro Query eine JSON-Zeile aus ({"query", "hits": [...]}),
+    bei --out in eine Datei statt auf die Konsole. Gibt die Ergebnisse zurück.
+    """
+    queries = _read_queries(args)
+    collections = [c.strip() for c in args.collections.split(",") if c.strip()]
+    results = search_batch(queries, collections, n=args.n, embedding_model=embedding_model,
+                           nprobe=getattr(args, "nprobe", None), ef_search=getattr(args, "ef_search", None),
+                           filters=db_search_filter.filters_from_args(args))
+    out = open(args.out, "w", encoding="utf-8") if getattr(args, "out", None) else sys.stdout
+    try:
+        for query, hits in zip(queries, results):
+            out.write(json.dumps({"query": query, "hits": [{
+                "rank": hit["rank"],
+                "collection": hit["collection"],
+                "vektor_index": hit["vektor_index"],
+                "distance": hit["distance"],
+                "id": hit["row"][0] if hit["row"] else None,
+                "primary_value": hit["row"][3] if hit["row"] else None,
+            } for hit in hits]}, ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if getattr(args, "out", None):
+        print(f"{len(queries)} Queries über {len(collections)} Collection(s) -> {args.out}")
+    return results
 
 def update_document(args, embedding_model):
-    # Lösung: Flagge alten Eintrag als gelöscht, füge neuen ein (Index bleibt append-only)
+    # In-Place-Update: ID und Vektor-ID bleiben, Vektor wird ersetzt (remove + add)
     index, index_file = load_or_create_faiss_index(args.collection, embedding_model.get_sentence_embedding_dimension())
     old_row = db_id_manager.get_by_id(args.id)
     if not old_row:
         print(f"[ERROR] ID {args.id} nicht in Registry.")
         return
-    # Optional: Registry-Flag für "deleted" setzen oder Eintrag entfernen
-    db_id_manager.delete_id(args.id)
-    # Neuen Eintrag generieren (wie ADD)
+    if old_row[1] != args.collection:
+        print(f"[ERROR] ID {args.id} gehört zu Collection '{old_row[1]}', nicht '{args.collection}'.")
+        return
     metadata = json.loads(args.metadata) if args.metadata else None
-    entity_type = args.entity_type if hasattr(args, 'entity_type') and args.entity_type else "EMAIL"
-    doc_id = db_id_manager.generate_id(
-        collection=args.collection,
-        entity_type=entity_type,
-        source=metadata.get("quelle") if metadata else None
-    )
+    entity_type = args.entity_type if hasattr(args, 'entity_type') and args.entity_type else old_row[2]
+    vektor_index = old_row[8]
+    if vektor_index is None:
+        vektor_index = db_id_manager.allocate_vektor_ids(args.collection, 1)[0]
     embedding = embedding_model.encode([args.text]).astype("float32")
-    index.add(embedding)
-    vektor_index = index.ntotal - 1
+    old_vektor_index = vektor_index
+    if not db_faiss_index.supports_remove(index):
+        # Index ohne Delete (HNSW): neue Vektor-ID, alter Vektor verwaist bis zur Reparatur
+        vektor_index = db_id_manager.allocate_vektor_ids(args.collection, 1)[0]
     db_id_manager.add_entry(
-        id=doc_id,
+        id=args.id,
         collection=args.collection,
         entity_type=entity_type,
         primary_value=args.text,
-        metadata=metadata,
-        source=metadata.get("quelle") if metadata else None,
+        metadata=metadata if metadata is not None else old_row[4],
+        source=metadata.get("quelle") if metadata else old_row[6],
         import_batch="update",
         vektor_index=vektor_index
     )
-    faiss.write_index(index, index_file)
-    print(f"Dokument aktualisiert: {doc_id} (Vektor-Index: {vektor_index})")
+    if old_vektor_index == vektor_index:
+        db_index_store.remove(index, index_file, [vektor_index])
+    db_index_store.add(index, index_file, embedding, [vektor_index])
+    journal_written(index, index_file, args.collection)
+    print(f"Dokument aktualisiert: {args.id} (Vektor-Index: {vektor_index})")
 
 def delete_document(args):
-    # Eintrag nur aus Registry entfernen; FAISS kennt kein echtes Delete!
+    # Registry-Eintrag löschen und Vektor per ID aus dem Index entfernen
+    # Nur innerhalb der angegebenen Collection: der Gateway-Server sperrt genau deren Index
+    row = db_id_manager.get_by_id(args.id)
+    if not row:
+        print(f"[ERROR] ID {args.id} nicht in Registry.")
+        return
+    if row[1] != args.collection:
+        print(f"[ERROR] ID {args.id} gehört zu Collection '{row[1]}', nicht '{args.collection}'.")
+        return
     db_id_manager.delete_id(args.id)
     print(f"Registry-Eintrag gelöscht: {args.id}")
-    print("[WARN] FAISS-Vektor verbleibt physisch bis zum periodischen Neuaufbau (empfohlen als Cronjob/Daemon).")
+    if row[8] is None:
+        return
+    index_file = db_index_manager.index_path(args.collection)
+    if not os.path.exists(index_file):
+        return
+    index, index_file = load_or_create_faiss_index(args.collection, None)
+    removed = db_index_store.remove(index, index_file, [row[8]])
+    if removed < 0:
+        print("[WARN] Index-Typ unterstützt kein Delete; Vektor verbleibt bis zum nächsten Neuaufbau.")
+        return
+    journal_written(index, index_file, args.collection)
+    print(f"Vektor {row[8]} aus Index '{index_file}' entfernt.")
 
 
 # ---------- CLI Interface ----------
@@ -117,8 +349,17 @@ def main():
     parser = argparse.ArgumentParser(
         description="Shadow Broker FAISS Gateway – CLI-Modul"
     )
+    parser.add_argument("--local", action="store_true", help="Nicht an einen laufenden Gateway-Server weiterleiten, sondern im eigenen Prozess ausführen")
+    parser.add_argument("--profile", action="store_true", help="Nach dem Kommando Zeit pro Stufe ausgeben (Model-Load, Encode, Index-Load/-Suche/-Schreiben, Registry)")
+    parser.add_argument("--profile_out", help="Zusätzlich cProfile laufen lassen und pstats in diese Datei schreiben (impliziert --profile)")
     subparsers = parser.add_subparsers(dest="command", required=True)
 
+    # SERVER
+    serve_p = subparsers.add_parser("serve", help="Startet den Gateway-Server (Model + Indizes bleiben resident).\n\nOPTIONAL: --host, --port, --workers")
+    serve_p.add_argument("--host", default=db_gateway_client.GATEWAY_HOST, help="Bind-Adresse (OPTIONAL, default: 127.0.0.1)")
+    serve_p.add_argument("--port", type=int, default=db_gateway_client.GATEWAY_PORT, help="Port (OPTIONAL, default: 8765)")
+    serve_p.add_argument("--workers", type=int, help="Anzahl Request-Threads (OPTIONAL, default: BROKER_GATEWAY_WORKERS bzw. 16)")
+
     # ADD
     add_p = subparsers.add_parser("add", help="Fügt ein Dokument hinzu.\n\nMANDATORY: --collection, --text\nOPTIONAL: --metadata (JSON), --entity_type")
     add_p.add_argument("--collection", required=True, help="Collection-Name (MANDATORY)")
@@ -128,15 +369,30 @@ def main():
     add_p.set_defaults(func=add_document)
 
     # QUERY
-    query_p = subparsers.add_parser("query", help="Semantische Suche in einer Collection.\n\nMANDATORY: --collection, --query\nOPTIONAL: --n (default: 3)")
+    query_p = subparsers.add_parser("query", help="Semantische Suche in einer Collection.\n\nMANDATORY: --collection, --query\nOPTIONAL: --n (default: 3), Filter: --source, --entity_type, --import_batch, --since, --until")
     query_p.add_argument("--collection", required=True, help="Collection-Name (MANDATORY, entspricht FAISS-Index & Registry-Feld)")
     query_p.add_argument("--query", required=True, help="Suchtext oder Frage (MANDATORY)")
     query_p.add_argument("--n", type=int, default=3, help="Anzahl der Top-Ergebnisse (OPTIONAL)")
-    # filters ist für FAISS+Registry erstmal nicht sinnvoll, weil du semantisch suchst und Filter später via Registry umsetzen könntest
+    query_p.add_argument("--nprobe", type=int, help="IVF: durchsuchte Cluster (OPTIONAL, default: aus Collection-Spezifikation)")
+    query_p.add_argument("--ef_search", type=int, help="HNSW: Suchbreite (OPTIONAL, default: aus Collection-Spezifikation)")
+    db_search_filter.add_filter_arguments(query_p)
     query_p.set_defaults(func=query_collection)
 
+    # BATCH-QUERY
+    bq_p = subparsers.add_parser("batch_query", help="Viele Queries auf einmal, optional über mehrere Collections.\n\nMANDATORY: --collections, --queries oder --file\nOPTIONAL: --n, --out, Filter wie bei query")
+    bq_p.add_argument("--collections", required=True, help="Collection-Name(n), kommagetrennt (MANDATORY)")
+    bq_src = bq_p.add_mutually_exclusive_group(required=True)
+    bq_src.add_argument("--queries", help="JSON-Array von Suchtexten")
+    bq_src.add_argument("--file", help="Datei mit Queries: JSON-Array, JSONL mit \"query\" oder eine Query pro Zeile")
+    bq_p.add_argument("--n", type=int, default=3, help="Top-Ergebnisse pro Query über alle Collections (OPTIONAL)")
+    bq_p.add_argument("--out", help="JSONL-Ausgabedatei (OPTIONAL, default: Konsole)")
+    bq_p.add_argument("--nprobe", type=int, help="IVF: durchsuchte Cluster (OPTIONAL)")
+    bq_p.add_argument("--ef_search", type=int, help="HNSW: Suchbreite (OPTIONAL)")
+    db_search_filter.add_filter_arguments(bq_p)
+    bq_p.set_defaults(func=batch_query)
+
     # UPDATE
-    upd_p = subparsers.add_parser("update", help="Dokument aktualisieren (löscht alten Eintrag und fügt neuen ein).\n\nMANDATORY: --collection, --id, --text\nOPTIONAL: --metadata, --entity_type")
+    upd_p = subparsers.add_parser("update", help="Dokument aktualisieren (ID und Vektor-ID bleiben, Vektor wird ersetzt).\n\nMANDATORY: --collection, --id, --text\nOPTIONAL: --metadata, --entity_type")
     upd_p.add_argument("--collection", required=True, help="Collection-Name (MANDATORY)")
     upd_p.add_argument("--id", required=True, help="Dokument-ID in der Registry (MANDATORY, nicht im FAISS-Index!)")
     upd_p.add_argument("--text", required=True, help="Neuer Text (MANDATORY)")
@@ -145,7 +401,7 @@ def main():
     upd_p.set_defaults(func=update_document)
 
     # DELETE
-    del_p = subparsers.add_parser("delete", help="Dokument löschen (aus Registry).\n\nMANDATORY: --collection, --id")
+    del_p = subparsers.add_parser("delete", help="Dokument löschen (aus Registry und Index).\n\nMANDATORY: --collection, --id")
     del_p.add_argument("--collection", required=True, help="Collection-Name (MANDATORY)")
     del_p.add_argument("--id", required=True, help="Dokument-ID in der Registry (MANDATORY)")
     del_p.set_defaults(func=delete_document)
@@ -159,27 +415,36 @@ def main():
     batch_p.set_defaults(func=db_batch_insert.batch_insert)
 
     # Export
-    exp_p = subparsers.add_parser("export", help="Registry + FAISS-Index exportieren.\n\nMANDATORY: --collection\nOPTIONAL: --out (default: export.jsonl)")
+    exp_p = subparsers.add_parser("export", help="Collection streamend exportieren (JSONL + .npy + Manifest).\n\nMANDATORY: --collection\nOPTIONAL: --out, --compress, --chunk_rows")
     exp_p.add_argument("--collection", required=True, help="Collection-Name (MANDATORY)")
-    exp_p.add_argument("--out", default="export.jsonl", help="JSONL-Dateiname für Registry-Export (OPTIONAL)")
-    exp_p.set_defaults(func=db_export_import.export_registry_and_vectors)
+    exp_p.add_argument("--out", help="Dateipräfix (OPTIONAL, default: <collection>_export -> .jsonl/.npy/.manifest.json)")
+    exp_p.add_argument("--compress", action="store_true", help="gzip-komprimiert schreiben (OPTIONAL)")
+    exp_p.add_argument("--chunk_rows", type=int, default=db_export_import.EXPORT_CHUNK, help="Zeilen pro Block (OPTIONAL)")
+    exp_p.set_defaults(func=db_export_import.export_collection)
 
     # Import
-    imp_p = subparsers.add_parser("import", help="Registry + FAISS-Index importieren.\n\nMANDATORY: --collection, --file")
-    imp_p.add_argument("--collection", required=True, help="Collection-Name (MANDATORY)")
-    imp_p.add_argument("--file", required=True, help="JSONL-Datei für Registry-Import (MANDATORY)")
-    # Du kannst hier später optional noch --faiss hinzufügen, für Index-Datei
-    imp_p.set_defaults(func=db_export_import.import_registry_and_vectors)
+    imp_p = subparsers.add_parser("import", help="Export (JSONL + .npy) in eine Collection übernehmen, ohne neu zu embedden.\n\nMANDATORY: --collection, --file\nOPTIONAL: --chunk_rows")
+    imp_p.add_argument("--collection", required=True, help="Ziel-Collection (MANDATORY, wird bei Bedarf angelegt)")
+    imp_p.add_argument("--file", required=True, help="Export-Präfix, Manifest oder JSONL-Datei (MANDATORY)")
+    imp_p.add_argument("--chunk_rows", type=int, default=db_export_import.IMPORT_CHUNK, help="Zeilen pro Block (OPTIONAL)")
+    imp_p.set_defaults(func=db_export_import.import_collection)
 
     # Collection Management
     list_p = subparsers.add_parser("list_collections", help="Alle genutzten Collections anzeigen.")
     list_p.set_defaults(func=db_collection_management.list_collections)
 
-    create_p = subparsers.add_parser("create_collection", help="Neue Collection (Index) anlegen.\n\nMANDATORY: --name")
+    create_p = subparsers.add_parser("create_collection", help="Neue Collection (Index) anlegen.\n\nMANDATORY: --name\nOPTIONAL: --dim, --index_type + Parameter")
     create_p.add_argument("--name", required=True, help="Name der Collection (MANDATORY)")
-    # Für create_collection könnte ein --dim Argument (Dimension des Embeddings) sinnvoll sein
+    create_p.add_argument("--dim", type=int, help="Embedding-Dimension (OPTIONAL, default: Dimension des Models)")
+    _add_index_spec_arguments(create_p)
     create_p.set_defaults(func=db_collection_management.create_collection)
 
+    train_p = subparsers.add_parser("train_collection", help="IVF/PQ-Index auf Registry-Stichprobe trainieren und neu aufbauen.\n\nMANDATORY: --name\nOPTIONAL: --sample, --index_type + Parameter (Typwechsel)")
+    train_p.add_argument("--name", required=True, help="Name der Collection (MANDATORY)")
+    train_p.add_argument("--sample", type=int, help="Max. Anzahl Trainingsvektoren (OPTIONAL, default: 100000)")
+    _add_index_spec_arguments(train_p)
+    train_p.set_defaults(func=db_collection_management.train_collection)
+
     drop_p = subparsers.add_parser("drop_collection", help="Collection (Index + Registry-Einträge) löschen.\n\nMANDATORY: --name")
     drop_p.add_argument("--name", required=True, help="Name der Collection (MANDATORY)")
     drop_p.set_defaults(func=db_collection_management.drop_collection)
@@ -189,19 +454,50 @@ def main():
     health_p.add_argument("--collection", required=True, help="Collection-Name (MANDATORY)")
     health_p.set_defaults(func=db_healthchecks.registry_healthcheck)
 
-    stats_p = subparsers.add_parser("stats", help="Eintragszahlen aller Collections.")
+    stats_p = subparsers.add_parser("stats", help="Eintragszahlen aller Collections.\n\nOPTIONAL: --details, --metrics")
+    stats_p.add_argument("--details", action="store_true", help="Zeitraum und Entity-Typen pro Collection anzeigen (OPTIONAL)")
+    stats_p.add_argument("--metrics", action="store_true", help="Metriken im Prometheus-Textformat ausgeben (Latenzen, Zähler, Gauges pro Collection; beim laufenden Gateway-Server dessen Werte) (OPTIONAL)")
     stats_p.set_defaults(func=db_healthchecks.db_stats)
 
     # Logging ist in den einzelnen Funktionen nutzbar
     # logger.log_event("xy") überall im Code verwenden
 
     args = parser.parse_args()
-    # Embedding Model
-    MODEL_NAME = "all-MiniLM-L6-v2"
-    EMBEDDING_MODEL = SentenceTransformer(MODEL_NAME)
-    INDEX_DIR = "./faiss_indices"
-    os.makedirs(INDEX_DIR, exist_ok=True)
-    
+    if args.profile_out:
+        # Absoluter Pfad, damit der Gateway-Server die Datei am erwarteten Ort schreibt
+        args.profile_out = os.path.abspath(args.profile_out)
+
+    # Läuft ein Gateway-Server, wird das Kommando dorthin weitergereicht:
+    # kein torch-Import, kein Model-Load, kein Index-Read in diesem Prozess.
+    if args.command != "serve" and not args.local:
+        response = db_gateway_client.forward(args)
+        if response is not None:
+            if response.get("output"):
+                sys.stdout.write(response["output"])
+            if not response.get("ok"):
+                print(f"[ERROR] Gateway-Server: {response.get('error')}")
+                sys.exit(1)
+            return
+
+    # Embedding Model (gemeinsame Engine, torch wird erst beim ersten encode geladen)
+    EMBEDDING_MODEL = db_embedding.get_engine()
+
+    if args.command == "serve":
+        import db_gateway_server
+        db_gateway_server.serve(EMBEDDING_MODEL, host=args.host, port=args.port,
+                                workers=args.workers or db_gateway_server.GATEWAY_WORKERS)
+        return
+    dispatch(args, EMBEDDING_MODEL)
+
+def dispatch(args, EMBEDDING_MODEL):
+    """Führt ein geparstes Kommando aus (lokal oder im Gateway-Server); --profile: mit Stufen-Aufschlüsselung."""
+    if getattr(args, "profile", False) or getattr(args, "profile_out", None):
+        with db_trace.profile(getattr(args, "profile_out", None)):
+            _dispatch(args, EMBEDDING_MODEL)
+    else:
+        _dispatch(args, EMBEDDING_MODEL)
+
+def _dispatch(args, EMBEDDING_MODEL):
     if args.command == "add":
         add_document(args, EMBEDDING_MODEL)
         db_logger.log_event(f"Dokument hinzugefügt: {args.text[:80]}...")
@@ -210,6 +506,10 @@ def main():
         query_collection(args, EMBEDDING_MODEL)
         db_logger.log_event(f"Query ausgeführt: '{args.query}' in {args.collection}")
 
+    elif args.command == "batch_query":
+        results = batch_query(args, EMBEDDING_MODEL)
+        db_logger.log_event(f"Batch-Query ausgeführt: {len(results)} Queries in {args.collections}")
+
     elif args.command == "update":
         update_document(args, EMBEDDING_MODEL)
         db_logger.log_event(f"Dokument aktualisiert: {args.id}")
@@ -226,26 +526,24 @@ def main():
         texts = json.loads(args.texts)
         metadatas = json.loads(args.metadatas) if args.metadatas else None
         ids, vektor_indices = db_batch_insert.batch_insert(
-            index, texts, args.collection, metadatas=metadatas
+            index, texts, args.collection, metadatas=metadatas,
+            embedding_model=EMBEDDING_MODEL, index_file=index_file
         )
-        faiss.write_index(index, index_file)
+        journal_written(index, index_file, args.collection)
         db_logger.log_event(f"Batch-Insert in {args.collection}: {len(ids)} Dokumente")
 
     elif args.command == "export":
-        out_jsonl, out_index = db_export_import.export_registry_and_vectors(
-            out_jsonl=args.out,
-            faiss_index=load_or_create_faiss_index(
-                args.collection, EMBEDDING_MODEL.get_sentence_embedding_dimension()
-            )[0],
-            out_faiss=f"{args.collection}.index"
+        manifest = db_export_import.export_collection(
+            args.collection, out=args.out, compress=args.compress, chunk_rows=args.chunk_rows
         )
-        db_logger.log_event(f"Export {args.collection} -> {out_jsonl} & {out_index}")
+        db_logger.log_event(f"Export {args.collection}: {manifest['rows']} Zeilen, {manifest['vectors']} Vektoren, {manifest['rows_per_s']} Zeilen/s")
 
-    elif args.command == "import_":
-        db_export_import.import_registry_and_vectors(
-            args.file, f"{args.collection}.index"
+    elif args.command == "import":
+        stats = db_export_import.import_collection(
+            args.file, collection=args.collection, chunk_rows=args.chunk_rows, embedding_model=EMBEDDING_MODEL
         )
-        db_logger.log_event(f"Import in {args.collection}: aus {args.file} + {args.collection}.index")
+        db_logger.log_event(f"Import in {args.collection} aus {args.file}: {stats['imported']} übernommen, "
+                            f"{stats['skipped_id'] + stats['skipped_content']} Duplikate, {stats['embedded']} embedded")
 
     elif args.command == "list_collections":
         result = db_collection_management.list_collections()
@@ -254,25 +552,41 @@ def main():
 
     elif args.command == "create_collection":
         # Dimension der Embeddings muss bekannt sein!
+        spec = index_spec_from_args(args)
         out_file = db_collection_management.create_collection(
-            args.name, EMBEDDING_MODEL.get_sentence_embedding_dimension()
+            args.name, args.dim or EMBEDDING_MODEL.get_sentence_embedding_dimension(), index_spec=spec
+        )
+        db_logger.log_event(f"Collection erstellt: {args.name} ({out_file}, {(spec or {'type': 'Flat'})['type']})")
+
+    elif args.command == "train_collection":
+        n = db_collection_management.train_collection(
+            args.name, EMBEDDING_MODEL.get_sentence_embedding_dimension(),
+            index_spec=index_spec_from_args(args), sample_size=args.sample
         )
-        db_logger.log_event(f"Collection erstellt: {args.name} ({out_file})")
+        print(f"Collection '{args.name}' trainiert und neu aufgebaut: {n} Einträge.")
+        db_logger.log_event(f"Collection trainiert: {args.name} ({n} Einträge)")
 
     elif args.command == "drop_collection":
         db_collection_management.drop_collection(args.name)
         db_logger.log_event(f"Collection gelöscht: {args.name}")
 
     elif args.command == "healthcheck":
-        ok, count = db_healthchecks.registry_healthcheck()
+        ok, count = db_healthchecks.registry_healthcheck(args.collection)
         print(f"Registry OK: {ok} – Einträge: {count}")
-        index_ok, n_vecs = db_healthchecks.faiss_healthcheck(f"{args.collection}.index")
+        index_ok, n_vecs = db_healthchecks.faiss_healthcheck(db_index_manager.index_path(args.collection))
         print(f"FAISS-Index OK: {index_ok} – Vektoren: {n_vecs}")
         db_logger.log_event(f"Healthcheck {args.collection}: Registry OK={ok}, N={count} | Index OK={index_ok}, V={n_vecs}")
 
     elif args.command == "stats":
-        stats = db_healthchecks.db_stats()
-        print(stats)
+        if getattr(args, "metrics", False):
+            db_metrics.register_collector(db_healthchecks.update_collection_gauges)
+            sys.stdout.write(db_metrics.render())
+        elif getattr(args, "details", False):
+            for entry in db_healthchecks.db_stats_detailed():
+                print(json.dumps(entry, ensure_ascii=False))
+        else:
+            stats = db_healthchecks.db_stats()
+            print(stats)
         db_logger.log_event("Stats aufgerufen.")
 
 if __name__ == "__main__":
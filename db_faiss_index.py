@@ -0,0 +1,294 @@
+# faiss_index.py
+#
+# FAISS-Schicht: Indizes mit stabilen 64-Bit-Vektor-IDs.
+# Die Registry-Spalte vektor_index ist die Vektor-ID, kein Positions-Offset mehr.
+# Dadurch funktionieren echte Deletes (remove_ids) und In-Place-Updates
+# (remove + add mit derselben ID) ohne Neuaufbau.
+#
+# Index-Typen pro Collection (Spezifikation als Dict, gespeichert in collection_meta):
+#   {"type": "Flat"}                                          exakt, Brute-Force
+#   {"type": "IVFFlat", "nlist": 1024, "nprobe": 16}          invertierte Listen
+#   {"type": "IVFPQ", "nlist": 1024, "m": 16, "nbits": 8, "nprobe": 16}   komprimiert
+#   {"type": "HNSWFlat", "m": 32, "ef_construction": 40, "ef_search": 64} Graph (kein Delete)
+# IVF-Typen müssen trainiert werden (train_collection bzw. rebuild_faiss_index).
+
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("Flat", "IVFFlat", "IVFPQ", "HNSWFlat")
+EXACT_INDEX_TYPES = ("Flat", "IVFFlat", "HNSWFlat")  # speichern die Vektoren unkomprimiert (siehe vectors_exact)
+
+_SPEC_DEFAULTS = {
+    "Flat": {},
+    "IVFFlat": {"nlist": 100, "nprobe": 8},
+    "IVFPQ": {"nlist": 100, "m": 8, "nbits": 8, "nprobe": 8},
+    "HNSWFlat": {"m": 32, "ef_construction": 40, "ef_search": 64},
+}
+
+def normalize_spec(spec=None):
+    """Ergänzt eine (evtl. unvollständige) Index-Spezifikation um Default-Parameter."""
+    spec = dict(spec or {"type": "Flat"})
+    index_type = spec.get("type", "Flat")
+    if index_type not in _SPEC_DEFAULTS:
+        raise ValueError(f"Unbekannter Index-Typ '{index_type}' (erlaubt: {', '.join(INDEX_TYPES)})")
+    out = {"type": index_type}
+    for key, default in _SPEC_DEFAULTS[index_type].items():
+        value = spec.get(key)
+        out[key] = int(value) if value is not None else default
+    return out
+
+def needs_training(spec):
+    return normalize_spec(spec)["type"] in ("IVFFlat", "IVFPQ")
+
+def min_training_size(spec):
+    """Mindestanzahl Trainingsvektoren, darunter bricht FAISS das Clustering ab."""
+    spec = normalize_spec(spec)
+    if spec["type"] == "IVFFlat":
+        return spec["nlist"]
+    if spec["type"] == "IVFPQ":
+        return max(spec["nlist"], 2 ** spec["nbits"])
+    return 0
+
+def factory_string(spec):
+    spec = normalize_spec(spec)
+    if spec["type"] == "Flat":
+        return "IDMap2,Flat"
+    if spec["type"] == "IVFFlat":
+        return f"IVF{spec['nlist']},Flat"          # IVF verwaltet IDs selbst
+    if spec["type"] == "IVFPQ":
+        return f"IVF{spec['nlist']},PQ{spec['m']}x{spec['nbits']}"
+    return f"IDMap2,HNSW{spec['m']}"
+
+def create_index(dim, spec=None):
+    """Neuer leerer Index mit ID-Unterstützung gemäß Spezifikation (default: Flat)."""
+    spec = normalize_spec(spec)
+    index = faiss.index_factory(dim, factory_string(spec))
+    if spec["type"] == "HNSWFlat":
+        faiss.downcast_index(index.index).hnsw.efConstruction = spec["ef_construction"]
+    apply_search_params(index, spec)
+    return index
+
+def apply_search_params(index, spec=None, nprobe=None, ef_search=None):
+    """
+    Setzt Suchparameter (nprobe für IVF, efSearch für HNSW) dauerhaft auf den Index; explizite Werte
+    haben Vorrang. Nur beim Laden/Erzeugen – Werte pro Query über search_params().
+    """
+    spec = normalize_spec(spec) if spec else {}
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        value = nprobe or spec.get("nprobe")
+        if value:
+            ivf.nprobe = int(value)
+        return
+    inner = faiss.downcast_index(index.index) if has_id_map(index) else index
+    if hasattr(inner, "hnsw"):
+        value = ef_search or spec.get("ef_search")
+        if value:
+            inner.hnsw.efSearch = int(value)
+
+def search_params(index, nprobe=None, ef_search=None, selector=None, exhaustive=False):
+    """
+    Suchparameter für einen einzelnen Aufruf (index.search(..., params=...)), statt Werte auf den
+    geteilten, residenten Index zu schreiben. Nicht gesetzte Werte: die des Index (Collection-Spezifikation).
+    exhaustive: IVF durchsucht alle Listen (kleine gefilterte Teilmengen). None, wenn nichts abweicht.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        if not nprobe and not exhaustive and selector is None:
+            return None
+        params = faiss.SearchParametersIVF()
+        params.nprobe = ivf.nlist if exhaustive else int(nprobe or ivf.nprobe)
+    else:
+        inner = faiss.downcast_index(index.index) if has_id_map(index) else index
+        if hasattr(inner, "hnsw"):
+            if not ef_search and selector is None:
+                return None
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = int(ef_search or inner.hnsw.efSearch)
+        elif selector is None:
+            return None
+        else:
+            params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
+
+def train_index(index, vectors):
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if not index.is_trained:
+        index.train(vectors)
+
+def has_id_map(index):
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2))
+
+def is_legacy_index(index):
+    """Alter positionsbasierter Index (IndexFlatL2 ohne ID-Mapping)?"""
+    return not has_id_map(index) and faiss.try_extract_index_ivf(index) is None
+
+def _as_ids(ids):
+    return np.asarray(ids, dtype="int64").reshape(-1)
+
+def add_vectors(index, vectors, ids):
+    """Fügt Vektoren mit den gegebenen Vektor-IDs hinzu."""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    index.add_with_ids(vectors, _as_ids(ids))
+
+def supports_remove(index):
+    """HNSW kann keine Vektoren entfernen (remove_ids wirft RuntimeError)."""
+    inner = faiss.downcast_index(index.index) if has_id_map(index) else index
+    return not hasattr(inner, "hnsw")
+
+def remove_vectors(index, ids):
+    """
+    Entfernt Vektoren per ID, gibt die Anzahl entfernter Vektoren zurück.
+    Index-Typen ohne Delete-Unterstützung (z. B. HNSW) liefern -1.
+    """
+    ids = _as_ids(ids)
+    if len(ids) == 0:
+        return 0
+    try:
+        return int(index.remove_ids(ids))
+    except RuntimeError:
+        return -1
+
+def index_ids(index):
+    """Alle im Index enthaltenen Vektor-IDs als int64-Array."""
+    if has_id_map(index):
+        return faiss.vector_to_array(index.id_map).astype("int64")
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        invlists = ivf.invlists
+        parts = []
+        for list_no in range(ivf.nlist):
+            size = invlists.list_size(list_no)
+            if size:
+                parts.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy())
+        return np.concatenate(parts).astype("int64") if parts else np.zeros(0, dtype="int64")
+    return np.arange(index.ntotal, dtype="int64")
+
+def is_ivf_flat(index):
+    ivf = faiss.try_extract_index_ivf(index)
+    return ivf is not None and type(faiss.downcast_index(ivf)) is faiss.IndexIVFFlat
+
+def ivf_flat_vectors(index, ids):
+    """
+    Vektoren zu Vektor-IDs direkt aus den invertierten Listen eines IVFFlat-Index (Codes sind die
+    float32-Vektoren): ohne Direct-Map, ohne den Index zu verändern (auch bei mmap) und ohne Lock.
+    Gibt (vectors, found_ids) zurück; IDs, die nicht im Index liegen, fehlen in found_ids.
+    Kosten: ein Abgleich aller Listen-IDs, Kopien nur für die Treffer.
+    """
+    ivf = faiss.downcast_index(faiss.try_extract_index_ivf(index))
+    invlists = ivf.invlists
+    sizes = np.array([invlists.list_size(list_no) for list_no in range(ivf.nlist)], dtype="int64")
+    lists = np.flatnonzero(sizes)
+    if not len(lists):
+        return np.zeros((0, ivf.d), dtype="float32"), np.zeros(0, dtype="int64")
+    list_ids = [faiss.rev_swig_ptr(invlists.get_ids(int(list_no)), int(sizes[list_no])) for list_no in lists]
+    hit = np.isin(np.concatenate(list_ids), _as_ids(ids))
+    vectors, found = [], []
+    offset = 0
+    for list_no, ids_in_list in zip(lists.tolist(), list_ids):
+        size = len(ids_in_list)
+        positions = np.flatnonzero(hit[offset:offset + size])
+        offset += size
+        if len(positions):
+            codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * ivf.code_size)
+            vectors.append(codes.view("float32").reshape(size, ivf.d)[positions])
+            found.append(ids_in_list[positions].astype("int64"))
+    if not found:
+        return np.zeros((0, ivf.d), dtype="float32"), np.zeros(0, dtype="int64")
+    return np.concatenate(vectors), np.concatenate(found)
+
+_direct_map_lock = threading.Lock()
+
+@contextmanager
+def reconstruct_access(index):
+    """
+    Ermöglicht reconstruct per Vektor-ID: IVF-Indizes bekommen dafür vorübergehend eine
+    Hashtable-Direct-Map (auch bei mmap, die Listen selbst bleiben unverändert).
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        yield index
+        return
+    with _direct_map_lock:
+        temporary = ivf.direct_map.type == faiss.DirectMap.NoMap
+        if temporary:
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        try:
+            yield index
+        finally:
+            if temporary:
+                ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+
+def vectors_exact(index):
+    """
+    Liefert reconstruct die Originalvektoren? Nur für unkomprimiert gespeicherte Indizes
+    (Flat, IDMap2 über Flat, IVFFlat, HNSWFlat); PQ/SQ-Varianten liefern Näherungen.
+    """
+    inner = faiss.downcast_index(index.index if has_id_map(index) else index)
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        # try_extract_index_ivf liefert die Basisklasse IndexIVF, erst downcast zeigt PQ/SQ
+        return isinstance(faiss.downcast_index(ivf), faiss.IndexIVFFlat)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    return isinstance(inner, faiss.IndexFlat)
+
+def reconstruct_vectors(index, ids):
+    """
+    Vektoren zu Vektor-IDs (innerhalb von reconstruct_access aufrufen).
+    Gibt (vectors, found) zurück; fehlende IDs ergeben NaN-Zeilen und found=False.
+    """
+    ids = _as_ids(ids)
+    try:
+        return index.reconstruct_batch(ids), np.ones(len(ids), dtype=bool)
+    except RuntimeError:
+        pass
+    # Mindestens eine ID fehlt im Index (Abgleich durch den Daemon steht aus): einzeln holen
+    vectors = np.full((len(ids), index.d), np.nan, dtype="float32")
+    found = np.zeros(len(ids), dtype=bool)
+    for i, vid in enumerate(ids.tolist()):
+        try:
+            vectors[i] = index.reconstruct(vid)
+            found[i] = True
+        except RuntimeError:
+            continue
+    return vectors, found
+
+def write_index_atomic(index, index_file):
+    """
+    Schreibt den Index in eine temporäre Datei und ersetzt die alte per Rename.
+    Leser (Gateway, Daemon) sehen immer entweder die alte oder die neue vollständige Datei.
+    """
+    tmp_file = f"{index_file}.tmp"
+    faiss.write_index(index, tmp_file)
+    with open(tmp_file, "rb+") as f:
+        os.fsync(f.fileno())  # Inhalt auf Platte, bevor der Rename sichtbar wird
+    os.replace(tmp_file, index_file)
+
+# FourCC-Codes, deren Datei mit dem Standard-Index-Header beginnt (d: int32, ntotal: int64)
+_HEADER_FOURCCS = {b"IxM2", b"IxMp", b"IxF2", b"IxFI", b"IxFl", b"IwFl", b"IwPQ", b"IwFd", b"IHNf", b"IHNp", b"IxPQ"}
+
+def read_index_header(index_file):
+    """
+    Liest nur den Dateikopf eines FAISS-Index ({"fourcc", "d", "ntotal"}) ohne den
+    Index zu deserialisieren. Unbekannte Formate werden voll eingelesen (Fallback).
+    """
+    with open(index_file, "rb") as f:
+        head = f.read(16)
+    if len(head) == 16:
+        fourcc, d, ntotal = struct.unpack("<4siq", head)
+        if fourcc in _HEADER_FOURCCS:
+            return {"fourcc": fourcc.decode("ascii"), "d": d, "ntotal": ntotal}
+    # mmap statt voller Kopie, soweit die FAISS-Version es kann
+    flags = getattr(faiss, "IO_FLAG_MMAP", 0) | getattr(faiss, "IO_FLAG_READ_ONLY", 0)
+    index = faiss.read_index(index_file, flags) if flags else faiss.read_index(index_file)
+    return {"fourcc": None, "d": index.d, "ntotal": index.ntotal}
@@ -0,0 +1,90 @@
+# gateway_client.py
+#
+# Schlanker Client für den Gateway-Server (db_gateway_server.py).
+# Importiert bewusst weder torch noch faiss, damit ein CLI-Aufruf in
+# Millisekunden an den laufenden Server weitergereicht werden kann.
+
+import json
+import os
+import urllib.error
+import urllib.request
+
+GATEWAY_HOST = os.environ.get("BROKER_GATEWAY_HOST", "127.0.0.1")
+GATEWAY_PORT = int(os.environ.get("BROKER_GATEWAY_PORT", "8765"))
+GATEWAY_TIMEOUT = 600  # Sekunden; Batch-Inserts können dauern
+# Gemeinsames Geheimnis: der Server schreibt bei jedem Start ein neues Token (Modus 0600) ins
+# Index-Verzeichnis, nur Prozesse mit Lesezugriff darauf dürfen Kommandos schicken
+GATEWAY_TOKEN_FILE = os.environ.get("BROKER_GATEWAY_TOKEN_FILE") or os.path.join(os.environ.get("BROKER_INDEX_DIR", "."), ".gateway_token")
+TOKEN_HEADER = "X-Broker-Token"
+
+def gateway_url(path, host=None, port=None):
+    return f"http://{host or GATEWAY_HOST}:{port or GATEWAY_PORT}{path}"
+
+def read_token(path=None):
+    """Token des laufenden Servers oder None (Datei fehlt / nicht lesbar)."""
+    try:
+        with open(path or GATEWAY_TOKEN_FILE, encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def is_running(host=None, port=None, timeout=0.5):
+    """Prüft, ob ein Gateway-Server erreichbar ist."""
+    try:
+        with urllib.request.urlopen(gateway_url("/health", host, port), timeout=timeout) as resp:
+            return resp.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+def send_command(command, params, host=None, port=None, timeout=GATEWAY_TIMEOUT):
+    """
+    Schickt ein Kommando (add, query, update, delete, batch_insert, ...) an den Server.
+    params: Dict mit denselben Feldern wie die argparse-Argumente des Subcommands.
+    Gibt das Antwort-Dict zurück ({"ok": bool, "output": str, "error": str})
+    oder None, wenn kein Server läuft (Verbindung beim Aufbau abgelehnt).
+    Timeouts, HTTP-Fehler und Abbrüche nach dem Senden liefern ein Fehler-Dict:
+    das Kommando kann dann schon ausgeführt sein und darf nicht lokal wiederholt werden.
+    """
+    payload = dict(params)
+    payload["command"] = command
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    token = read_token()
+    if token:
+        headers[TOKEN_HEADER] = token
+    req = urllib.request.Request(
+        gateway_url("/command", host, port),
+        data=body,
+        headers=headers,
+        method="POST"
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        # Server läuft, hat aber einen Fehler gemeldet
+        try:
+            return json.loads(e.read().decode("utf-8"))
+        except Exception:
+            return {"ok": False, "output": "", "error": f"HTTP {e.code}"}
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, ConnectionRefusedError):
+            return None  # Kein Server: nichts gesendet, Aufrufer darf lokal ausführen
+        return _failed(e.reason)
+    except (OSError, ValueError) as e:
+        # Timeout/Abbruch nach dem Senden: der Server hat das Kommando evtl. schon ausgeführt,
+        # daher kein lokaler Zweitversuch (Inserts/Imports würden doppelt geschrieben)
+        return _failed(e)
+
+def _failed(reason):
+    return {"ok": False, "output": "", "error": f"Gateway-Server antwortet nicht ({type(reason).__name__}: {reason}); "
+                                                "Kommando wurde evtl. bereits ausgeführt, kein lokaler Zweitversuch."}
+
+def forward(args):
+    """
+    Reicht ein geparstes argparse-Namespace an den Server weiter.
+    Gibt None zurück, wenn kein Server läuft (Aufrufer arbeitet dann lokal),
+    sonst das Antwort- bzw. Fehler-Dict von send_command.
+    """
+    params = {k: v for k, v in vars(args).items() if k not in ("func", "command") and not callable(v)}
+    return send_command(args.command, params)
@@ -0,0 +1,304 @@
+# gateway_server.py
+#
+# Langlaufender Gateway-Dienst: hält Embedding-Model und Collection-Indizes
+# (db_index_manager: LRU mit Speicherbudget) resident und nimmt Kommandos per localhost-HTTP entgegen. Spart pro Insert/Query
+# den Import von torch, das Laden des Models und das Einlesen der .index-Datei.
+#
+# Start:   python db_faiss_gateway.py serve [--host 127.0.0.1] [--port 8765]
+# Metriken: GET /metrics (Prometheus-Textformat, db_metrics)
+# Worker:  feste Anzahl langlebiger Threads (BROKER_GATEWAY_WORKERS, default 16), damit die
+#          thread-lokalen Registry-Verbindungen über Requests hinweg wiederverwendet werden
+# Client:  db_gateway_client.py (wird von db_faiss_gateway.main automatisch genutzt)
+# Idle:    Collections ohne Schreibzugriff seit BROKER_GATEWAY_IDLE_COMPACT_S (default 30 s)
+#          bekommen einen Snapshot, damit Queries den Index wieder per mmap lesen (db_index_store)
+# Zugriff: POST /command nur mit Content-Type application/json, ohne Origin-Header (kein
+#          Browser-Request, CSRF) und mit dem Token aus GATEWAY_TOKEN_FILE (X-Broker-Token)
+
+import argparse
+import hmac
+import io
+import json
+import os
+import queue
+import secrets
+import sys
+import threading
+import time
+import traceback
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import db_faiss_gateway
+import db_healthchecks
+import db_id_manager
+import db_metrics
+from db_gateway_client import GATEWAY_HOST, GATEWAY_PORT, GATEWAY_TOKEN_FILE, TOKEN_HEADER
+
+# Kommandos, die den Index einer Collection verändern (exklusiver Zugriff)
+WRITE_COMMANDS = {"add", "update", "delete", "batch_insert", "import", "create_collection", "drop_collection", "train_collection"}
+GATEWAY_WORKERS = int(os.environ.get("BROKER_GATEWAY_WORKERS", "16"))
+IDLE_COMPACT_SECONDS = float(os.environ.get("BROKER_GATEWAY_IDLE_COMPACT_S", "30"))  # 0 = aus
+
+
+class _ThreadLocalStdout(io.TextIOBase):
+    """
+    Leitet print()/rich-Ausgaben des aktuellen Request-Threads in einen Puffer um,
+    damit der Client dieselbe Ausgabe sieht wie beim lokalen Aufruf.
+    Andere Threads schreiben weiter auf das echte stdout.
+    """
+    def __init__(self, real):
+        self._real = real
+        self._local = threading.local()
+
+    def start_capture(self):
+        self._local.buf = io.StringIO()
+
+    def stop_capture(self):
+        buf = getattr(self._local, "buf", None)
+        self._local.buf = None
+        return buf.getvalue() if buf else ""
+
+    def write(self, s):
+        buf = getattr(self._local, "buf", None)
+        if buf is not None:
+            return buf.write(s)
+        return self._real.write(s)
+
+    def flush(self):
+        self._real.flush()
+
+    def isatty(self):
+        return False
+
+
+class _RWLock:
+    """Einfacher Reader/Writer-Lock: viele parallele Queries, Schreiben exklusiv."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class _WorkerPoolHTTPServer(HTTPServer):
+    """
+    HTTP-Server mit fester Anzahl langlebiger Worker-Threads. ThreadingHTTPServer startet
+    pro Request einen neuen Thread und damit eine neue SQLite-Verbindung (db_id_manager
+    hält sie thread-lokal); hier bleibt es bei höchstens einer Verbindung pro Worker.
+    Weitere Requests warten in der Queue, bis ein Worker frei ist.
+    """
+    def __init__(self, server_address, handler_class, workers=GATEWAY_WORKERS):
+        workers = max(1, workers)
+        super().__init__(server_address, handler_class)
+        self._requests = queue.Queue()
+        self._workers = [threading.Thread(target=self._work, name=f"gateway-worker-{i}", daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def _work(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+        db_id_manager.close_connection()
+
+    def server_close(self):
+        super().server_close()
+        for _ in self._workers:
+            self._requests.put(None)
+
+
+class GatewayServer:
+    def __init__(self, embedding_model, idle_compact_seconds=IDLE_COMPACT_SECONDS):
+        self.embedding_model = embedding_model
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._last_write = {}  # Collection -> time.monotonic() des letzten Schreibkommandos
+        self._stdout = _ThreadLocalStdout(sys.stdout)
+        sys.stdout = self._stdout
+        self.idle_compact_seconds = idle_compact_seconds
+        if idle_compact_seconds > 0:
+            threading.Thread(target=self._compact_idle_loop, name="gateway-idle-compact", daemon=True).start()
+
+    def _compact_idle_loop(self):
+        while True:
+            time.sleep(max(1.0, self.idle_compact_seconds / 4))
+            self.compact_idle()
+
+    def compact_idle(self, now=None):
+        """
+        Schreibt für Collections, die seit idle_compact_seconds nicht verändert wurden, das Journal
+        in einen Snapshot (exklusiv wie ein Schreibkommando). Gibt die kompaktierten Collections zurück.
+        """
+        now = time.monotonic() if now is None else now
+        done = []
+        for collection, stamp in list(self._last_write.items()):
+            if now - stamp < self.idle_compact_seconds:
+                continue
+            lock = self._lock_for(collection)
+            lock.acquire_write()
+            try:
+                if self._last_write.get(collection) != stamp:
+                    continue  # inzwischen wieder geschrieben
+                del self._last_write[collection]
+                if db_faiss_gateway.compact_index(collection):
+                    done.append(collection)
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                lock.release_write()
+        return done
+
+    def _lock_for(self, collection):
+        with self._locks_guard:
+            if collection not in self._locks:
+                self._locks[collection] = _RWLock()
+            return self._locks[collection]
+
+    def execute(self, params):
+        """Führt ein Kommando aus und gibt (ok, output, error) zurück."""
+        args = argparse.Namespace(**params)
+        collection = getattr(args, "collection", None) or getattr(args, "name", None)
+        collections = [collection] if collection else []
+        if getattr(args, "collections", None):
+            # batch_query über mehrere Collections: Locks in fester Reihenfolge (kein Deadlock)
+            collections = sorted({c.strip() for c in args.collections.split(",") if c.strip()})
+        locks = [self._lock_for(c) for c in collections]
+        write = args.command in WRITE_COMMANDS
+        for lock in locks:
+            lock.acquire_write() if write else lock.acquire_read()
+        self._stdout.start_capture()
+        try:
+            db_faiss_gateway.dispatch(args, self.embedding_model)
+            return True, self._stdout.stop_capture(), None
+        except Exception as e:
+            output = self._stdout.stop_capture()
+            traceback.print_exc(file=sys.stderr)
+            return False, output, f"{type(e).__name__}: {e}"
+        finally:
+            if write:
+                for c in collections:
+                    self._last_write[c] = time.monotonic()
+            for lock in reversed(locks):
+                lock.release_write() if write else lock.release_read()
+
+
+def write_token(path=GATEWAY_TOKEN_FILE):
+    """Neues Zugriffstoken erzeugen und nur für den Besitzer lesbar ablegen (Temp-Datei + Rename)."""
+    token = secrets.token_hex(32)
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+    os.replace(tmp, path)
+    return token
+
+
+def _make_handler(server, token):
+    class GatewayRequestHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"ok": True})
+            elif self.path.split("?")[0] == "/metrics":
+                body = db_metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", db_metrics.CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._reply(404, {"ok": False, "error": "not found"})
+
+        def _rejection(self):
+            """Grund, einen Kommando-Request abzulehnen, oder None."""
+            if self.headers.get("Origin") is not None:
+                return "Requests aus dem Browser (Origin-Header) sind nicht erlaubt"
+            content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+            if content_type != "application/json":
+                return "Content-Type muss application/json sein"
+            if not hmac.compare_digest((self.headers.get(TOKEN_HEADER) or "").encode("utf-8"), token.encode("utf-8")):
+                return f"Token fehlt oder ist falsch ({TOKEN_HEADER}, siehe {GATEWAY_TOKEN_FILE})"
+            return None
+
+        def do_POST(self):
+            if self.path != "/command":
+                self._reply(404, {"ok": False, "error": "not found"})
+                return
+            rejection = self._rejection()
+            if rejection:
+                self._reply(403, {"ok": False, "output": "", "error": rejection})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                params = json.loads(self.rfile.read(length).decode("utf-8"))
+            except Exception as e:
+                self._reply(400, {"ok": False, "output": "", "error": f"Ungültiger Request: {e}"})
+                return
+            if params.get("command") in (None, "serve"):
+                self._reply(400, {"ok": False, "output": "", "error": "Kommando fehlt oder nicht erlaubt"})
+                return
+            ok, output, error = server.execute(params)
+            self._reply(200 if ok else 500, {"ok": ok, "output": output, "error": error})
+
+        def log_message(self, format, *args):
+            # Kein Access-Log auf stderr; Events laufen über db_logger
+            pass
+
+    return GatewayRequestHandler
+
+
+def serve(embedding_model, host=GATEWAY_HOST, port=GATEWAY_PORT, workers=GATEWAY_WORKERS):
+    """Startet den Gateway-Server (blockierend) mit `workers` Request-Threads."""
+    server = GatewayServer(embedding_model)
+    workers = max(1, workers)
+    db_metrics.register_collector(db_healthchecks.update_collection_gauges)
+    token = write_token()
+    httpd = _WorkerPoolHTTPServer((host, port), _make_handler(server, token), workers)
+    print(f"Gateway-Server läuft auf http://{host}:{port} mit {workers} Workern (Ctrl+C zum Beenden)", file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        print("Gateway-Server gestoppt.", file=sys.stderr)
@@ -1,28 +1,49 @@
 import db_id_manager
+import db_metrics
 import os
 
 def registry_healthcheck(collection):
     """Prüft, ob Registry für eine Collection erreichbar ist und wie viele Einträge sie hat."""
     try:
-        rows = db_id_manager.find_by_collection(collection)
-        return True, len(rows)
+        return True, db_id_manager.count_by_collection(collection)
     except Exception as e:
         return False, str(e)
 
 def faiss_healthcheck(index_file_path):
-    """Prüft, ob ein FAISS-Indexfile existiert und gibt grobe Infos."""
+    """
+    Prüft, ob ein FAISS-Indexfile existiert und gibt grobe Infos (liest nur den Dateikopf
+    und die Journal-Datensatzköpfe: Snapshot-ntotal + Journal-Adds - Journal-Removes).
+    """
     if os.path.exists(index_file_path):
-        import faiss
-        index = faiss.read_index(index_file_path)
-        return True, index.ntotal
+        import db_faiss_index
+        import db_index_store
+        header = db_faiss_index.read_index_header(index_file_path)
+        added, removed = db_index_store.journal_counts(index_file_path)
+        return True, header["ntotal"] + added - removed
     else:
         return False, 0
 
 def db_stats():
     """Gibt die Anzahl aller Dokumente pro Collection laut Registry zurück."""
-    rows = db_id_manager.list_all()
-    stats = {}
-    for row in rows:
-        coll = row[1]  # collection
-        stats[coll] = stats.get(coll, 0) + 1
-    return stats
+    return db_id_manager.collection_counts()
+
+def db_stats_detailed(collection=None):
+    """Anzahl, Zeitraum (MIN/MAX timestamp) und Entity-Typen pro Collection."""
+    return db_id_manager.collection_stats(collection)
+
+def update_collection_gauges(collections=None):
+    """
+    Metrik-Collector: setzt broker_collection_registry_count/_ntotal/_drift.
+    collections: Liste (name, index_file); default alle Collections der Registry mit
+    Index-Datei aus BROKER_INDEX_DIR.
+    """
+    counts = db_id_manager.collection_counts()
+    if collections is None:
+        import db_index_manager
+        collections = [(name, db_index_manager.index_path(name)) for name in counts if name]
+    # Gelöschte Collections nicht mit altem Stand weiter melden
+    for gauge in (db_metrics.COLLECTION_REGISTRY_COUNT, db_metrics.COLLECTION_NTOTAL, db_metrics.COLLECTION_DRIFT):
+        gauge.clear()
+    for name, index_file in collections:
+        _, ntotal = faiss_healthcheck(index_file)
+        db_metrics.set_collection_gauges(name, counts.get(name, 0), ntotal)
@@ -1,16 +1,95 @@
 # id_manager.py
 
+import ast
+import json
+import os
 import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
 
+import db_metrics
+
 REGISTRY_DB = "broker_registry.db"
 
+# Pragmas für jede Registry-Verbindung: WAL erlaubt parallele Leser neben einem Schreiber,
+# synchronous=NORMAL spart im WAL-Modus das fsync pro Commit (nur noch beim Checkpoint).
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", "-65536"),        # 64 MB Page-Cache
+    ("mmap_size", "268435456"),      # 256 MB memory-mapped I/O
+    ("temp_store", "MEMORY"),
+    ("recursive_triggers", "ON"),    # INSERT OR REPLACE löst sonst keine DELETE-Trigger (Änderungsprotokoll) aus
+)
+STATEMENT_CACHE_SIZE = 256  # vorbereitete Statements pro Verbindung (sqlite3-Statement-Cache)
+IN_CHUNK = 900  # max. Parameter pro IN (...)-Liste (SQLite-Variablenlimit)
+CHANGE_LOG_MAX_ROWS = int(os.environ.get("BROKER_CHANGE_LOG_MAX_ROWS", "1000000"))  # Obergrenze registry_changes
+# Bedingung des partiellen Index idx_registry_metadata_invalid (Abfragen müssen sie wörtlich enthalten)
+METADATA_INVALID = "metadata IS NOT NULL AND TRIM(metadata) <> '' AND NOT json_valid(metadata)"
+
+# Zuletzt vergebene Vektor-ID pro Collection in diesem Prozess (schützt parallele Threads vor Doppelvergabe)
+_last_vektor_ids = {}
+_vektor_id_lock = threading.Lock()
+
+_local = threading.local()
+
+# Laufzeit pro Registry-Funktion (Label op) in broker_registry_query_seconds, Span registry.<op>
+_timed = db_metrics.timed(db_metrics.REGISTRY_QUERY_SECONDS, span="registry")
+
 def get_connection():
-    return sqlite3.connect(REGISTRY_DB)
+    """
+    Thread-lokale, dauerhaft offene Registry-Verbindung (WAL, getunte Pragmas).
+    Nicht schließen – alle Registry-Zugriffe dieses Threads teilen sie, damit
+    Verbindungsaufbau und Statement-Vorbereitung nur einmal anfallen.
+    """
+    conn = getattr(_local, "conn", None)
+    # Neu verbinden nach fork() oder wenn REGISTRY_DB umgestellt wurde
+    if conn is None or _local.pid != os.getpid() or _local.db != REGISTRY_DB:
+        conn = sqlite3.connect(REGISTRY_DB, timeout=30, cached_statements=STATEMENT_CACHE_SIZE)
+        for name, value in PRAGMAS:
+            conn.execute(f"PRAGMA {name}={value}")
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.db = REGISTRY_DB
+    return conn
 
-def setup_registry():
+@contextmanager
+def transaction():
+    """Cursor in einer Transaktion: Commit am Ende, Rollback bei Exception."""
     conn = get_connection()
-    c = conn.cursor()
+    with conn:
+        yield conn.cursor()
+
+@contextmanager
+def read_snapshot():
+    """
+    Eigene Verbindung mit einer Lesetransaktion für lange Lesevorgänge (Export): alle
+    Abfragen darin sehen denselben Registry-Stand, Schreiber laufen dank WAL weiter.
+    """
+    conn = sqlite3.connect(REGISTRY_DB, timeout=30)
+    try:
+        for name, value in PRAGMAS:
+            conn.execute(f"PRAGMA {name}={value}")
+        conn.execute("BEGIN")
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+def close_connection():
+    """Schließt die Verbindung des aktuellen Threads (z. B. vor Thread-Ende)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# ---------- Schema-Migrationen ----------
+# Jede Migration läuft genau einmal; die erreichte Version steht in PRAGMA user_version.
+# Neue Schemaänderungen immer als neue Funktion hinten an SCHEMA_MIGRATIONS anhängen.
+
+def _migration_1_base_tables(c):
     c.execute("""
         CREATE TABLE IF NOT EXISTS id_registry (
             id TEXT PRIMARY KEY,
@@ -24,8 +103,177 @@ def setup_registry():
             vektor_index INTEGER UNIQUE
         )
     """)
-    conn.commit()
-    conn.close()
+    # Collection-Metadaten: Embedding-Dimension und Index-Spezifikation (JSON)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS collection_meta (
+            name TEXT PRIMARY KEY,
+            dim INTEGER,
+            index_spec TEXT,
+            trained INTEGER DEFAULT 0,
+            created TEXT
+        )
+    """)
+
+def _migration_2_collection_indexes(c):
+    # Globales UNIQUE auf vektor_index durch Eindeutigkeit pro Collection ersetzen.
+    # SQLite kann Spalten-Constraints nicht entfernen -> Tabelle neu anlegen (rowid bleibt erhalten).
+    c.execute("""
+        CREATE TABLE id_registry_v2 (
+            id TEXT PRIMARY KEY,
+            collection TEXT,
+            entity_type TEXT,
+            primary_value TEXT,
+            metadata TEXT,
+            timestamp TEXT,
+            source TEXT,
+            import_batch TEXT,
+            vektor_index INTEGER
+        )
+    """)
+    c.execute("""
+        INSERT INTO id_registry_v2 (rowid, id, collection, entity_type, primary_value, metadata, timestamp, source, import_batch, vektor_index)
+        SELECT rowid, id, collection, entity_type, primary_value, metadata, timestamp, source, import_batch, vektor_index
+        FROM id_registry
+    """)
+    c.execute("DROP TABLE id_registry")
+    c.execute("ALTER TABLE id_registry_v2 RENAME TO id_registry")
+    # (collection, vektor_index): Treffer-Hydration, MAX pro Collection, Vektor-ID-Eindeutigkeit
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_registry_collection_vektor ON id_registry (collection, vektor_index)")
+    # (collection, entity_type, primary_value): Duplikat-Erkennung im Checkup
+    c.execute("CREATE INDEX IF NOT EXISTS idx_registry_collection_entity_value ON id_registry (collection, entity_type, primary_value)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_registry_timestamp ON id_registry (timestamp)")
+
+def _migration_3_change_log(c):
+    # Änderungsprotokoll für den Daemon: jede index-relevante Änderung bekommt eine fortlaufende seq.
+    # Updates werden als delete (alte Werte) + insert (neue Werte) protokolliert, damit auch
+    # Collection-Wechsel und neue Vektor-IDs beim Abgleich ankommen.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS registry_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            collection TEXT,
+            id TEXT,
+            vektor_index INTEGER,
+            op TEXT
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_changes_collection_seq ON registry_changes (collection, seq)")
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_registry_insert AFTER INSERT ON id_registry BEGIN
+            INSERT INTO registry_changes (collection, id, vektor_index, op) VALUES (NEW.collection, NEW.id, NEW.vektor_index, 'insert');
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_registry_delete AFTER DELETE ON id_registry BEGIN
+            INSERT INTO registry_changes (collection, id, vektor_index, op) VALUES (OLD.collection, OLD.id, OLD.vektor_index, 'delete');
+        END
+    """)
+    # Nur index-relevante Spalten; Metadata-/Timestamp-Korrekturen des Checkups erzeugen keine Einträge
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_registry_update AFTER UPDATE OF collection, primary_value, vektor_index ON id_registry BEGIN
+            INSERT INTO registry_changes (collection, id, vektor_index, op) VALUES (OLD.collection, OLD.id, OLD.vektor_index, 'delete');
+            INSERT INTO registry_changes (collection, id, vektor_index, op) VALUES (NEW.collection, NEW.id, NEW.vektor_index, 'insert');
+        END
+    """)
+    # Checkpoint pro Collection: bis zu welcher seq Registry und Index abgeglichen sind,
+    # plus Index-Stand (mtime, ntotal) zu diesem Zeitpunkt
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS collection_checkpoint (
+            collection TEXT PRIMARY KEY,
+            seq INTEGER,
+            index_mtime REAL,
+            index_ntotal INTEGER,
+            checked_at TEXT
+        )
+    """)
+
+def _migration_4_filter_indexes(c):
+    # Gefilterte Suche: Registry-Prädikate pro Collection über Indizes auflösen statt die Collection zu scannen
+    # (entity_type ist über idx_registry_collection_entity_value abgedeckt)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_registry_collection_source ON id_registry (collection, source)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_registry_collection_batch ON id_registry (collection, import_batch)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_registry_collection_timestamp ON id_registry (collection, timestamp)")
+    # Generationszähler pro Collection: ändert sich bei jeder Änderung an Einträgen (auch Filter-Spalten),
+    # damit gecachte Filter-ID-Mengen ungültig werden. Das Änderungsprotokoll reicht dafür nicht
+    # (keine Einträge für source/import_batch/timestamp, wird nach dem Abgleich geleert).
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS registry_generation (
+            collection TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    """)
+    for event, row in (("INSERT", "NEW"), ("DELETE", "OLD"), ("UPDATE", "NEW")):
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_registry_generation_{event.lower()} AFTER {event} ON id_registry BEGIN
+                INSERT INTO registry_generation (collection, value) VALUES ({row}.collection, 1)
+                    ON CONFLICT(collection) DO UPDATE SET value = value + 1;
+            END
+        """)
+    # Collection-Wechsel per UPDATE: auch die alte Collection wird ungültig
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_registry_generation_move AFTER UPDATE OF collection ON id_registry
+        WHEN OLD.collection IS NOT NEW.collection BEGIN
+            INSERT INTO registry_generation (collection, value) VALUES (OLD.collection, 1)
+                ON CONFLICT(collection) DO UPDATE SET value = value + 1;
+        END
+    """)
+
+def _migration_5_json_metadata(c):
+    # Metadaten als kanonisches JSON (kompakt wie SQLite json()) statt Python-Repr (str(dict)).
+    # Altbestände einmalig umwandeln; nicht lesbare Einträge bleiben stehen (meldet der Checkup).
+    c.execute("SELECT rowid, metadata FROM id_registry WHERE metadata IS NOT NULL AND NOT json_valid(metadata)")
+    updates = []
+    for rowid, meta in c.fetchall():
+        if not meta.strip():
+            updates.append((None, rowid))
+            continue
+        as_json = metadata_to_json(meta)
+        if as_json is not None:
+            updates.append((as_json, rowid))
+    c.executemany("UPDATE id_registry SET metadata = ? WHERE rowid = ?", updates)
+    c.execute("UPDATE id_registry SET metadata = json(metadata) WHERE json_valid(metadata) AND metadata <> json(metadata)")
+    # Häufig gefilterte Schlüssel als virtuelle Spalten (nur bei gültigem JSON) mit Indizes pro Collection
+    for column, declared, path in (("meta_quelle", "TEXT", "$.quelle"),
+                                   ("meta_timestamp", "TEXT", "$.timestamp"),
+                                   ("meta_confidence", "REAL", "$.confidence")):
+        c.execute(f"""
+            ALTER TABLE id_registry ADD COLUMN {column} {declared}
+            GENERATED ALWAYS AS (CASE WHEN json_valid(metadata) THEN json_extract(metadata, '{path}') END) VIRTUAL
+        """)
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_registry_collection_{column} ON id_registry (collection, {column})")
+    # Partieller Index über die (wenigen) ungültigen Einträge: der Checkup findet sie ohne Tabellenscan
+    c.execute(f"CREATE INDEX IF NOT EXISTS idx_registry_metadata_invalid ON id_registry (id) WHERE {METADATA_INVALID}")
+
+SCHEMA_MIGRATIONS = [
+    (1, "Basistabellen id_registry + collection_meta", _migration_1_base_tables),
+    (2, "Indizes pro Collection, vektor_index eindeutig pro Collection", _migration_2_collection_indexes),
+    (3, "Änderungsprotokoll (Trigger) + Checkpoints pro Collection", _migration_3_change_log),
+    (4, "Indizes für gefilterte Suche + Generationszähler pro Collection", _migration_4_filter_indexes),
+    (5, "Metadaten als JSON, virtuelle Spalten meta_quelle/meta_timestamp/meta_confidence", _migration_5_json_metadata),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+def get_schema_version():
+    return get_connection().execute("PRAGMA user_version").fetchone()[0]
+
+def setup_registry():
+    """Legt die Registry an bzw. migriert sie auf SCHEMA_VERSION (idempotent, prozesssicher)."""
+    conn = get_connection()
+    if get_schema_version() >= SCHEMA_VERSION:
+        return
+    # Migration 1 ist idempotent (IF NOT EXISTS) und gilt auch für Bestandsdatenbanken ohne Versionsnummer
+    for version, description, migrate in SCHEMA_MIGRATIONS:
+        # BEGIN IMMEDIATE: Schreibsperre, damit parallel startende Prozesse nicht doppelt migrieren
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_schema_version() >= version:
+                conn.rollback()
+                continue
+            migrate(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
 
 def generate_id(collection, entity_type, source=None, unique_part=None):
@@ -35,91 +283,437 @@ def generate_id(collection, entity_type, source=None, unique_part=None):
     uniq = unique_part if unique_part else datetime.utcnow().strftime("%H%M%S%f")
     return f"{collection.upper()}_{entity_type.upper()}_{src_part}_{date_part}_{uniq}"
 
+def metadata_to_json(metadata):
+    """
+    Kanonisches JSON (kompakt, Schlüsselreihenfolge bleibt) für Metadaten. Strings werden
+    geparst: JSON, Python-Repr aus Altbeständen, JSON mit einfachen Anführungszeichen.
+    Gibt None zurück, wenn ein String nicht lesbar ist.
+    """
+    if isinstance(metadata, (bytes, str)):
+        text = metadata.decode("utf-8") if isinstance(metadata, bytes) else metadata
+        for parse in (json.loads, ast.literal_eval, lambda t: json.loads(t.replace("'", '"'))):
+            try:
+                metadata = parse(text)
+                break
+            except Exception:
+                continue
+        else:
+            return None
+    return json.dumps(metadata, ensure_ascii=False, separators=(",", ":"), default=str)
+
+def _encode_metadata(metadata):
+    if not metadata:
+        return None
+    as_json = metadata_to_json(metadata)
+    return as_json if as_json is not None else str(metadata)
+
+def _count_writes(c, rows):
+    """
+    Zählt geschriebene Zeilen als neu (DOCS_ADDED) bzw. ersetzt (DOCS_UPDATED): INSERT OR REPLACE
+    überschreibt vorhandene IDs, das ist ein Update und kein neues Dokument. Direkt vor dem Schreiben
+    mit demselben Cursor aufrufen; gibt eine Funktion zurück, die die Zähler nach dem Schreiben erhöht.
+    """
+    ids = list(dict.fromkeys(row[0] for row in rows))
+    seen = set()
+    for start in range(0, len(ids), IN_CHUNK):
+        chunk = ids[start:start + IN_CHUNK]
+        c.execute(f"SELECT id FROM id_registry WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        seen.update(r[0] for r in c.fetchall())
+    added, updated = Counter(), Counter()
+    for row in rows:
+        (updated if row[0] in seen else added)[row[1]] += 1
+        seen.add(row[0])  # doppelte ID im selben Batch ersetzt die erste Zeile
+
+    def commit():
+        for collection, n in added.items():
+            db_metrics.DOCS_ADDED.inc(n, collection=collection)
+        for collection, n in updated.items():
+            db_metrics.DOCS_UPDATED.inc(n, collection=collection)
+    return commit
+
+@_timed
 def add_entry(id, collection, entity_type, primary_value, metadata=None, source=None, import_batch=None, vektor_index=None):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
+    with transaction() as c:
+        count = _count_writes(c, [(id, collection)])
+        c.execute("""
+            INSERT OR REPLACE INTO id_registry
+            (id, collection, entity_type, primary_value, metadata, timestamp, source, import_batch, vektor_index)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            id,
+            collection,
+            entity_type,
+            primary_value,
+            _encode_metadata(metadata),
+            datetime.utcnow().isoformat(),
+            source,
+            import_batch,
+            vektor_index
+        ))
+    count()
+
+@_timed
+def add_entries(entries, cursor=None):
+    """
+    Bulk-Insert: schreibt viele Registry-Einträge in einer Transaktion (executemany).
+    entries: Iterable von Dicts mit den Feldern von add_entry (id, collection, entity_type,
+    primary_value, metadata, source, import_batch, vektor_index; optional timestamp).
+    cursor: Cursor einer offenen Transaktion (z. B. Import) -> kein eigener Commit.
+    Gibt die Anzahl geschriebener Zeilen zurück.
+    """
+    now = datetime.utcnow().isoformat()
+    rows = [(
+        e["id"],
+        e["collection"],
+        e["entity_type"],
+        e["primary_value"],
+        _encode_metadata(e.get("metadata")),
+        e.get("timestamp") or now,
+        e.get("source"),
+        e.get("import_batch"),
+        e.get("vektor_index")
+    ) for e in entries]
+    if not rows:
+        return 0
+    sql = """
         INSERT OR REPLACE INTO id_registry
         (id, collection, entity_type, primary_value, metadata, timestamp, source, import_batch, vektor_index)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        id,
-        collection,
-        entity_type,
-        primary_value,
-        str(metadata) if metadata else None,
-        datetime.utcnow().isoformat(),
-        source,
-        import_batch,
-        vektor_index
-    ))
-    conn.commit()
-    conn.close()
+    """
+    if cursor is not None:
+        count = _count_writes(cursor, rows)
+        cursor.executemany(sql, rows)
+    else:
+        with transaction() as c:
+            count = _count_writes(c, rows)
+            c.executemany(sql, rows)
+    count()
+    return len(rows)
 
 #obsolete?
+@_timed
 def get_by_id(id):
-    conn = get_connection()
-    c = conn.cursor()
+    c = get_connection().cursor()
     c.execute("SELECT * FROM id_registry WHERE id = ?", (id,))
-    row = c.fetchone()
-    conn.close()
-    return row
+    return c.fetchone()
 
-def get_by_vektor_index(vektor_index):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM id_registry WHERE vektor_index = ?", (vektor_index,))
-    row = c.fetchone()
-    conn.close()
-    return row
+@_timed
+def get_by_ids(ids):
+    """Lädt viele Registry-Zeilen per Dokument-ID (IN-Query), gibt ein Dict id -> Zeile zurück."""
+    ids = list(dict.fromkeys(ids))
+    result = {}
+    c = get_connection().cursor()
+    for start in range(0, len(ids), IN_CHUNK):
+        chunk = ids[start:start + IN_CHUNK]
+        c.execute(f"SELECT * FROM id_registry WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        for row in c.fetchall():
+            result[row[0]] = row
+    return result
+
+@_timed
+def existing_ids(ids):
+    """Dict id -> Collection für die Dokument-IDs, die schon in der Registry stehen."""
+    ids = list(dict.fromkeys(ids))
+    found = {}
+    c = get_connection().cursor()
+    for start in range(0, len(ids), IN_CHUNK):
+        chunk = ids[start:start + IN_CHUNK]
+        c.execute(f"SELECT id, collection FROM id_registry WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        found.update(c.fetchall())
+    return found
+
+@_timed
+def existing_values(collection, entity_type, values):
+    """Teilmenge der primary_values, die es in der Collection mit diesem Entity-Typ schon gibt (Index-Lookup)."""
+    values = list(dict.fromkeys(values))
+    found = set()
+    c = get_connection().cursor()
+    for start in range(0, len(values), IN_CHUNK):
+        chunk = values[start:start + IN_CHUNK]
+        c.execute(f"""
+            SELECT primary_value FROM id_registry
+            WHERE collection = ? AND entity_type IS ? AND primary_value IN ({','.join('?' * len(chunk))})
+        """, (collection, entity_type, *chunk))
+        found.update(row[0] for row in c.fetchall())
+    return found
+
+@_timed
+def get_by_vektor_index(vektor_index, collection=None):
+    # Vektor-IDs sind nur pro Collection eindeutig -> collection angeben, wo bekannt
+    c = get_connection().cursor()
+    if collection is None:
+        c.execute("SELECT * FROM id_registry WHERE vektor_index = ?", (vektor_index,))
+    else:
+        c.execute("SELECT * FROM id_registry WHERE collection = ? AND vektor_index = ?", (collection, vektor_index))
+    return c.fetchone()
 
+@_timed
+def get_by_vektor_indices(vektor_indices, collection=None):
+    """
+    Lädt viele Registry-Zeilen auf einmal (IN-Query statt einer Abfrage pro Treffer).
+    Gibt ein Dict vektor_index -> Zeile zurück; fehlende IDs fehlen im Dict.
+    """
+    ids = list(dict.fromkeys(int(v) for v in vektor_indices))
+    result = {}
+    c = get_connection().cursor()
+    for start in range(0, len(ids), IN_CHUNK):
+        chunk = ids[start:start + IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        if collection is None:
+            c.execute(f"SELECT * FROM id_registry WHERE vektor_index IN ({placeholders})", chunk)
+        else:
+            c.execute(f"SELECT * FROM id_registry WHERE collection = ? AND vektor_index IN ({placeholders})", (collection, *chunk))
+        for row in c.fetchall():
+            result[row[8]] = row
+    return result
+
+@_timed
 def find_by_collection(collection):
-    conn = get_connection()
-    c = conn.cursor()
+    c = get_connection().cursor()
     c.execute("SELECT * FROM id_registry WHERE collection = ?", (collection,))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    return c.fetchall()
+
+@_timed
+def list_vektor_ids(collection):
+    """(id, vektor_index) aller Einträge einer Collection, ohne Metadaten zu laden."""
+    c = get_connection().cursor()
+    c.execute("SELECT id, vektor_index FROM id_registry WHERE collection = ?", (collection,))
+    return c.fetchall()
 
+@_timed
 def delete_id(id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM id_registry WHERE id = ?", (id,))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        row = c.execute("SELECT collection FROM id_registry WHERE id = ?", (id,)).fetchone()
+        c.execute("DELETE FROM id_registry WHERE id = ?", (id,))
+    if row:
+        db_metrics.DOCS_DELETED.inc(collection=row[0])
+
+@_timed
+def delete_collection(collection):
+    """Löscht alle Registry-Einträge einer Collection, gibt die Anzahl zurück."""
+    with transaction() as c:
+        c.execute("DELETE FROM id_registry WHERE collection = ?", (collection,))
+        deleted = c.rowcount
+    db_metrics.DOCS_DELETED.inc(deleted, collection=collection)
+    return deleted
 
 def list_all():
-    conn = get_connection()
-    c = conn.cursor()
+    c = get_connection().cursor()
     c.execute("SELECT * FROM id_registry")
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    return c.fetchall()
+
+# ---------- Aggregate (COUNT/GROUP BY in SQL statt Zeilen in Python zählen) ----------
+@_timed
+def count_by_collection(collection):
+    c = get_connection().cursor()
+    c.execute("SELECT COUNT(*) FROM id_registry WHERE collection = ?", (collection,))
+    return c.fetchone()[0]
+
+@_timed
+def collection_counts():
+    """Dict collection -> Anzahl Einträge."""
+    c = get_connection().cursor()
+    c.execute("SELECT collection, COUNT(*) FROM id_registry GROUP BY collection")
+    return dict(c.fetchall())
+
+def list_collection_names():
+    c = get_connection().cursor()
+    c.execute("SELECT DISTINCT collection FROM id_registry WHERE collection IS NOT NULL ORDER BY collection")
+    return [row[0] for row in c.fetchall()]
+
+@_timed
+def collection_stats(collection=None):
+    """
+    Kennzahlen pro Collection: Anzahl, ältester/neuester Timestamp, Entity-Typen.
+    Gibt eine Liste von Dicts zurück (nur die angegebene Collection, falls gesetzt).
+    """
+    sql = """
+        SELECT collection, COUNT(*), MIN(timestamp), MAX(timestamp), GROUP_CONCAT(DISTINCT entity_type)
+        FROM id_registry
+    """
+    params = ()
+    if collection is not None:
+        sql += " WHERE collection = ?"
+        params = (collection,)
+    sql += " GROUP BY collection ORDER BY collection"
+    c = get_connection().cursor()
+    c.execute(sql, params)
+    return [{
+        "collection": row[0],
+        "count": row[1],
+        "first_timestamp": row[2],
+        "last_timestamp": row[3],
+        "entity_types": sorted(row[4].split(",")) if row[4] else []
+    } for row in c.fetchall()]
+
+# Spalten im Export (JSONL), Reihenfolge wie in id_registry
+EXPORT_COLUMNS = ("id", "collection", "entity_type", "primary_value", "metadata", "timestamp", "source", "import_batch", "vektor_index")
 
 def export_registry(out_file="id_registry_export.jsonl"):
-    import json
+    """Ganze Registry als JSONL, zeilenweise gestreamt (ohne Vektoren, siehe db_export_import.export_collection)."""
+    c = get_connection().cursor()
+    c.execute(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM id_registry")
     with open(out_file, "w", encoding="utf-8") as f:
-        for row in list_all():
-            entry = {
-                "id": row[0],
-                "collection": row[1],
-                "entity_type": row[2],
-                "primary_value": row[3],
-                "metadata": row[4],
-                "timestamp": row[5],
-                "source": row[6],
-                "import_batch": row[7]
-            }
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        for row in c:
+            f.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
     return out_file
 
-def get_max_vektor_index():
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT MAX(vektor_index) FROM id_registry")
+def get_max_vektor_index(collection=None):
+    c = get_connection().cursor()
+    if collection is None:
+        c.execute("SELECT MAX(vektor_index) FROM id_registry")
+    else:
+        c.execute("SELECT MAX(vektor_index) FROM id_registry WHERE collection = ?", (collection,))
     result = c.fetchone()
-    conn.close()
     return result[0] if result and result[0] is not None else -1
 
+def set_collection_meta(name, dim, index_spec, trained=False):
+    with transaction() as c:
+        c.execute("""
+            INSERT INTO collection_meta (name, dim, index_spec, trained, created)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET dim = excluded.dim, index_spec = excluded.index_spec, trained = excluded.trained
+        """, (name, dim, json.dumps(index_spec), int(bool(trained)), datetime.utcnow().isoformat()))
+
+def get_collection_meta(name):
+    """Gibt {"name", "dim", "index_spec", "trained"} zurück oder None, wenn nie angelegt."""
+    c = get_connection().cursor()
+    c.execute("SELECT name, dim, index_spec, trained FROM collection_meta WHERE name = ?", (name,))
+    row = c.fetchone()
+    if not row:
+        return None
+    return {"name": row[0], "dim": row[1], "index_spec": json.loads(row[2]) if row[2] else None, "trained": bool(row[3])}
+
+def delete_collection_meta(name):
+    with transaction() as c:
+        c.execute("DELETE FROM collection_meta WHERE name = ?", (name,))
+
+def allocate_vektor_ids(collection, n=1):
+    """
+    Reserviert n neue Vektor-IDs (64 Bit) für eine Collection und gibt sie als Liste zurück.
+    Die IDs sind pro Collection eindeutig und stabil: sie ändern sich bei Update/Delete
+    anderer Dokumente nicht.
+    """
+    with _vektor_id_lock:
+        start = max(get_max_vektor_index(collection), _last_vektor_ids.get(collection, -1)) + 1
+        _last_vektor_ids[collection] = start + n - 1
+    return list(range(start, start + n))
+
+def set_vektor_index(id, vektor_index):
+    with transaction() as c:
+        c.execute("UPDATE id_registry SET vektor_index = ? WHERE id = ?", (vektor_index, id))
+
+def set_vektor_indices(pairs):
+    """Bulk-Variante von set_vektor_index: pairs = [(id, vektor_index), ...] in einer Transaktion."""
+    with transaction() as c:
+        c.executemany("UPDATE id_registry SET vektor_index = ? WHERE id = ?", [(vid, id) for id, vid in pairs])
+
+# ---------- Gefilterte Suche ----------
+def filter_generation(collection):
+    """Generationszähler der Collection (ändert sich bei jeder Registry-Änderung, 0 = noch keine)."""
+    c = get_connection().cursor()
+    c.execute("SELECT value FROM registry_generation WHERE collection = ?", (collection,))
+    row = c.fetchone()
+    return row[0] if row else 0
+
+@_timed
+def filter_vektor_ids(collection, source=None, entity_type=None, import_batch=None, since=None, until=None, min_confidence=None):
+    """
+    Vektor-IDs aller Einträge der Collection, die allen gesetzten Prädikaten entsprechen
+    (since/until: ISO-Zeitstempel, inklusive; min_confidence: Metadaten-Schlüssel confidence),
+    aufsteigend sortiert.
+    """
+    where = ["collection = ?", "vektor_index IS NOT NULL"]
+    params = [collection]
+    for column, value in (("source", source), ("entity_type", entity_type), ("import_batch", import_batch)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        where.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("timestamp <= ?")
+        params.append(until)
+    if min_confidence is not None:
+        where.append("meta_confidence >= ?")
+        params.append(float(min_confidence))
+    c = get_connection().cursor()
+    c.execute(f"SELECT vektor_index FROM id_registry WHERE {' AND '.join(where)} ORDER BY vektor_index", params)
+    return [row[0] for row in c.fetchall()]
+
+# ---------- Änderungsprotokoll & Checkpoints (inkrementeller Abgleich im Daemon) ----------
+def current_change_seq():
+    """Höchste vergebene Änderungs-seq (0, wenn noch nichts protokolliert wurde)."""
+    c = get_connection().cursor()
+    c.execute("SELECT MAX(seq) FROM registry_changes")
+    result = c.fetchone()[0]
+    return result or 0
+
+@_timed
+def changes_since(collection, after_seq, upto_seq=None):
+    """Änderungen einer Collection mit after_seq < seq <= upto_seq als Liste (seq, id, vektor_index, op)."""
+    c = get_connection().cursor()
+    if upto_seq is None:
+        c.execute("SELECT seq, id, vektor_index, op FROM registry_changes WHERE collection = ? AND seq > ? ORDER BY seq", (collection, after_seq))
+    else:
+        c.execute("SELECT seq, id, vektor_index, op FROM registry_changes WHERE collection = ? AND seq > ? AND seq <= ? ORDER BY seq", (collection, after_seq, upto_seq))
+    return c.fetchall()
+
+def prune_changes(collection, upto_seq):
+    """Entfernt abgearbeitete Änderungen einer Collection (seq <= upto_seq)."""
+    with transaction() as c:
+        c.execute("DELETE FROM registry_changes WHERE collection = ? AND seq <= ?", (collection, upto_seq))
+        return c.rowcount
+
+def prune_change_log(max_rows=None):
+    """
+    Räumt das Änderungsprotokoll über alle Collections auf (prune_changes im Daemon erfasst nur
+    die konfigurierten):
+      - Änderungen bis zum Checkpoint ihrer Collection sind abgearbeitet
+      - Collections ohne Checkpoint gleichen beim ersten Check ohnehin vollständig ab
+      - höchstens max_rows (default BROKER_CHANGE_LOG_MAX_ROWS) Zeilen bleiben stehen; Checkpoints,
+        deren Änderungen dabei wegfallen, werden verworfen (nächster Check wieder vollständig)
+    Gibt die Anzahl gelöschter Zeilen zurück.
+    """
+    max_rows = CHANGE_LOG_MAX_ROWS if max_rows is None else max_rows
+    with transaction() as c:
+        c.execute("""
+            DELETE FROM registry_changes
+            WHERE collection NOT IN (SELECT collection FROM collection_checkpoint)
+               OR seq <= (SELECT cp.seq FROM collection_checkpoint cp WHERE cp.collection = registry_changes.collection)
+        """)
+        deleted = c.rowcount
+        cutoff = c.execute("SELECT seq FROM registry_changes ORDER BY seq DESC LIMIT 1 OFFSET ?", (max(0, max_rows),)).fetchone()
+        if cutoff is not None:
+            c.execute("DELETE FROM registry_changes WHERE seq <= ?", cutoff)
+            deleted += c.rowcount
+            c.execute("DELETE FROM collection_checkpoint WHERE seq < ?", cutoff)
+        return deleted
+
+def get_checkpoint(collection):
+    """Gibt {"seq", "index_mtime", "index_ntotal", "checked_at"} zurück oder None (noch nie abgeglichen)."""
+    c = get_connection().cursor()
+    c.execute("SELECT seq, index_mtime, index_ntotal, checked_at FROM collection_checkpoint WHERE collection = ?", (collection,))
+    row = c.fetchone()
+    if not row:
+        return None
+    return {"seq": row[0], "index_mtime": row[1], "index_ntotal": row[2], "checked_at": row[3]}
+
+def set_checkpoint(collection, seq, index_mtime=None, index_ntotal=None):
+    with transaction() as c:
+        c.execute("""
+            INSERT INTO collection_checkpoint (collection, seq, index_mtime, index_ntotal, checked_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(collection) DO UPDATE SET seq = excluded.seq, index_mtime = excluded.index_mtime,
+                index_ntotal = excluded.index_ntotal, checked_at = excluded.checked_at
+        """, (collection, seq, index_mtime, index_ntotal, datetime.utcnow().isoformat()))
+
+def delete_checkpoint(collection):
+    """Checkpoint und offene Änderungen einer Collection verwerfen (z. B. nach drop_collection)."""
+    with transaction() as c:
+        c.execute("DELETE FROM collection_checkpoint WHERE collection = ?", (collection,))
+        c.execute("DELETE FROM registry_changes WHERE collection = ?", (collection,))
+
 # Setup direkt beim Import
 setup_registry()
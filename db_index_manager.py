@@ -0,0 +1,146 @@
+# index_manager.py
+#
+# Zentrale Verwaltung der Collection-Indizes eines Prozesses (Gateway-Server, Daemon, CLI):
+#   - Index-Pfade aus einem konfigurierten Verzeichnis (BROKER_INDEX_DIR, default ".")
+#   - häufig genutzte Indizes bleiben resident (LRU)
+#   - kalte Indizes werden verdrängt, sobald das Speicherbudget überschritten ist
+#   - ändert sich Snapshot oder Journal auf der Platte (anderer Prozess), wird neu geladen
+# Per mmap geladene Query-Indizes (read_only) zählen nicht zum Budget: sie liegen im
+# geteilten Page-Cache, nicht im Prozessspeicher.
+
+import os
+import threading
+from collections import OrderedDict
+
+import db_faiss_index
+import db_id_manager
+import db_index_store
+import db_trace
+
+INDEX_DIR = os.environ.get("BROKER_INDEX_DIR", ".")
+MEMORY_BUDGET_MB = int(os.environ.get("BROKER_INDEX_MEMORY_MB", "2048"))
+MAX_RESIDENT = int(os.environ.get("BROKER_INDEX_MAX_RESIDENT", "256"))  # Obergrenze inkl. mmap-Indizes
+
+
+def index_path(collection, index_dir=None):
+    """Pfad der Index-Datei einer Collection im konfigurierten Index-Verzeichnis."""
+    return os.path.join(index_dir or INDEX_DIR, f"{collection}.index")
+
+
+class _Entry:
+    def __init__(self, index, stamp, read_only, size):
+        self.index = index
+        self.stamp = stamp
+        self.read_only = read_only
+        self.size = size
+        self.hits = 0
+
+
+class IndexManager:
+    """
+    LRU-Cache für geladene Indizes mit Speicherbudget.
+    get() lädt bei Bedarf (Snapshot + Journal bzw. mmap), put() übernimmt einen im Prozess
+    veränderten oder neu gebauten Index nach dem Schreiben.
+    """
+    def __init__(self, index_dir=None, memory_budget_mb=MEMORY_BUDGET_MB, max_resident=MAX_RESIDENT):
+        self.index_dir = index_dir or INDEX_DIR
+        self.memory_budget = int(memory_budget_mb) * 1024 * 1024
+        self.max_resident = max(1, int(max_resident))
+        self._entries = OrderedDict()   # index_file -> _Entry, zuletzt genutzt am Ende
+        self._lock = threading.Lock()
+        self._load_locks = {}           # index_file -> Lock (paralleles Laden derselben Datei vermeiden)
+        self.evictions = 0
+
+    def path(self, collection):
+        return index_path(collection, self.index_dir)
+
+    def _key(self, collection, index_file):
+        return os.path.abspath(index_file or self.path(collection))
+
+    def get(self, collection, read_only=False, index_file=None):
+        """
+        Gibt den Index der Collection zurück oder None, wenn keine Index-Datei existiert.
+        read_only=True: darf per mmap geladen sein und wird vom Aufrufer nicht verändert.
+        """
+        key = self._key(collection, index_file)
+        if not os.path.exists(key):
+            self.evict(collection, index_file)
+            return None
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            stamp = db_index_store.file_stamp(key)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.stamp == stamp and (read_only or not entry.read_only):
+                    self._entries.move_to_end(key)
+                    entry.hits += 1
+                    return entry.index
+            with db_trace.span("index.load"):
+                if read_only:
+                    index, loaded_read_only, size = db_index_store.load_query_index(key, collection)
+                else:
+                    index, _ = db_index_store.load_index(key, collection)
+                    loaded_read_only, size = False, None
+            meta = db_id_manager.get_collection_meta(collection)
+            if meta:
+                db_faiss_index.apply_search_params(index, meta["index_spec"])
+            self._store(key, index, loaded_read_only, size)
+            return index
+
+    def put(self, collection, index, index_file=None, read_only=False):
+        """Übernimmt einen Index nach dem Schreiben (Snapshot/Journal) mit aktuellem Datei-Stand."""
+        key = self._key(collection, index_file)
+        if os.path.exists(key):
+            self._store(key, index, read_only)
+
+    def evict(self, collection, index_file=None):
+        with self._lock:
+            self._entries.pop(self._key(collection, index_file), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, key, index, read_only, size=None):
+        # size: tatsächlich residente Bytes (mmap-Anteil zählt nicht), default Snapshot + Journal
+        if size is None:
+            size = os.path.getsize(key) + db_index_store.journal_size(key)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            entry = _Entry(index, db_index_store.file_stamp(key), read_only, size)
+            entry.hits = old.hits if old else 0
+            self._entries[key] = entry
+            self._evict_over_budget()
+
+    def _evict_over_budget(self):
+        # Der zuletzt genutzte Index bleibt immer resident, auch wenn er allein das Budget sprengt
+        while len(self._entries) > 1 and (self.resident_bytes() > self.memory_budget or len(self._entries) > self.max_resident):
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def resident_bytes(self):
+        return sum(entry.size for entry in self._entries.values())
+
+    def stats(self):
+        """Residente Indizes (LRU-Reihenfolge, zuletzt genutzt am Ende) für Stats/Monitoring."""
+        with self._lock:
+            return [{
+                "index_file": key,
+                "bytes": entry.size,
+                "read_only": entry.read_only,
+                "hits": entry.hits,
+            } for key, entry in self._entries.items()]
+
+
+_MANAGER = None
+_MANAGER_LOCK = threading.Lock()
+
+def get_manager():
+    """Prozessweiter IndexManager (wird beim ersten Aufruf angelegt)."""
+    global _MANAGER
+    if _MANAGER is None:
+        with _MANAGER_LOCK:
+            if _MANAGER is None:
+                _MANAGER = IndexManager()
+    return _MANAGER
@@ -0,0 +1,305 @@
+# index_store.py
+#
+# Absturzsichere Persistenz der FAISS-Indizes:
+#   - Snapshot:  {collection}.index, geschrieben per Temp-Datei + fsync + Rename
+#   - Journal:   {collection}.index.journal, Append-only-Datensätze (add/remove) seit dem Snapshot
+# Einfügen/Ändern/Löschen hängt nur einen kleinen Datensatz an das Journal an statt den
+# ganzen Index neu zu schreiben. Beim Laden wird das Journal auf den Snapshot angewendet;
+# ab COMPACT_BYTES wird ein neuer Snapshot geschrieben und das Journal geleert.
+#
+# Reihenfolge beim Schreiben: Registry-Commit -> Journal-Datensatz (mit Registry-Änderungs-seq)
+# -> Index im Speicher. Ein Abbruch zwischen Registry und Journal hinterlässt eine
+# Registry-Änderung ohne passenden Vektor: bei Inserts fehlt die Vektor-ID im Index, bei Updates
+# liegt unter derselben Vektor-ID noch der Vektor des alten Texts. Beides zieht der Daemon über
+# das Änderungsprotokoll nach (db_cleanup.reindex_changes: fehlende IDs einfügen, ersetzte Zeilen
+# neu embedden); die diff-basierte Reparatur allein sieht nur fehlende/verwaiste IDs.
+# Replay ist idempotent: bereits vorhandene IDs werden übersprungen, adds ohne
+# Registry-Eintrag (Collection bekannt) werden verworfen.
+#
+# Für Queries gibt es einen Lesemodus (load_query_index): der Snapshot wird per mmap
+# eingeblendet statt kopiert, sodass Gateway, Daemon und CLI-Prozesse denselben
+# Page-Cache teilen. Ein so geladener Index darf NICHT verändert werden (FAISS bricht
+# den Prozess sonst ab). Snapshots werden per Rename ersetzt, bestehende Mappings
+# zeigen dabei weiter auf die alte, vollständige Datei.
+# Einschränkung: mmap nur bei leerem Journal (ein eingeblendeter Index kann keine
+# Journal-Datensätze aufnehmen). Da jeder Schreibzugriff ins Journal geht und erst ab
+# COMPACT_BYTES kompaktiert wird, schreibt der Gateway-Server nach einer Schreibpause
+# (BROKER_GATEWAY_IDLE_COMPACT_S) einen Snapshot (db_faiss_gateway.compact_index); bis dahin
+# laufen Queries auf der voll geladenen Kopie. Reine CLI-Prozesse kompaktieren nicht im Leerlauf.
+
+import os
+import struct
+import zlib
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+import db_faiss_index
+import db_id_manager
+import db_trace
+
+try:
+    import fcntl
+except ImportError:  # Windows: kein flock, Zugriff dann nur über einen Prozess (Gateway-Server)
+    fcntl = None
+
+JOURNAL_SUFFIX = ".journal"
+LOCK_SUFFIX = ".lock"
+COMPACT_BYTES = int(os.environ.get("BROKER_JOURNAL_COMPACT_MB", "64")) * 1024 * 1024
+JOURNAL_FSYNC = os.environ.get("BROKER_JOURNAL_FSYNC", "1") != "0"
+QUERY_MMAP = os.environ.get("BROKER_INDEX_MMAP", "1") != "0"
+
+# mmap-Flags je nach FAISS-Version: MMAP (invertierte Listen), MMAP_IFC (Flat-Codes, ab 1.12), READ_ONLY.
+# IVF-Indizes lassen sich nicht mit beiden mmap-Flags zugleich lesen -> Varianten der Reihe nach probieren.
+_READ_ONLY = getattr(faiss, "IO_FLAG_READ_ONLY", 0)
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP", 0) | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | _READ_ONLY
+MMAP_FLAG_VARIANTS = tuple(dict.fromkeys(
+    flags for flags in (MMAP_FLAGS, getattr(faiss, "IO_FLAG_MMAP", 0) | _READ_ONLY,
+                        getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | _READ_ONLY)
+    if flags & ~_READ_ONLY
+))
+
+# Datensatz-Kopf: Magic, Operation, Registry-seq, Anzahl IDs, Dimension, CRC32 der Nutzdaten
+_RECORD = struct.Struct("<4sBqiiI")
+_MAGIC = b"BJR1"
+OP_ADD = 1
+OP_REMOVE = 2
+
+
+def journal_file(index_file):
+    return index_file + JOURNAL_SUFFIX
+
+@contextmanager
+def _locked(index_file):
+    """Exklusive Sperre pro Index (Journal-Append, Snapshot) über Prozessgrenzen hinweg."""
+    if fcntl is None:
+        yield
+        return
+    with open(index_file + LOCK_SUFFIX, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def journal_size(index_file):
+    try:
+        return os.path.getsize(journal_file(index_file))
+    except OSError:
+        return 0
+
+def file_stamp(index_file):
+    """(mtime Snapshot, Größe Journal): ändert sich bei jedem Schreibvorgang, auch aus anderen Prozessen."""
+    return os.path.getmtime(index_file), journal_size(index_file)
+
+# ---------- Journal ----------
+def _append(index_file, op, ids, vectors=None, seq=None):
+    ids = np.ascontiguousarray(np.asarray(ids, dtype="int64").reshape(-1))
+    if len(ids) == 0:
+        return
+    payload = ids.tobytes()
+    dim = 0
+    if vectors is not None:
+        vectors = np.ascontiguousarray(vectors, dtype="float32").reshape(len(ids), -1)
+        dim = vectors.shape[1]
+        payload += vectors.tobytes()
+    if seq is None:
+        seq = db_id_manager.current_change_seq()
+    record = _RECORD.pack(_MAGIC, op, int(seq), len(ids), dim, zlib.crc32(payload)) + payload
+    with _locked(index_file):
+        with open(journal_file(index_file), "ab") as f:
+            f.write(record)
+            f.flush()
+            if JOURNAL_FSYNC:
+                os.fsync(f.fileno())
+
+def read_journal(index_file, start=0):
+    """
+    Liest gültige Journal-Datensätze ab Byte-Offset start.
+    Gibt (records, end) zurück: records = [(op, seq, ids, vectors)], end = Offset hinter dem
+    letzten gültigen Datensatz (ein abgerissener Datensatz am Ende wird ignoriert).
+    """
+    records = []
+    path = journal_file(index_file)
+    if not os.path.exists(path):
+        return records, 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        end = start
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                break
+            magic, op, seq, n, dim, crc = _RECORD.unpack(head)
+            if magic != _MAGIC or n < 0 or dim < 0:
+                break
+            payload = f.read(n * 8 + n * dim * 4)
+            if len(payload) < n * 8 + n * dim * 4 or zlib.crc32(payload) != crc:
+                break
+            ids = np.frombuffer(payload[:n * 8], dtype="int64")
+            vectors = np.frombuffer(payload[n * 8:], dtype="float32").reshape(n, dim) if dim else None
+            records.append((op, seq, ids, vectors))
+            end = f.tell()
+    return records, end
+
+def _truncate_torn_tail(index_file):
+    """Schneidet einen bei einem Absturz halb geschriebenen Datensatz ab, damit neue Appends lesbar bleiben."""
+    with _locked(index_file):
+        # Unter der Sperre neu bestimmen: parallele Appends sind vollständige Datensätze
+        end = read_journal(index_file)[1]
+        if journal_size(index_file) > end:
+            with open(journal_file(index_file), "r+b") as f:
+                f.truncate(end)
+
+def journal_counts(index_file):
+    """(Anzahl hinzugefügter, Anzahl entfernter IDs) im Journal, nur Datensatzköpfe gelesen."""
+    added = removed = 0
+    path = journal_file(index_file)
+    if not os.path.exists(path):
+        return 0, 0
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                break
+            magic, op, seq, n, dim, crc = _RECORD.unpack(head)
+            if magic != _MAGIC or f.tell() + n * 8 + n * dim * 4 > size:
+                break
+            f.seek(n * 8 + n * dim * 4, os.SEEK_CUR)
+            if op == OP_ADD:
+                added += n
+            elif op == OP_REMOVE:
+                removed += n
+    return added, removed
+
+def replay(index, records, collection=None):
+    """
+    Wendet Journal-Datensätze idempotent auf einen Index an.
+    Gibt die Anzahl angewendeter IDs zurück.
+    """
+    present = set(db_faiss_index.index_ids(index).tolist())
+    applied = 0
+    for op, seq, ids, vectors in records:
+        if op == OP_REMOVE:
+            todo = [vid for vid in ids.tolist() if vid in present]
+            if todo and db_faiss_index.remove_vectors(index, todo) >= 0:
+                present.difference_update(todo)
+                applied += len(todo)
+        elif op == OP_ADD:
+            keep = np.array([vid not in present for vid in ids.tolist()], dtype=bool)
+            if collection is not None and keep.any():
+                known = db_id_manager.get_by_vektor_indices(ids[keep], collection=collection)
+                keep &= np.array([vid in known for vid in ids.tolist()], dtype=bool)
+            if keep.any():
+                db_faiss_index.add_vectors(index, vectors[keep], ids[keep])
+                present.update(ids[keep].tolist())
+                applied += int(keep.sum())
+    return applied
+
+# ---------- Öffentliche Schnittstelle ----------
+def load_index(index_file, collection=None):
+    """
+    Lädt Snapshot + Journal. Gibt (index, journal_end) zurück; journal_end kann an
+    write_snapshot übergeben werden, damit nur neuere Datensätze nachgespielt werden.
+    """
+    index = faiss.read_index(index_file)
+    records, end = read_journal(index_file)
+    if journal_size(index_file) > end:
+        _truncate_torn_tail(index_file)
+    if records:
+        replay(index, records, collection)
+    return index, end
+
+def _resident_bytes(index, index_file, flags):
+    """
+    Geschätzter Speicherbedarf eines mit flags gelesenen Index außerhalb des Page-Cache:
+    eingeblendet sind nur die invertierten Listen (IO_FLAG_MMAP, IVF) bzw. die Flat-Codes
+    (IO_FLAG_MMAP_IFC, Flat/HNSW-Storage); alles andere liegt voll im Speicher. Ältere
+    FAISS-Versionen ohne MMAP_IFC lesen Flat-Indizes trotz mmap-Flag komplett ein.
+    """
+    size = os.path.getsize(index_file)
+    if faiss.try_extract_index_ivf(index) is not None:
+        return 0 if flags & getattr(faiss, "IO_FLAG_MMAP", 0) else size
+    if flags & getattr(faiss, "IO_FLAG_MMAP_IFC", 0):
+        return max(0, size - index.ntotal * index.d * 4)  # HNSW: Graph bleibt im Speicher
+    return size
+
+def load_query_index(index_file, collection=None):
+    """
+    Lädt einen Index nur zum Suchen. Gibt (index, read_only, resident_bytes) zurück.
+    Ohne offenes Journal wird der Snapshot per mmap eingeblendet (read_only=True, nicht
+    verändern!); mit Journal-Datensätzen oder ohne mmap-Unterstützung voll geladen.
+    resident_bytes: tatsächlich im Prozess belegter Speicher (für das Budget des IndexManagers).
+    """
+    if QUERY_MMAP and journal_size(index_file) == 0:
+        for flags in MMAP_FLAG_VARIANTS:
+            try:
+                index = faiss.read_index(index_file, flags)
+            except RuntimeError:
+                continue
+            return index, True, _resident_bytes(index, index_file, flags)
+    index, _ = load_index(index_file, collection)
+    return index, False, None
+
+def journal_end(index_file):
+    """Aktuelles Ende des gültigen Journals (vor einem Neuaufbau merken, an write_snapshot übergeben)."""
+    return read_journal(index_file)[1]
+
+@db_trace.traced("index.write_snapshot")
+def write_snapshot(index, index_file, journal_offset=0, collection=None):
+    """
+    Schreibt einen Snapshot (Temp-Datei + fsync + Rename) und leert das Journal.
+    Unter der Sperre werden vorher alle Journal-Datensätze ab journal_offset idempotent
+    auf den Index nachgespielt, damit Appends paralleler Schreiber nicht verloren gehen.
+    """
+    with _locked(index_file):
+        records, _ = read_journal(index_file, journal_offset)
+        if records:
+            replay(index, records, collection)
+        db_faiss_index.write_index_atomic(index, index_file)
+        _fsync_dir(index_file)
+        # Journal leeren; ein Abbruch davor ist unkritisch (Replay ist idempotent)
+        if os.path.exists(journal_file(index_file)):
+            with open(journal_file(index_file), "wb") as f:
+                os.fsync(f.fileno())
+
+@db_trace.traced("index.journal_add")
+def add(index, index_file, vectors, ids, seq=None):
+    """Vektoren ins Journal schreiben und im geladenen Index hinzufügen (nach dem Registry-Commit aufrufen)."""
+    _append(index_file, OP_ADD, ids, vectors, seq)
+    db_faiss_index.add_vectors(index, vectors, ids)
+
+@db_trace.traced("index.journal_remove")
+def remove(index, index_file, ids, seq=None):
+    """Vektoren per ID entfernen und im Journal vermerken; -1, wenn der Index kein Delete kann."""
+    removed = db_faiss_index.remove_vectors(index, ids)
+    if removed >= 0:
+        _append(index_file, OP_REMOVE, ids, None, seq)
+    return removed
+
+def maybe_compact(index, index_file, collection=None):
+    """Schreibt einen neuen Snapshot, sobald das Journal COMPACT_BYTES überschreitet."""
+    if journal_size(index_file) < COMPACT_BYTES:
+        return False
+    write_snapshot(index, index_file, collection=collection)
+    return True
+
+def remove_files(index_file):
+    """Journal- und Lock-Datei eines gelöschten Index entfernen."""
+    for path in (journal_file(index_file), index_file + LOCK_SUFFIX):
+        if os.path.exists(path):
+            os.remove(path)
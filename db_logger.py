@@ -1,21 +1,185 @@
 # logger.py
+#
+# Gemeinsames Logging aller Module (Gateway, Daemon, Checkup, Cleanup, Monitoring, OSINT):
+#   - log_audit(msg, level)  -> audit.log               (Daemon/Checkup/Cleanup/...)
+#   - log_event(event, level) -> shadowbroker_gateway.log (+ optional farbig auf der Konsole)
+# Aufrufer legen Zeilen nur in eine begrenzte Queue; ein Hintergrund-Thread schreibt sie
+# gebündelt (ein write + flush pro Batch statt open/append/close pro Zeile). Volle Queue:
+# der Aufrufer wartet (Backpressure), Audit-Einträge gehen nicht verloren.
+# Rotation nach Größe (BROKER_LOG_MAX_MB) und/oder Alter (BROKER_LOG_ROTATE_HOURS), rotierte
+# Dateien werden gzip-komprimiert, es bleiben BROKER_LOG_BACKUPS Stück.
+# BROKER_LOG_FORMAT=json schreibt eine JSON-Zeile pro Eintrag (Promtail json-Stage, siehe
+# Loki/promtail-config.yaml), default ist das bisherige Textformat.
 
-from rich.console import Console
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
 from datetime import datetime
 
-console = Console()
-LOGFILE = "shadowbroker_gateway.log"
+AUDIT_LOG = os.environ.get("BROKER_AUDIT_LOG", "audit.log")
+LOGFILE = os.environ.get("BROKER_EVENT_LOG", "shadowbroker_gateway.log")
+LOG_FORMAT = os.environ.get("BROKER_LOG_FORMAT", "text")           # text | json
+LOG_CONSOLE = os.environ.get("BROKER_LOG_CONSOLE", "1") != "0"     # log_event zusätzlich auf die Konsole
+QUEUE_SIZE = int(os.environ.get("BROKER_LOG_QUEUE", "10000"))
+FLUSH_INTERVAL = float(os.environ.get("BROKER_LOG_FLUSH_MS", "200")) / 1000.0
+BATCH_MAX = 1000                                                    # Zeilen pro Schreibvorgang
+MAX_BYTES = int(float(os.environ.get("BROKER_LOG_MAX_MB", "50")) * 1024 * 1024)   # 0 = keine Größenrotation
+ROTATE_SECONDS = float(os.environ.get("BROKER_LOG_ROTATE_HOURS", "0")) * 3600     # 0 = keine Zeitrotation
+BACKUPS = int(os.environ.get("BROKER_LOG_BACKUPS", "5"))
+
+_COLORS = {
+    "INFO": "#176030",
+    "WARN": "#ffbe4d",
+    "ERROR": "#ff5555",
+    "DEBUG": "#24caff"
+}
+
+_console = None
+_queue = None
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def _format(level, msg, pid, audit):
+    if LOG_FORMAT == "json":
+        return json.dumps({
+            "ts": datetime.now().astimezone().isoformat(),
+            "level": level,
+            "pid": pid,
+            "msg": msg,
+        }, ensure_ascii=False)
+    if audit:
+        return f"{datetime.now().isoformat(timespec='seconds')} [{level}] [PID:{pid}] {msg}"
+    return f"{datetime.now().isoformat()} [{level}] {msg}"
+
+
+class _LogFile:
+    """Offene Logdatei mit Rotation; erkennt Rotation durch andere Prozesse (Inode gewechselt)."""
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+        self.opened = None
+
+    def _open(self):
+        self.f = open(self.path, "a", encoding="utf-8")
+        self.opened = time.time()
+
+    def _stale(self):
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.f.fileno()).st_ino
+        except OSError:
+            return True
+
+    def write(self, lines):
+        if self.f is not None and not self._stale() and self._due():
+            self.rotate()
+        if self.f is None or self._stale():
+            self.close()
+            self._open()
+        self.f.write("\n".join(lines) + "\n")
+        self.f.flush()
+
+    def _due(self):
+        if MAX_BYTES and self.f.tell() >= MAX_BYTES:
+            return True
+        return bool(ROTATE_SECONDS) and time.time() - self.opened >= ROTATE_SECONDS
+
+    def rotate(self):
+        self.close()
+        rotated = f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        try:
+            os.replace(self.path, rotated)
+        except OSError:
+            return  # Windows: Datei noch von einem anderen Prozess geöffnet -> beim nächsten Mal
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        for old in sorted(glob.glob(glob.escape(self.path) + ".*.gz"))[:-BACKUPS or None]:
+            os.remove(old)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def _run(q):
+    files = {}
+    while True:
+        item = q.get()
+        batch = [item]
+        # Alles Anstehende (bis BATCH_MAX) mitnehmen; bei wenig Last kurz auf weitere Zeilen warten
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < BATCH_MAX:
+            try:
+                batch.append(q.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        by_file = {}
+        waiters = []
+        for entry in batch:
+            if isinstance(entry, threading.Event):
+                waiters.append(entry)
+            else:
+                by_file.setdefault(entry[0], []).append(entry[1])
+        for path, lines in by_file.items():
+            try:
+                files.setdefault(path, _LogFile(path)).write(lines)
+            except OSError:
+                pass  # Logging darf die Anwendung nicht stoppen
+        for event in waiters:
+            event.set()
+
+def _get_queue():
+    """Queue + Writer-Thread dieses Prozesses (nach fork() neu, der Thread überlebt fork nicht)."""
+    global _queue, _writer, _writer_pid
+    if _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer_pid != os.getpid():
+                _queue = queue.Queue(maxsize=QUEUE_SIZE)
+                _writer = threading.Thread(target=_run, args=(_queue,), name="broker-log-writer", daemon=True)
+                _writer.start()
+                _writer_pid = os.getpid()
+    return _queue
+
+def _enqueue(path, line):
+    _get_queue().put((path, line))
+
+def flush(timeout=5.0):
+    """Wartet, bis alle bisher eingereihten Zeilen geschrieben sind (z. B. vor Prozessende)."""
+    if _writer_pid != os.getpid():
+        return True
+    done = threading.Event()
+    _queue.put(done)
+    return done.wait(timeout)
+
+atexit.register(flush)
+
+
+def log_audit(msg, level="INFO", pid=None):
+    """Audit-Eintrag (audit.log); pid default: eigener Prozess (Monitoring: PID des gestarteten Dienstes)."""
+    _enqueue(AUDIT_LOG, _format(level, msg, pid or os.getpid(), audit=True))
+
+def audit_logger(default_level):
+    """log_audit mit modul-eigenem Default-Level, z. B. log_audit = db_logger.audit_logger("CLEANUP")."""
+    def log(msg, level=default_level):
+        log_audit(msg, level)
+    return log
 
 def log_event(event, level="INFO"):
-    line = f"{datetime.now().isoformat()} [{level}] {event}"
-    # Schreibe in Logfile
-    with open(LOGFILE, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
-    # Schreibe auf Konsole (optional farbig)
-    color = {
-        "INFO": "#176030",
-        "WARN": "#ffbe4d",
-        "ERROR": "#ff5555",
-        "DEBUG": "#24caff"
-    }.get(level, "#dddddd")
-    console.print(f"[{color}]{line}[/{color}]")
+    line = _format(level, event, os.getpid(), audit=False)
+    _enqueue(LOGFILE, line)
+    if LOG_CONSOLE:
+        global _console
+        if _console is None:
+            from rich.console import Console
+            _console = Console()
+        color = _COLORS.get(level, "#dddddd")
+        _console.print(f"[{color}]{line}[/{color}]")
@@ -0,0 +1,235 @@
+# metrics.py
+#
+# Prozessweite Metriken im Prometheus-Textformat (ohne prometheus_client):
+#   - Counter:   nur steigend (z. B. broker_docs_added_total{collection=...})
+#   - Histogram: Latenzen/Dauern mit festen Buckets (_bucket/_sum/_count)
+#   - Gauge:     aktueller Wert (z. B. ntotal/Registry-Anzahl/Drift pro Collection)
+# Collectors (register_collector) werden direkt vor dem Rendern aufgerufen und setzen
+# Gauges, deren Wert erst beim Scrapen bestimmt wird.
+#
+# Scrape: GET /metrics am Gateway-Server bzw. am Daemon (BROKER_DAEMON_METRICS_PORT),
+# CLI:    python db_faiss_gateway.py stats --metrics
+
+import functools
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import db_trace
+
+# Sekunden; Abfragen/Suchen im ms-Bereich bis zu langen Rebuilds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = {}
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_items(items))
+        return lines
+
+    def _render_items(self, items):
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(_label_key(labels), None)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [Zähler pro Bucket (nicht kumuliert) + Überlauf, Summe, Anzahl]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_items(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+def _get_or_create(cls, name, help_text, **kwargs):
+    with _registry_lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, help_text, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metrik '{name}' ist bereits als {metric.kind} registriert")
+        return metric
+
+def counter(name, help_text):
+    return _get_or_create(Counter, name, help_text)
+
+def gauge(name, help_text):
+    return _get_or_create(Gauge, name, help_text)
+
+def histogram(name, help_text, buckets=LATENCY_BUCKETS):
+    return _get_or_create(Histogram, name, help_text, buckets=buckets)
+
+def timed(hist, span=None, **labels):
+    """
+    Decorator: Laufzeit der Funktion in hist, Label op = Funktionsname (falls nicht gesetzt).
+    span: Präfix für einen db_trace-Span "<span>.<Funktionsname>" (--profile).
+    """
+    def decorate(func):
+        func_labels = {"op": func.__name__, **labels}
+        span_name = f"{span}.{func.__name__}" if span else None
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if span_name is None:
+                with hist.time(**func_labels):
+                    return func(*args, **kwargs)
+            with db_trace.span(span_name), hist.time(**func_labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def register_collector(func):
+    """func() wird vor jedem render() aufgerufen (z. B. Gauges pro Collection aktualisieren)."""
+    with _registry_lock:
+        if func not in _collectors:
+            _collectors.append(func)
+    return func
+
+def render():
+    """Alle Metriken im Prometheus-Textformat (Exposition-Format 0.0.4)."""
+    with _registry_lock:
+        collectors = list(_collectors)
+    for collect in collectors:
+        try:
+            collect()
+        except Exception as e:
+            # Ein kaputter Collector darf den Scrape nicht verhindern
+            print(f"[WARN] Metrik-Collector {getattr(collect, '__name__', collect)}: {e}", file=sys.stderr)
+    with _registry_lock:
+        metrics = sorted(_metrics.values(), key=lambda metric: metric.name)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- Metriken der Broker-Module ----------
+EMBED_SECONDS = histogram("broker_embed_seconds", "Dauer von EmbeddingEngine.encode pro Aufruf")
+EMBED_TEXTS = counter("broker_embed_texts_total", "Embeddete Texte (cached: aus dem Embedding-Cache)")
+SEARCH_SECONDS = histogram("broker_search_seconds", "Dauer der FAISS-Suche pro Collection und Aufruf")
+REGISTRY_QUERY_SECONDS = histogram("broker_registry_query_seconds", "Dauer von Registry-Abfragen (SQLite) pro Funktion")
+DOCS_ADDED = counter("broker_docs_added_total", "Neu in die Registry geschriebene Dokumente")
+DOCS_UPDATED = counter("broker_docs_updated_total", "In der Registry ersetzte Dokumente (Update, erneuter Import)")
+DOCS_DELETED = counter("broker_docs_deleted_total", "Aus der Registry gelöschte Dokumente")
+REBUILD_SECONDS = histogram("broker_rebuild_seconds", "Dauer von Index-Rebuild/-Reparatur/-Abgleich", DURATION_BUCKETS)
+DAEMON_CYCLE_SECONDS = histogram("broker_daemon_cycle_seconds", "Dauer eines Daemon-Durchlaufs", DURATION_BUCKETS)
+COLLECTION_NTOTAL = gauge("broker_collection_ntotal", "Vektoren im FAISS-Index (Snapshot + Journal)")
+COLLECTION_REGISTRY_COUNT = gauge("broker_collection_registry_count", "Einträge der Collection in der Registry")
+COLLECTION_DRIFT = gauge("broker_collection_drift", "Registry-Einträge minus Index-Vektoren")
+
+
+def set_collection_gauges(collection, registry_count, ntotal):
+    COLLECTION_REGISTRY_COUNT.set(registry_count, collection=collection)
+    COLLECTION_NTOTAL.set(ntotal, collection=collection)
+    COLLECTION_DRIFT.set(registry_count - ntotal, collection=collection)
+
+
+# ---------- Scrape-Endpunkt (Daemon; der Gateway-Server hat /metrics im eigenen Handler) ----------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_in_background(port, host="127.0.0.1"):
+    """Startet einen /metrics-Endpunkt in einem Daemon-Thread; gibt den Server zurück."""
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="broker-metrics", daemon=True).start()
+    return httpd
@@ -0,0 +1,113 @@
+# search_filter.py
+#
+# Metadaten-gefilterte Vektorsuche:
+#   - Registry-Prädikate (source, entity_type, import_batch, since/until, min_confidence) werden
+#     per SQL zu einer Menge von Vektor-IDs aufgelöst (Indizes aus Migration 4 und 5)
+#   - große Teilmengen: FAISS-IDSelector als Suchparameter, nur IDs der Teilmenge kommen
+#     in die Top-k (kein Over-Fetching + Nachfiltern)
+#   - kleine Teilmengen (<= BRUTE_FORCE_MAX): Vektoren der Teilmenge holen (reconstruct bei
+#     IDMap2, direkt aus den invertierten Listen bei IVFFlat) und exakt vergleichen; die
+#     Distanzberechnung kostet dann proportional zur Teilmenge, nicht zur Collection.
+#     IVFPQ (nur Näherungsvektoren): alle Listen mit Selector durchsuchen
+# Aufgelöste ID-Mengen werden pro (Collection, Filter) gecacht, bis sich der
+# Generationszähler der Collection in der Registry ändert.
+
+import os
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+import db_faiss_index
+import db_id_manager
+
+FILTER_FIELDS = ("source", "entity_type", "import_batch", "since", "until", "min_confidence")
+BRUTE_FORCE_MAX = int(os.environ.get("BROKER_FILTER_BRUTE_FORCE", "50000"))
+FILTER_CACHE_SIZE = int(os.environ.get("BROKER_FILTER_CACHE_SIZE", "128"))
+
+_cache = OrderedDict()  # (collection, filters) -> (generation, ids, selector)
+_cache_lock = threading.Lock()
+
+
+def normalize_filters(filters):
+    """Dict ohne leere Werte; until als reines Datum schließt den ganzen Tag ein. None, wenn kein Filter gesetzt ist."""
+    filters = {key: value for key, value in (filters or {}).items() if key in FILTER_FIELDS and value not in (None, "")}
+    if len(filters.get("until", "")) == 10:
+        filters["until"] += "T23:59:59.999999"
+    return filters or None
+
+def filters_from_args(args):
+    """Filter aus den CLI-Argumenten (--source, --entity_type, --import_batch, --since, --until, --min_confidence)."""
+    return normalize_filters({key: getattr(args, key, None) for key in FILTER_FIELDS})
+
+def add_filter_arguments(p):
+    p.add_argument("--source", help="Filter: Quelle (OPTIONAL)")
+    p.add_argument("--entity_type", help="Filter: Entity-Typ (OPTIONAL)")
+    p.add_argument("--import_batch", help="Filter: Import-Batch (OPTIONAL)")
+    p.add_argument("--since", help="Filter: Zeitstempel ab (ISO, inklusive, OPTIONAL)")
+    p.add_argument("--until", help="Filter: Zeitstempel bis (ISO oder Datum, inklusive, OPTIONAL)")
+    p.add_argument("--min_confidence", type=float, help="Filter: Metadaten-confidence mindestens (OPTIONAL)")
+
+def _lookup(collection, filters):
+    key = (collection, tuple(sorted(filters.items())))
+    generation = db_id_manager.filter_generation(collection)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == generation:
+            _cache.move_to_end(key)
+            return cached
+    ids = np.asarray(db_id_manager.filter_vektor_ids(collection, **filters), dtype="int64")
+    entry = (generation, ids, faiss.IDSelectorBatch(ids) if len(ids) else None)
+    with _cache_lock:
+        _cache[key] = entry
+        _cache.move_to_end(key)
+        while len(_cache) > FILTER_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return entry
+
+def filter_ids(collection, filters):
+    """Vektor-IDs der Collection, die den Filtern entsprechen (sortiertes int64-Array, gecacht)."""
+    return _lookup(collection, normalize_filters(filters) or {})[1]
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+def _empty_result(nq, n):
+    return np.full((nq, n), np.inf, dtype="float32"), np.full((nq, n), -1, dtype="int64")
+
+def _search_exact(index, query_emb, n, ids):
+    """Exakte L2-Suche über die Vektoren der Teilmenge (IDMap2: reconstruct, IVFFlat: Listen)."""
+    if db_faiss_index.is_ivf_flat(index):
+        vectors, ids = db_faiss_index.ivf_flat_vectors(index, ids)
+        if not len(ids):
+            return _empty_result(len(query_emb), n)
+    else:
+        vectors = index.reconstruct_batch(ids)
+    k = min(n, len(ids))
+    D, positions = faiss.knn(query_emb, vectors, k)
+    I = np.where(positions >= 0, ids[np.maximum(positions, 0)], -1)
+    if k < n:
+        pad_D, pad_I = _empty_result(len(query_emb), n - k)
+        D, I = np.hstack([D, pad_D]), np.hstack([I, pad_I])
+    return D, I
+
+def search(index, query_emb, n, collection, filters, nprobe=None, ef_search=None):
+    """
+    Top-n innerhalb der gefilterten Teilmenge der Collection; gibt (D, I) wie index.search
+    zurück (fehlende Treffer: Distanz inf, ID -1). nprobe/ef_search gelten nur für diesen Aufruf.
+    """
+    query_emb = np.ascontiguousarray(query_emb, dtype="float32")
+    _, ids, selector = _lookup(collection, normalize_filters(filters) or {})
+    if not len(ids):
+        return _empty_result(len(query_emb), n)
+    small = len(ids) <= BRUTE_FORCE_MAX
+    if small and (isinstance(index, faiss.IndexIDMap2) or db_faiss_index.is_ivf_flat(index)):
+        try:
+            return _search_exact(index, query_emb, n, ids)
+        except RuntimeError:
+            pass  # Registry-ID fehlt im Index (Abgleich durch den Daemon steht aus) -> Selector
+    # Kleine Teilmenge bei IVFPQ: alle Listen durchsuchen, Distanzen nur für Selector-Treffer
+    params = db_faiss_index.search_params(index, nprobe=nprobe, ef_search=ef_search, selector=selector, exhaustive=small)
+    return index.search(query_emb, n, params=params)
@@ -1,193 +1,262 @@
-import sqlite3
 import json
 import os
+import re
+import time
 from datetime import datetime
 
-REGISTRY_DB = "broker_registry.db"
-AUDIT_LOG = "audit.log"
+import db_id_manager
+import db_index_manager
+import db_logger
 
-def log_audit(msg, level="SQLITE_CHECK"):
-    now = datetime.now().isoformat(timespec="seconds")
-    pid = os.getpid()
-    line = f"{now} [{level}] [PID:{pid}] {msg}"
-    with open(AUDIT_LOG, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
+CHUNK_ROWS = 50000          # rowid-Fenster pro Statement/Commit (Gateway-Schreiber kommen dazwischen)
+TIME_BUDGET = 60.0          # Sekunden pro Checkup-Lauf; danach wird abgebrochen und im Report vermerkt
+MAX_SAMPLE_IDS = 10         # Beispiel-IDs pro Regel im Audit-Log statt einer Zeile pro Zeile
+ID_PATTERN = r"[A-Za-z]+_[A-Za-z]+_[A-Za-z]+_[0-9]+_[0-9]+"
+
+log_audit = db_logger.audit_logger("SQLITE_CHECK")
 
 def repair_metadata(meta):
-    # Step 1: Versuche json.loads wie gewohnt
-    try:
-        json.loads(meta)
-        return meta, False  # Already valid
-    except Exception:
-        pass
-
-    # Step 2: Ersetze Single Quotes mit Double Quotes
-    repaired = meta.replace("'", '"')
-    try:
-        json.loads(repaired)
-        return repaired, True
-    except Exception:
-        pass
-
-    # Step 3: Fallback: Versuche ast.literal_eval (nur für kontrollierte Umgebungen)
-    import ast
-    try:
-        obj = ast.literal_eval(meta)
-        as_json = json.dumps(obj, ensure_ascii=False)
-        return as_json, True
-    except Exception:
-        pass
-
-    return meta, False  # Could not repair
-
-def sqlite_checkup():
-    conn = sqlite3.connect(REGISTRY_DB)
+    """Wandelt ungültige Metadaten (Python-Repr, einfache Anführungszeichen) in JSON um -> (json, repariert?)."""
+    as_json = db_id_manager.metadata_to_json(meta)
+    if as_json is None or as_json == meta:
+        return meta, False
+    return as_json, True
+
+
+class CheckupReport:
+    """Ergebnis eines Checkup-Laufs: Anzahl Befunde pro Regel, Beispiel-IDs, Laufzeit."""
+    def __init__(self, time_budget=TIME_BUDGET):
+        self.started = time.monotonic()
+        self.time_budget = time_budget
+        self.counts = {}
+        self.samples = {}
+        self.incomplete = []   # Regeln, die wegen des Zeitbudgets nicht fertig wurden
+        self.duration = None
+
+    def add(self, rule, count, sample_ids=None):
+        self.counts[rule] = self.counts.get(rule, 0) + count
+        if sample_ids:
+            merged = self.samples.setdefault(rule, [])
+            merged.extend(sample_ids[:MAX_SAMPLE_IDS - len(merged)])
+
+    def over_budget(self):
+        return self.time_budget is not None and time.monotonic() - self.started > self.time_budget
+
+    def finish(self):
+        self.duration = time.monotonic() - self.started
+        return self
+
+    def as_dict(self):
+        return {
+            "counts": dict(self.counts),
+            "samples": {k: list(v) for k, v in self.samples.items()},
+            "incomplete": list(self.incomplete),
+            "duration_s": round(self.duration or 0.0, 3),
+        }
+
+    def __str__(self):
+        findings = ", ".join(f"{rule}={n}" for rule, n in self.counts.items() if n) or "keine Befunde"
+        state = f" – abgebrochen (Zeitbudget) bei: {', '.join(self.incomplete)}" if self.incomplete else ""
+        return f"SQLite-Checkup: {findings} in {self.duration or 0.0:.2f}s{state}"
+
+
+WINDOW = "rowid BETWEEN ? AND ?"
+
+def _rowid_windows(c, chunk_rows):
+    c.execute("SELECT MIN(rowid), MAX(rowid) FROM id_registry")
+    lo, hi = c.fetchone()
+    if lo is None:
+        return
+    for start in range(lo, hi + 1, chunk_rows):
+        yield start, start + chunk_rows - 1
+
+def _chunked(conn, report, rule, sql, params=(), sample_sql=None, chunk_rows=CHUNK_ROWS):
+    """
+    Führt ein UPDATE/DELETE fensterweise über rowid-Bereiche aus (ein Commit pro Fenster).
+    sql/sample_sql enden mit der Fensterbedingung (WINDOW); params gehen davor.
+    Gibt False zurück, wenn das Zeitbudget vorher aufgebraucht war.
+    """
     c = conn.cursor()
-    removed = 0
+    for lo, hi in list(_rowid_windows(c, chunk_rows)):
+        if report.over_budget():
+            report.incomplete.append(rule)
+            return False
+        if sample_sql and len(report.samples.get(rule, [])) < MAX_SAMPLE_IDS:
+            c.execute(f"{sample_sql} LIMIT {MAX_SAMPLE_IDS}", (lo, hi))
+            report.add(rule, 0, [row[0] for row in c.fetchall()])
+        c.execute(sql, (*params, lo, hi))
+        report.add(rule, max(c.rowcount, 0))
+        conn.commit()
+    report.counts.setdefault(rule, 0)
+    return True
 
-    # 1. Duplikate erkennen und entfernen
-    # Zuerst: Duplikate selektieren und loggen
-    c.execute('''
-        SELECT rowid, id, collection, entity_type, primary_value
-        FROM id_registry
-        WHERE rowid NOT IN (
-            SELECT MIN(rowid)
-            FROM id_registry
-            GROUP BY collection, entity_type, primary_value
-        )
-    ''')
-    dup_rows = c.fetchall()
-    for row in dup_rows:
-        log_audit(f"Duplikat gelöscht: rowid={row[0]}, id={row[1]}, collection={row[2]}, entity_type={row[3]}, primary_value={row[4]}", "CLEANUP")
-    # Jetzt löschen
-    c.execute("""
-        DELETE FROM id_registry
-        WHERE rowid NOT IN (
-            SELECT MIN(rowid)
-            FROM id_registry
-            GROUP BY collection, entity_type, primary_value
-        )
-    """)
-    dupes = conn.total_changes
-    if dupes > 0:
-        log_audit(f"{dupes} Duplikate entfernt (gleiche Collection, entity_type, primary_value).", "CLEANUP")
+def _count(conn, report, rule, where, params=(), chunk_rows=CHUNK_ROWS):
+    """Zählt Befunde fensterweise (nur Report, keine Änderung)."""
+    c = conn.cursor()
+    for lo, hi in list(_rowid_windows(c, chunk_rows)):
+        if report.over_budget():
+            report.incomplete.append(rule)
+            return False
+        c.execute(f"SELECT COUNT(*) FROM id_registry WHERE rowid BETWEEN ? AND ? AND ({where})", (lo, hi, *params))
+        n = c.fetchone()[0]
+        sample = []
+        if n and len(report.samples.get(rule, [])) < MAX_SAMPLE_IDS:
+            c.execute(f"SELECT id FROM id_registry WHERE rowid BETWEEN ? AND ? AND ({where}) LIMIT {MAX_SAMPLE_IDS}", (lo, hi, *params))
+            sample = [row[0] for row in c.fetchall()]
+        report.add(rule, n, sample)
+    report.counts.setdefault(rule, 0)
+    return True
 
-    # 2. IDs prüfen (Format & Eindeutigkeit, wird durch PRIMARY KEY erzwungen, daher nur Format hier)
-    c.execute("SELECT id FROM id_registry")
-    bad_ids = [row[0] for row in c.fetchall() if not valid_id(row[0])]
-    for bad_id in bad_ids:
-        log_audit(f"ID mit ungültigem Format gefunden: {bad_id}", "WARNING")
+def _log_rule(report, rule, msg, level):
+    n = report.counts.get(rule, 0)
+    if n:
+        sample = report.samples.get(rule)
+        suffix = f" Beispiele: {', '.join(map(str, sample))}" if sample else ""
+        log_audit(f"{n} {msg}.{suffix}", level)
 
-    # 3. Leichen & Waisen (leere/null Pflichtfelder)
-    c.execute("""
-        SELECT rowid, id, collection, entity_type, primary_value
-        FROM id_registry
-        WHERE primary_value IS NULL OR TRIM(primary_value) = '' OR collection IS NULL OR entity_type IS NULL
-    """)
-    leichen_rows = c.fetchall()
-    for row in leichen_rows:
-        log_audit(f"Leiche/Waise gelöscht: rowid={row[0]}, id={row[1]}, collection={row[2]}, entity_type={row[3]}, primary_value={row[4]}", "CLEANUP")
-    c.execute("DELETE FROM id_registry WHERE primary_value IS NULL OR TRIM(primary_value) = '' OR collection IS NULL OR entity_type IS NULL")
-    leichen = conn.total_changes
-    if leichen > 0:
-        log_audit(f"{leichen} Leichen/Waisen entfernt (leere/null Pflichtfelder).", "CLEANUP")
-
-    # 4. Zeitliche Anomalien
-    c.execute("SELECT id, timestamp, metadata FROM id_registry")
-    for id, ts, meta in c.fetchall():
-        update_needed = False
-        new_metadata = meta
-        now_iso = datetime.now().isoformat(timespec="seconds")
-        if not ts:
-            # Add missing timestamp
-            new_ts = now_iso
-            try:
-                meta_obj = json.loads(meta) if meta else {}
-            except Exception:
-                meta_obj = {}
-            meta_obj["audited"] = "added missing timestamp"
-            new_metadata = json.dumps(meta_obj, ensure_ascii=False)
-            c.execute("UPDATE id_registry SET timestamp = ?, metadata = ?, import_batch = ? WHERE id = ?", (new_ts, new_metadata, "audited_by_demon", id))
-            log_audit(f"Kein Timestamp bei ID {id} – gesetzt auf {new_ts} und auditiert.", "WARNING")
-            continue
-        try:
-            dt = datetime.fromisoformat(ts.replace("Z", "+00:00") if "Z" in ts else ts)
-            if dt.year < 2000 or dt > datetime.now():
-                # Timely anomaly
-                new_ts = now_iso
-                try:
-                    meta_obj = json.loads(meta) if meta else {}
-                except Exception:
-                    meta_obj = {}
-                meta_obj["audited"] = "timestamp anomaly"
-                new_metadata = json.dumps(meta_obj, ensure_ascii=False)
-                c.execute("UPDATE id_registry SET timestamp = ?, metadata = ?, import_batch = ? WHERE id = ?", (new_ts, new_metadata, "audited_by_demon", id))
-                log_audit(f"Zeitliche Anomalie bei {id}: {ts} – gesetzt auf {new_ts} und auditiert.", "WARNING")
-        except Exception:
-            log_audit(f"Ungültiges Timestamp-Format bei {id}: {ts}", "WARNING")
-
-    # 5. Metadaten-Integrität
-    c.execute("SELECT id, metadata FROM id_registry")
-    for id, meta in c.fetchall():
-        if meta:
-            repaired, fixed = repair_metadata(meta)
-            if fixed:
-                c.execute("UPDATE id_registry SET metadata = ?, import_batch = ? WHERE id = ?", (repaired, "audited_by_demon", id))
-                log_audit(f"Metadata-JSON bei ID {id} auto-repariert.", "CLEANUP")
-            else:
-                try:
-                    json.loads(meta)
-                except Exception:
-                    log_audit(f"Ungültiges Metadata-JSON bei ID: {id} konnte nicht auto-repariert werden.", "WARNING")
-
-    # 6. Collection-Logik: leere Collectionnamen, Sammlungen ohne Index
-    c.execute("SELECT DISTINCT collection FROM id_registry")
-    collections = [row[0] for row in c.fetchall() if row[0] and row[0].strip()]
-    for coll in collections:
-        idxfile = f"{coll}.index"
-        if not os.path.isfile(idxfile):
-            log_audit(f"Registry-Sammlung '{coll}' ohne zugehörigen Index: {idxfile}", "WARNING")
+
+def sqlite_checkup(time_budget=TIME_BUDGET, chunk_rows=CHUNK_ROWS):
+    """
+    Konsistenz-Checkup der Registry als mengenbasierte SQL-Operationen:
+    ein Statement pro Regel und rowid-Fenster statt einer Abfrage/Änderung pro Zeile,
+    aggregierte Audit-Zeilen statt einer Zeile pro Befund.
+    Gibt einen CheckupReport zurück.
+    """
+    conn = db_id_manager.get_connection()  # geteilte Registry-Verbindung (WAL), nicht schließen
+    conn.create_function("REGEXP", 2, lambda pattern, value: value is not None and re.match(pattern, str(value)) is not None, deterministic=True)
+    report = CheckupReport(time_budget)
+    now_iso = datetime.now().isoformat(timespec="seconds")
+
+    # 1. Duplikate (gleiche Collection, entity_type, primary_value): jüngere Zeilen löschen
+    dup_where = """
+        EXISTS (SELECT 1 FROM id_registry d
+                WHERE d.collection IS id_registry.collection
+                  AND d.entity_type IS id_registry.entity_type
+                  AND d.primary_value IS id_registry.primary_value
+                  AND d.rowid < id_registry.rowid)
+    """
+    _chunked(conn, report, "duplicates",
+             f"DELETE FROM id_registry WHERE {dup_where} AND {WINDOW}",
+             sample_sql=f"SELECT id FROM id_registry WHERE {dup_where} AND {WINDOW}",
+             chunk_rows=chunk_rows)
+    _log_rule(report, "duplicates", "Duplikate entfernt (gleiche Collection, entity_type, primary_value)", "CLEANUP")
+
+    # 2. ID-Format (PRIMARY KEY erzwingt Eindeutigkeit, hier nur das Format)
+    _count(conn, report, "invalid_id_format", "NOT (id REGEXP ?)", (ID_PATTERN,), chunk_rows)
+    _log_rule(report, "invalid_id_format", "IDs mit ungültigem Format gefunden", "WARNING")
+
+    # 3. Leichen & Waisen (leere/null Pflichtfelder) – deckt auch die alte Regel 8 ab
+    corpse_where = "(primary_value IS NULL OR TRIM(primary_value) = '' OR collection IS NULL OR entity_type IS NULL)"
+    _chunked(conn, report, "corpses",
+             f"DELETE FROM id_registry WHERE {corpse_where} AND {WINDOW}",
+             sample_sql=f"SELECT id FROM id_registry WHERE {corpse_where} AND {WINDOW}",
+             chunk_rows=chunk_rows)
+    _log_rule(report, "corpses", "Leichen/Waisen entfernt (leere/null Pflichtfelder)", "CLEANUP")
+
+    # 4. Metadaten-Integrität: ungültige Zeilen über den partiellen Index (kein Tabellenscan),
+    #    nur diese landen in Python (ast-Reparatur)
+    if report.over_budget():
+        report.incomplete.append("metadata")
+    else:
+        c = conn.cursor()
+        fixed, broken, broken_ids, last_id = 0, 0, [], ""
+        while True:
+            if report.over_budget():
+                report.incomplete.append("metadata")
+                break
+            c.execute(f"""
+                SELECT rowid, id, metadata FROM id_registry
+                WHERE {db_id_manager.METADATA_INVALID} AND id > ?
+                ORDER BY id LIMIT ?
+            """, (last_id, chunk_rows))
+            rows = c.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][1]
+            updates = []
+            for rowid, id, meta in rows:
+                repaired, ok = repair_metadata(meta)
+                if ok:
+                    updates.append((repaired, "audited_by_demon", rowid))
+                else:
+                    broken += 1
+                    broken_ids.append(id)
+            c.executemany("UPDATE id_registry SET metadata = ?, import_batch = ? WHERE rowid = ?", updates)
+            conn.commit()
+            fixed += len(updates)
+        report.add("metadata_repaired", fixed)
+        report.add("metadata_invalid", broken, broken_ids)
+    _log_rule(report, "metadata_repaired", "Metadata-JSON-Einträge auto-repariert", "CLEANUP")
+    _log_rule(report, "metadata_invalid", "ungültige Metadata-JSON-Einträge konnten nicht auto-repariert werden", "WARNING")
+
+    # 5. Zeitliche Anomalien (nach der Metadaten-Reparatur, damit json_set gültiges JSON vorfindet)
+    audit_set = ("SET timestamp = ?, import_batch = 'audited_by_demon', "
+                 "metadata = json_set(CASE WHEN json_valid(metadata) THEN metadata ELSE '{}' END, '$.audited', ?)")
+    missing_where = "(timestamp IS NULL OR TRIM(timestamp) = '')"
+    _chunked(conn, report, "timestamp_missing",
+             f"UPDATE id_registry {audit_set} WHERE {missing_where} AND {WINDOW}",
+             (now_iso, "added missing timestamp"),
+             sample_sql=f"SELECT id FROM id_registry WHERE {missing_where} AND {WINDOW}",
+             chunk_rows=chunk_rows)
+    _log_rule(report, "timestamp_missing", f"Einträge ohne Timestamp – gesetzt auf {now_iso} und auditiert", "WARNING")
+
+    # Vor 2000 oder in der Zukunft; julianday() ist NULL bei ungültigem Format (eigene Regel unten)
+    # Vergleich mit voller Präzision, sonst gelten frische Einträge (mit Mikrosekunden) als Zukunft
+    anomaly_where = f"((timestamp < '2000' OR timestamp > '{datetime.now().isoformat()}') AND julianday(timestamp) IS NOT NULL)"
+    _chunked(conn, report, "timestamp_anomaly",
+             f"UPDATE id_registry {audit_set} WHERE {anomaly_where} AND {WINDOW}",
+             (now_iso, "timestamp anomaly"),
+             sample_sql=f"SELECT id FROM id_registry WHERE {anomaly_where} AND {WINDOW}",
+             chunk_rows=chunk_rows)
+    _log_rule(report, "timestamp_anomaly", f"zeitliche Anomalien (vor 2000 oder in der Zukunft) – gesetzt auf {now_iso} und auditiert", "WARNING")
+
+    _count(conn, report, "timestamp_invalid",
+           "timestamp IS NOT NULL AND TRIM(timestamp) <> '' AND julianday(timestamp) IS NULL", (), chunk_rows)
+    _log_rule(report, "timestamp_invalid", "Einträge mit ungültigem Timestamp-Format", "WARNING")
+
+    # 6. Collection-Logik: Sammlungen ohne Index (DISTINCT über den Collection-Index)
+    missing_index = []
+    for coll in db_id_manager.list_collection_names():
+        if coll.strip() and not os.path.isfile(db_index_manager.index_path(coll)):
+            missing_index.append(coll)
+    report.add("collection_without_index", len(missing_index), missing_index)
+    _log_rule(report, "collection_without_index", "Registry-Sammlungen ohne zugehörigen Index", "WARNING")
 
     # 7. ID-Kollisionsschutz (bereits PRIMARY KEY, aber zur Sicherheit Report)
+    c = conn.cursor()
+    c.execute("SELECT id FROM id_registry GROUP BY id HAVING COUNT(*) > 1")
+    collisions = [row[0] for row in c.fetchall()]
+    report.add("id_collision", len(collisions), collisions)
+    _log_rule(report, "id_collision", "ID-KOLLISIONEN gefunden", "ERROR")
+
+    # 8. Optionale Felder NULL/leer: nur Aggregat als INFO (keine Zeile pro Eintrag)
     c.execute("""
-        SELECT id, COUNT(*)
+        SELECT
+            SUM(metadata IS NULL OR TRIM(metadata) = ''),
+            SUM(import_batch IS NULL OR TRIM(import_batch) = ''),
+            SUM(timestamp IS NULL OR TRIM(timestamp) = '')
         FROM id_registry
-        GROUP BY id
-        HAVING COUNT(*) > 1
     """)
-    for id, count in c.fetchall():
-        log_audit(f"KOLLISION: ID {id} taucht {count}x auf!", "ERROR")
-
-    # 8. Leere/unnütze Einträge (sollten mit #3 abgedeckt sein, Redundanz für Sicherheit)
-    # Nur Pflichtfelder werden für Löschung geprüft, optionale NULLs werden als INFO geloggt
-    # Pflichtfelder: primary_value, collection, entity_type
-    # Optionale Felder: metadata, import_batch, timestamp
-    # Logge optionale NULLs als INFO
-    c.execute("SELECT rowid, id, collection, entity_type, primary_value, metadata, import_batch, timestamp FROM id_registry")
-    for row in c.fetchall():
-        rowid, id, collection, entity_type, primary_value, metadata, import_batch, timestamp = row
-        # Pflichtfeld-Check (Löschung, wie gehabt)
-        if primary_value is None or str(primary_value).strip() == "":
-            c.execute("DELETE FROM id_registry WHERE rowid = ?", (rowid,))
-            log_audit(f"Null/unnützer Eintrag entfernt: rowid={rowid}, id={id}, collection={collection}, entity_type={entity_type}, primary_value={primary_value}", "CLEANUP")
-        # Optionale Felder NULL/leer: nur loggen
-        else:
-            if metadata is None or str(metadata).strip() == "":
-                log_audit(f"Optionales Feld 'metadata' ist NULL/leer bei rowid={rowid}, id={id}", "INFO")
-            if import_batch is None or str(import_batch).strip() == "":
-                log_audit(f"Optionales Feld 'import_batch' ist NULL/leer bei rowid={rowid}, id={id}", "INFO")
-            if timestamp is None or str(timestamp).strip() == "":
-                log_audit(f"Optionales Feld 'timestamp' ist NULL/leer bei rowid={rowid}, id={id}", "INFO")
+    for field, n in zip(("metadata", "import_batch", "timestamp"), c.fetchone()):
+        report.add(f"optional_{field}_empty", n or 0)
+        _log_rule(report, f"optional_{field}_empty", f"Einträge mit leerem optionalem Feld '{field}'", "INFO")
 
     conn.commit()
-    conn.close()
-    log_audit("SQLite-Checkup abgeschlossen.", "SUCCESS")
+    report.finish()
+    log_audit(str(report), "SUCCESS" if not report.incomplete else "WARNING")
+    return report
 
 def valid_id(id_str):
     # Beispiel-Regel: collection_entitytype_source_YYYYMMDD_uniq
     # Passe Regex an dein wirkliches ID-Schema an
-    import re
-    return bool(re.match(r"[A-Za-z]+_[A-Za-z]+_[A-Za-z]+_[0-9]+_[0-9]+", str(id_str)))
+    return bool(re.match(ID_PATTERN, str(id_str)))
 
 if __name__ == "__main__":
-    sqlite_checkup()
+    import argparse
+    parser = argparse.ArgumentParser(description="SQLite-Checkup der Broker-Registry")
+    parser.add_argument("--time_budget", type=float, default=TIME_BUDGET, help=f"Max. Laufzeit in Sekunden (default: {TIME_BUDGET})")
+    parser.add_argument("--chunk_rows", type=int, default=CHUNK_ROWS, help=f"rowid-Fenster pro Statement (default: {CHUNK_ROWS})")
+    parser.add_argument("--json", action="store_true", help="Report als JSON ausgeben")
+    args = parser.parse_args()
+    result = sqlite_checkup(time_budget=args.time_budget, chunk_rows=args.chunk_rows)
+    print(json.dumps(result.as_dict(), ensure_ascii=False, indent=2) if args.json else result)
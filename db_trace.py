@@ -0,0 +1,141 @@
+# trace.py
+#
+# Leichte Timing-Spans für die Stufen eines Kommandos (Model-Load, Encode, Index-Load,
+# Index-Suche, Registry-I/O, Index-Schreiben). Aufgezeichnet wird nur innerhalb von
+# profile() im selben Thread (bzw. in per wrap() übergebenen Worker-Threads); sonst ist
+# span() ein Attribut-Lookup ohne Zeitmessung.
+#
+#   with db_trace.span("index.search"): ...
+#   @db_trace.traced("registry.read")
+#
+# Gateway: python db_faiss_gateway.py --profile [--profile_out query.pstats] query ...
+# gibt nach dem Kommando die Aufschlüsselung pro Stufe aus (auch über den Gateway-Server).
+
+import cProfile
+import functools
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+PSTATS_TOP = 25  # Zeilen der cProfile-Übersicht (sortiert nach kumulierter Zeit)
+
+_local = threading.local()
+
+
+class Trace:
+    """Aggregierte Spans eines Kommandos: Pfad (Eltern-Spans + Name) -> [Aufrufe, Sekunden]."""
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.wall = None
+
+    def _enter(self, path):
+        with self.lock:
+            self.stages.setdefault(path, [0, 0.0])  # Reihenfolge des ersten Auftretens
+
+    def _exit(self, path, seconds):
+        with self.lock:
+            stage = self.stages[path]
+            stage[0] += 1
+            stage[1] += seconds
+
+    def report(self):
+        """Tabelle pro Stufe (eingerückt nach Verschachtelung) mit Anteil an der Gesamtzeit."""
+        wall = self.wall if self.wall is not None else time.perf_counter() - self.started
+        lines = [f"{'Stufe':<40} {'Aufrufe':>8} {'ms':>10} {'%':>6}"]
+        top_level = 0.0
+        with self.lock:
+            stages = list(self.stages.items())
+        for path, (calls, seconds) in stages:
+            if len(path) == 1:
+                top_level += seconds
+            name = "  " * (len(path) - 1) + path[-1]
+            lines.append(f"{name:<40} {calls:>8} {seconds * 1000:>10.1f} {100 * seconds / wall if wall else 0:>6.1f}")
+        rest = max(0.0, wall - top_level)
+        lines.append(f"{'(ohne Span)':<40} {'':>8} {rest * 1000:>10.1f} {100 * rest / wall if wall else 0:>6.1f}")
+        lines.append(f"{'Gesamt':<40} {'':>8} {wall * 1000:>10.1f} {100.0:>6.1f}")
+        return "\n".join(lines)
+
+
+def current():
+    return getattr(_local, "trace", None)
+
+@contextmanager
+def span(name):
+    """Misst die Dauer des Blocks als Stufe name (nur während profile() aktiv)."""
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        yield
+        return
+    path = _local.path + (name,)
+    trace._enter(path)
+    parent, _local.path = _local.path, path
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace._exit(path, time.perf_counter() - start)
+        _local.path = parent
+
+def traced(name):
+    """Decorator-Variante von span()."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def wrap(func):
+    """Überträgt den aktiven Trace (mit aktuellem Span als Eltern) auf func in einem Worker-Thread."""
+    trace = current()
+    if trace is None:
+        return func
+    parent_path = _local.path
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        saved = (getattr(_local, "trace", None), getattr(_local, "path", ()))
+        _local.trace, _local.path = trace, parent_path
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.trace, _local.path = saved
+    return wrapper
+
+@contextmanager
+def profile(out_file=None, stream=None):
+    """
+    Zeichnet die Spans des Blocks auf und gibt danach die Aufschlüsselung pro Stufe aus.
+    out_file: zusätzlich cProfile laufen lassen und die pstats dorthin schreiben
+    (auswerten z. B. mit python -m pstats out_file oder snakeviz).
+    """
+    trace = Trace()
+    saved = (getattr(_local, "trace", None), getattr(_local, "path", ()))
+    _local.trace, _local.path = trace, ()
+    profiler = cProfile.Profile() if out_file else None
+    if profiler is not None:
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # z. B. paralleles --profile im Gateway-Server: nur ein Profiler pro Prozess
+            print(f"[WARN] cProfile nicht gestartet: {e}", file=stream)
+            profiler = None
+    try:
+        yield trace
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        trace.wall = time.perf_counter() - trace.started
+        _local.trace, _local.path = saved
+        print("\n" + trace.report(), file=stream)
+        if profiler is not None:
+            profiler.dump_stats(out_file)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(PSTATS_TOP)
+            print(summary.getvalue(), file=stream)
+            print(f"cProfile-Daten geschrieben: {out_file}", file=stream)
@@ -2,9 +2,9 @@ import subprocess
 import os
 import signal
 import sys
-from datetime import datetime
 
-AUDIT_LOG = "audit.log"
+import db_logger
+
 LOKI_DIR = os.path.join(os.path.dirname(__file__), "Loki")
 LOKI_CMD = [os.path.join(LOKI_DIR, "loki-windows-amd64.exe"), "--config.file=" + os.path.join(LOKI_DIR, "loki-config.yaml")]
 PROMTAIL_CMD = [os.path.join(LOKI_DIR, "promtail-windows-amd64.exe"), "--config.file=" + os.path.join(LOKI_DIR, "promtail-config.yaml")]
@@ -12,12 +12,6 @@ PROMTAIL_CMD = [os.path.join(LOKI_DIR, "promtail-windows-amd64.exe"), "--config.
 loki_proc = None
 promtail_proc = None
 
-def log_audit(action, pid):
-    now = datetime.now().isoformat(timespec="seconds")
-    line = f"{now} [MONITOR] [PID:{pid}] {action}"
-    with open(AUDIT_LOG, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
-
 def start_monitoring():
     global loki_proc, promtail_proc
     if loki_proc is None:
@@ -27,7 +21,7 @@ def start_monitoring():
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL
         )
-        log_audit("LOKI STARTED", loki_proc.pid)
+        db_logger.log_audit("LOKI STARTED", "MONITOR", pid=loki_proc.pid)
     if promtail_proc is None:
         promtail_proc = subprocess.Popen(
             PROMTAIL_CMD,
@@ -35,17 +29,17 @@ def start_monitoring():
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL
         )
-        log_audit("PROMTAIL STARTED", promtail_proc.pid)
+        db_logger.log_audit("PROMTAIL STARTED", "MONITOR", pid=promtail_proc.pid)
 
 def stop_monitoring():
     global loki_proc, promtail_proc
     if loki_proc:
         loki_proc.terminate()
-        log_audit("LOKI STOPPED", loki_proc.pid)
+        db_logger.log_audit("LOKI STOPPED", "MONITOR", pid=loki_proc.pid)
         loki_proc = None
     if promtail_proc:
         promtail_proc.terminate()
-        log_audit("PROMTAIL STOPPED", promtail_proc.pid)
+        db_logger.log_audit("PROMTAIL STOPPED", "MONITOR", pid=promtail_proc.pid)
         promtail_proc = None
 
 def cleanup_on_exit(signum=None, frame=None):
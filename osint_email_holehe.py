@@ -4,6 +4,8 @@ import json
 import sys
 import os
 import re
+import db_gateway_client
+import db_logger
 
 def run_holehe(email):
     """Führt Holehe mit --only-used für die gegebene E-Mail aus und gibt stdout zurück."""
@@ -44,9 +46,17 @@ def osint_email_holehe(email):
     return metadata
 
 def send_to_gateway(email, metadata, gateway_path="db_faiss_gateway.py", collection="emails"):
-    """Überträgt das Ergebnis per CLI an den Gateway."""
+    """Überträgt das Ergebnis an den Gateway (Server falls aktiv, sonst per CLI-Subprozess)."""
     # Übergib metadata als JSON-String
     meta_str = json.dumps(metadata, ensure_ascii=False)
+    response = db_gateway_client.send_command("add", {
+        "collection": collection,
+        "text": email,
+        "metadata": meta_str,
+        "entity_type": "HOLEHE"
+    })
+    if response is not None:
+        return response.get("output", ""), response.get("error") or ""
     cmd = [
         sys.executable, gateway_path,
         "add",
@@ -59,14 +69,7 @@ def send_to_gateway(email, metadata, gateway_path="db_faiss_gateway.py", collect
     result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8")
     return result.stdout, result.stderr
 
-def log_audit(msg, level="OSINT_EMAIL_HOLEHE"):
-    from datetime import datetime
-    import os
-    now = datetime.now().isoformat(timespec="seconds")
-    pid = os.getpid()
-    line = f"{now} [{level}] [PID:{pid}] {msg}"
-    with open("audit.log", "a", encoding="utf-8") as f:
-        f.write(line + "\n")
+log_audit = db_logger.audit_logger("OSINT_EMAIL_HOLEHE")
 
 def process_email_file(filepath, gateway_path="db_faiss_gateway.py", collection="emails"):
     """
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.hash_embedder import HashEmbedder
+
+DIM = 32
+
+
+@pytest.fixture(scope="session")
+def broker(tmp_path_factory):
+    """
+    Isolierte Broker-Umgebung: Registry, Indizes und Logs im Temp-Verzeichnis,
+    deterministischer HashEmbedder statt SentenceTransformer. Die Module lesen
+    BROKER_* beim Import, daher Umgebung setzen bevor sie geladen werden.
+    """
+    workdir = str(tmp_path_factory.mktemp("broker"))
+    os.environ.update({
+        "BROKER_INDEX_DIR": workdir,
+        "BROKER_EMBED_CACHE": "",
+        "BROKER_AUDIT_LOG": os.path.join(workdir, "audit.log"),
+        "BROKER_EVENT_LOG": os.path.join(workdir, "shadowbroker_gateway.log"),
+        "BROKER_LOG_CONSOLE": "0",
+    })
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    import db_embedding
+    db_embedding.configure(model_name=f"hash-{DIM}", model=HashEmbedder(DIM), cache=None)
+    import db_id_manager
+    db_id_manager.REGISTRY_DB = os.path.join(workdir, "broker_registry.db")
+    db_id_manager.setup_registry()
+    yield workdir
+    db_id_manager.close_connection()
+    os.chdir(cwd)
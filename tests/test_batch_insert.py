@@ -0,0 +1,43 @@
+import pytest
+
+from conftest import DIM
+
+
+class _CountingEmbedder:
+    def __init__(self):
+        from benchmarks.hash_embedder import HashEmbedder
+        self.inner = HashEmbedder(DIM)
+        self.calls = 0
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+    def encode(self, texts, **kwargs):
+        self.calls += 1
+        return self.inner.encode(texts, **kwargs)
+
+
+def _index(name):
+    import db_collection_management
+    import db_index_manager
+    db_collection_management.create_collection(name, DIM)
+    return db_index_manager.get_manager().get(name)
+
+
+def test_batch_insert_empty_input_skips_encode(broker):
+    import db_batch_insert
+    model = _CountingEmbedder()
+    assert db_batch_insert.batch_insert(_index("bi_empty"), [], "bi_empty", embedding_model=model) == ([], [])
+    assert model.calls == 0
+
+
+def test_batch_insert_rejects_short_metadatas(broker):
+    import db_batch_insert
+    import db_id_manager
+    index = _index("bi_meta")
+    model = _CountingEmbedder()
+    with pytest.raises(ValueError):
+        db_batch_insert.batch_insert(index, ["a", "b", "c"], "bi_meta", metadatas=[{}, {}], embedding_model=model)
+    assert model.calls == 0
+    assert index.ntotal == 0
+    assert db_id_manager.count_by_collection("bi_meta") == 0
@@ -0,0 +1,35 @@
+def _add(collection, n):
+    import db_id_manager
+    for i in range(n):
+        db_id_manager.add_entry(f"{collection}_{i}", collection, "NOTE", f"{collection} eintrag {i}")
+
+
+def _changes(collection):
+    import db_id_manager
+    return db_id_manager.changes_since(collection, 0)
+
+
+def test_prune_change_log_covers_unwatched_collections(broker):
+    import db_id_manager
+    _add("watched", 3)
+    db_id_manager.set_checkpoint("watched", db_id_manager.current_change_seq())
+    _add("unwatched", 4)
+    db_id_manager.add_entry("watched_new", "watched", "NOTE", "nach dem checkpoint")
+
+    db_id_manager.prune_change_log()
+    assert _changes("unwatched") == []
+    assert [row[1] for row in _changes("watched")] == ["watched_new"]
+    db_id_manager.delete_checkpoint("watched")
+
+
+def test_prune_change_log_caps_rows_and_drops_stale_checkpoints(broker):
+    import db_id_manager
+    _add("capped", 1)
+    db_id_manager.set_checkpoint("capped", db_id_manager.current_change_seq())
+    for i in range(5):
+        db_id_manager.add_entry(f"capped_late_{i}", "capped", "NOTE", f"spät {i}")
+
+    db_id_manager.prune_change_log(max_rows=2)
+    assert [row[1] for row in _changes("capped")] == ["capped_late_3", "capped_late_4"]
+    # Änderungen seit dem Checkpoint fehlen jetzt: der nächste Check muss vollständig laufen
+    assert db_id_manager.get_checkpoint("capped") is None
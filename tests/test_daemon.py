@@ -0,0 +1,56 @@
+import numpy as np
+
+
+def _vector(collection, vektor_index):
+    import db_faiss_index
+    import db_index_manager
+    index = db_index_manager.get_manager().get(collection, read_only=True)
+    with db_faiss_index.reconstruct_access(index):
+        return db_faiss_index.reconstruct_vectors(index, [vektor_index])[0][0]
+
+
+def _replace_text_without_journal(doc_id, text):
+    # Abbruch nach dem Registry-Commit von update_document, vor dem Journal-Datensatz
+    import db_id_manager
+    row = db_id_manager.get_by_id(doc_id)
+    db_id_manager.add_entry(row[0], row[1], row[2], text, metadata=row[4], source=row[6],
+                            import_batch="update", vektor_index=row[8])
+    return row[8]
+
+
+def _check(collection):
+    import broker_daemon
+    import db_index_manager
+    broker_daemon.check_collection(collection, db_index_manager.index_path(collection))
+
+
+def _setup(collection):
+    import db_batch_insert
+    import db_collection_management
+    import db_id_manager
+    import db_index_manager
+    from conftest import DIM
+    db_collection_management.create_collection(collection, DIM)
+    index = db_index_manager.get_manager().get(collection)
+    db_batch_insert.batch_insert(index, ["alter text eins", "alter text zwei", "alter text drei"], collection,
+                                 entity_type="NOTE", index_file=db_index_manager.index_path(collection))
+    return [doc_id for doc_id, _ in db_id_manager.list_vektor_ids(collection)]
+
+
+def test_daemon_reembeds_replaced_row_after_crash_before_journal(broker):
+    import db_embedding
+    ids = _setup("crash_update")
+    _check("crash_update")  # Checkpoint setzen
+    vid = _replace_text_without_journal(ids[0], "ganz neuer inhalt")
+    _check("crash_update")
+    expected = db_embedding.get_engine().encode(["ganz neuer inhalt"])[0]
+    assert np.allclose(_vector("crash_update", vid), expected, atol=1e-6)
+
+
+def test_daemon_first_check_reembeds_replaced_row(broker):
+    import db_embedding
+    ids = _setup("crash_first")
+    vid = _replace_text_without_journal(ids[1], "anderer inhalt")
+    _check("crash_first")  # ohne Checkpoint
+    expected = db_embedding.get_engine().encode(["anderer inhalt"])[0]
+    assert np.allclose(_vector("crash_first", vid), expected, atol=1e-6)
@@ -0,0 +1,95 @@
+import json
+
+from conftest import DIM
+
+
+def _ivf_type(index):
+    import faiss
+    return type(faiss.downcast_index(faiss.try_extract_index_ivf(index))).__name__
+
+
+def _create_collection(name, spec, n=64):
+    import db_batch_insert
+    import db_collection_management
+    import db_index_manager
+    db_collection_management.create_collection(name, DIM, index_spec=spec)
+    index = db_index_manager.get_manager().get(name)
+    texts = [f"eintrag {i} konto zugang hinweis {i * 7}" for i in range(n)]
+    db_batch_insert.batch_insert(index, texts, name, index_file=db_index_manager.index_path(name))
+    db_collection_management.train_collection(name, DIM)
+
+
+def test_export_ivfpq_vectors_not_exact(broker, tmp_path):
+    import db_export_import
+    import db_faiss_index
+    import db_index_manager
+    _create_collection("ivfpq", {"type": "IVFPQ", "nlist": 4, "m": 4, "nbits": 4})
+    index = db_index_manager.get_manager().get("ivfpq", read_only=True)
+    assert _ivf_type(index) == "IndexIVFPQ"
+    assert db_faiss_index.vectors_exact(index) is False
+
+    manifest = db_export_import.export_collection("ivfpq", out=str(tmp_path / "ivfpq"))
+    assert manifest["vectors_exact"] is False
+    with open(tmp_path / "ivfpq.manifest.json", encoding="utf-8") as f:
+        assert json.load(f)["vectors_exact"] is False
+
+
+def test_export_flat_vectors_exact(broker, tmp_path):
+    import db_export_import
+    _create_collection("flat", {"type": "Flat"})
+    manifest = db_export_import.export_collection("flat", out=str(tmp_path / "flat"))
+    assert manifest["vectors_exact"] is True
+
+
+def _seeding_engine(tmp_path):
+    import db_embedding
+    import db_embedding_cache
+    from benchmarks.hash_embedder import HashEmbedder
+    cache = db_embedding_cache.EmbeddingCache(str(tmp_path / "embed_cache.db"))
+    return db_embedding.EmbeddingEngine(model_name=db_embedding.get_engine().model_name, model=HashEmbedder(DIM), cache=cache)
+
+
+def test_import_seeds_cache_only_from_exact_index_types(broker, tmp_path):
+    import db_export_import
+    _create_collection("seed_flat", {"type": "Flat"})
+    _create_collection("seed_pq", {"type": "IVFPQ", "nlist": 4, "m": 4, "nbits": 4})
+    db_export_import.export_collection("seed_flat", out=str(tmp_path / "seed_flat"))
+    db_export_import.export_collection("seed_pq", out=str(tmp_path / "seed_pq"))
+    # Manifest einer älteren Version, die IVFPQ als exakt markiert hat
+    manifest_file = tmp_path / "seed_pq.manifest.json"
+    manifest = json.loads(manifest_file.read_text(encoding="utf-8"))
+    manifest["vectors_exact"] = True
+    manifest_file.write_text(json.dumps(manifest), encoding="utf-8")
+
+    engine = _seeding_engine(tmp_path)
+    flat = db_export_import.import_collection(str(tmp_path / "seed_flat"), "seed_flat_copy", embedding_model=engine)
+    pq = db_export_import.import_collection(str(tmp_path / "seed_pq"), "seed_pq_copy", embedding_model=engine)
+    assert flat["cached"] == flat["imported"] > 0
+    assert pq["imported"] > 0 and pq["cached"] == 0
+
+
+def test_import_from_other_model_reembeds(broker, tmp_path):
+    import numpy as np
+    import db_embedding
+    import db_export_import
+    import db_faiss_index
+    import db_id_manager
+    import db_index_manager
+    _create_collection("other_model", {"type": "Flat"}, n=8)
+    db_export_import.export_collection("other_model", out=str(tmp_path / "other_model"))
+    manifest_file = tmp_path / "other_model.manifest.json"
+    manifest = json.loads(manifest_file.read_text(encoding="utf-8"))
+    manifest["embedding_model"] = "anderes-model"
+    manifest_file.write_text(json.dumps(manifest), encoding="utf-8")
+    # Vektoren des "anderen" Models: dürfen nicht im Index landen
+    npy_file = tmp_path / manifest["files"]["vectors"]
+    np.save(npy_file, -np.load(npy_file))
+
+    stats = db_export_import.import_collection(str(tmp_path / "other_model"), "other_model_copy")
+    assert stats["embedded"] == stats["imported"] == 8
+    rows = db_id_manager.get_by_ids([doc_id for doc_id, _ in db_id_manager.list_vektor_ids("other_model_copy")])
+    texts = [row[3] for row in rows.values()]
+    index = db_index_manager.get_manager().get("other_model_copy", read_only=True)
+    with db_faiss_index.reconstruct_access(index):
+        vectors, _ = db_faiss_index.reconstruct_vectors(index, [row[8] for row in rows.values()])
+    assert np.allclose(vectors, db_embedding.get_engine().encode(texts), atol=1e-6)
@@ -0,0 +1,88 @@
+import argparse
+
+from conftest import DIM
+
+
+def _hnsw_collection(name, texts):
+    import db_batch_insert
+    import db_collection_management
+    import db_faiss_gateway
+    import db_id_manager
+    db_collection_management.create_collection(name, DIM, index_spec={"type": "HNSWFlat"})
+    index, index_file = db_faiss_gateway.load_or_create_faiss_index(name, DIM)
+    db_batch_insert.batch_insert(index, texts, name, entity_type="NOTE", index_file=index_file)
+    db_faiss_gateway.journal_written(index, index_file, name)
+    rows = db_id_manager.get_by_ids([doc_id for doc_id, _ in db_id_manager.list_vektor_ids(name)])
+    return {row[3]: row[0] for row in rows.values()}
+
+
+def _query(collection, text, n):
+    import db_embedding
+    import db_faiss_gateway
+    args = argparse.Namespace(collection=collection, query=text, n=n)
+    return db_faiss_gateway.query_collection(args, db_embedding.get_engine())
+
+
+def test_hnsw_orphans_do_not_take_top_k_slots(broker):
+    import db_embedding
+    import db_faiss_gateway
+    texts = [f"notiz zu treffen {i}" for i in range(8)]
+    ids = _hnsw_collection("hnsw_orphans", texts)
+    db_faiss_gateway.delete_document(argparse.Namespace(id=ids[texts[0]], collection="hnsw_orphans"))
+    db_faiss_gateway.update_document(argparse.Namespace(id=ids[texts[1]], collection="hnsw_orphans", text="etwas anderes",
+                                                        metadata=None, entity_type=None), db_embedding.get_engine())
+
+    hits = _query("hnsw_orphans", texts[0], 7)
+    assert len(hits) == 7
+    assert all(hit["row"] is not None for hit in hits)
+    assert texts[0] not in [hit["row"][3] for hit in hits]
+
+
+def test_hnsw_check_rebuilds_orphans_away(broker):
+    import broker_daemon
+    import db_faiss_gateway
+    import db_healthchecks
+    import db_index_manager
+    texts = [f"bericht nummer {i}" for i in range(6)]
+    ids = _hnsw_collection("hnsw_repair", texts)
+    index_file = db_index_manager.index_path("hnsw_repair")
+    broker_daemon.check_collection("hnsw_repair", index_file)
+    for text in texts[:2]:
+        db_faiss_gateway.delete_document(argparse.Namespace(id=ids[text], collection="hnsw_repair"))
+    assert db_healthchecks.faiss_healthcheck(index_file)[1] == 6
+
+    broker_daemon.check_collection("hnsw_repair", index_file)
+    assert db_healthchecks.faiss_healthcheck(index_file)[1] == db_healthchecks.registry_healthcheck("hnsw_repair")[1] == 4
+
+
+def test_delete_refuses_id_from_other_collection(broker, capsys):
+    import db_faiss_gateway
+    import db_id_manager
+    ids = _hnsw_collection("delete_owner", ["eintrag a", "eintrag b"])
+    db_faiss_gateway.delete_document(argparse.Namespace(id=ids["eintrag a"], collection="andere_collection"))
+    assert "gehört zu Collection 'delete_owner'" in capsys.readouterr().out
+    assert db_id_manager.get_by_id(ids["eintrag a"]) is not None
+
+
+def test_idle_compaction_lets_queries_use_mmap(broker, monkeypatch):
+    import sys
+    import db_collection_management
+    import db_embedding
+    import db_gateway_server
+    import db_index_manager
+    import db_index_store
+    monkeypatch.setattr(sys, "stdout", sys.stdout)  # GatewayServer ersetzt stdout
+    db_collection_management.create_collection("idle_compact", DIM)
+    server = db_gateway_server.GatewayServer(db_embedding.get_engine(), idle_compact_seconds=0)
+    ok, _, error = server.execute({"command": "add", "collection": "idle_compact", "text": "neuer eintrag",
+                                   "metadata": None, "entity_type": None})
+    assert ok, error
+    index_file = db_index_manager.index_path("idle_compact")
+    assert db_index_store.journal_size(index_file) > 0
+
+    assert server.compact_idle() == ["idle_compact"]
+    assert db_index_store.journal_size(index_file) == 0
+    manager = db_index_manager.get_manager()
+    assert manager.get("idle_compact", read_only=True).ntotal == 1
+    entry = [e for e in manager.stats() if e["index_file"].endswith("idle_compact.index")][0]
+    assert entry["read_only"]
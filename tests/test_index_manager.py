@@ -0,0 +1,35 @@
+import faiss
+import numpy as np
+import pytest
+
+from conftest import DIM
+
+
+def _write_flat(path, n=200):
+    import db_faiss_index
+    index = db_faiss_index.create_index(DIM)
+    db_faiss_index.add_vectors(index, np.random.default_rng(0).random((n, DIM), dtype="float32"), np.arange(n))
+    faiss.write_index(index, str(path))
+
+
+def test_flat_without_mmap_ifc_counts_against_budget(broker, tmp_path, monkeypatch):
+    import db_index_manager
+    import db_index_store
+    # FAISS < 1.12: nur IO_FLAG_MMAP, Flat-Codes werden trotzdem komplett gelesen
+    monkeypatch.setattr(db_index_store, "MMAP_FLAG_VARIANTS", (faiss.IO_FLAG_MMAP | db_index_store._READ_ONLY,))
+    index_file = tmp_path / "budget_flat.index"
+    _write_flat(index_file)
+    manager = db_index_manager.IndexManager(index_dir=str(tmp_path))
+    index = manager.get("budget_flat", read_only=True)
+    assert index.ntotal == 200
+    assert manager.resident_bytes() == index_file.stat().st_size
+
+
+@pytest.mark.skipif(not hasattr(faiss, "IO_FLAG_MMAP_IFC"), reason="FAISS ohne mmap für Flat-Codes")
+def test_mmapped_flat_codes_are_not_charged(broker, tmp_path):
+    import db_index_manager
+    index_file = tmp_path / "budget_mmap.index"
+    _write_flat(index_file)
+    manager = db_index_manager.IndexManager(index_dir=str(tmp_path))
+    manager.get("budget_mmap", read_only=True)
+    assert manager.resident_bytes() <= index_file.stat().st_size - 200 * DIM * 4
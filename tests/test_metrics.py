@@ -0,0 +1,16 @@
+def _count(metric, collection):
+    return metric._values.get((("collection", collection),), 0)
+
+
+def test_replaced_registry_rows_count_as_updates(broker):
+    import db_id_manager
+    import db_metrics
+    db_id_manager.add_entry("metric_1", "metrics", "NOTE", "erster eintrag")
+    db_id_manager.add_entry("metric_1", "metrics", "NOTE", "erster eintrag, geändert")
+    db_id_manager.add_entries([
+        {"id": "metric_1", "collection": "metrics", "entity_type": "NOTE", "primary_value": "erneuter import"},
+        {"id": "metric_2", "collection": "metrics", "entity_type": "NOTE", "primary_value": "zweiter eintrag"},
+        {"id": "metric_2", "collection": "metrics", "entity_type": "NOTE", "primary_value": "doppelt im batch"},
+    ])
+    assert _count(db_metrics.DOCS_ADDED, "metrics") == 2
+    assert _count(db_metrics.DOCS_UPDATED, "metrics") == 3
@@ -0,0 +1,37 @@
+import numpy as np
+
+from conftest import DIM
+
+
+def _ivf_collection(name):
+    import db_batch_insert
+    import db_collection_management
+    import db_index_manager
+    db_collection_management.create_collection(name, DIM, index_spec={"type": "IVFFlat", "nlist": 8, "nprobe": 1})
+    index = db_index_manager.get_manager().get(name)
+    index_file = db_index_manager.index_path(name)
+    db_batch_insert.batch_insert(index, [f"hintergrund eintrag {i}" for i in range(200)], name,
+                                 import_batch="rest", index_file=index_file)
+    db_batch_insert.batch_insert(index, [f"gesuchter bericht {i}" for i in range(10)], name,
+                                 import_batch="klein", index_file=index_file)
+    db_collection_management.train_collection(name, DIM)
+    return db_index_manager.get_manager().get(name, read_only=True)
+
+
+def test_small_ivfflat_subset_uses_exact_search(broker, monkeypatch):
+    import db_embedding
+    import db_faiss_index
+    import db_id_manager
+    import db_search_filter
+    index = _ivf_collection("filter_ivf")
+    ids = db_search_filter.filter_ids("filter_ivf", {"import_batch": "klein"})
+    assert len(ids) == 10
+    monkeypatch.setattr(db_faiss_index, "search_params", lambda *a, **kw: (_ for _ in ()).throw(AssertionError("Selector-Suche")))
+
+    query = db_embedding.get_engine().encode(["bericht"]).astype("float32")
+    D, I = db_search_filter.search(index, query, 5, "filter_ivf", {"import_batch": "klein"})
+    rows = db_id_manager.get_by_vektor_indices(ids.tolist(), collection="filter_ivf")
+    texts = [rows[int(vid)][3] for vid in ids]
+    expected = ((db_embedding.get_engine().encode(texts) - query) ** 2).sum(axis=1)
+    assert set(I[0].tolist()) <= set(ids.tolist())
+    assert np.allclose(D[0], np.sort(expected)[:5], atol=1e-5)